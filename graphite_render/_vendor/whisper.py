@@ -25,7 +25,9 @@
 #		Archive = Point+
 #			Point = timestamp,value
 
+import io
 import itertools
+import mmap
 import operator
 import os
 import struct
@@ -77,7 +79,9 @@ if CAN_FALLOCATE:
 LOCK = False
 CACHE_HEADERS = False
 AUTOFLUSH = False
+MMAP_READS = True
 __headerCache = {}
+__seriesStructCache = {}
 
 longFormat = "!L"
 longSize = struct.calcsize(longFormat)
@@ -752,8 +756,24 @@ Returns None if no data can be returned
     if fh:
       fh.close()
 
-def file_fetch(fh, fromTime, untilTime, now = None):
-  header = __readHeader(fh)
+def file_fetch(fh, fromTime, untilTime, now = None, header = None):
+  if header is None:
+    header = __readHeader(fh)
+  selected = selectArchive(header, fromTime, untilTime, now)
+  if selected is None:
+    return None
+  archive, fromTime, untilTime = selected
+  return __archive_fetch(fh, archive, fromTime, untilTime)
+
+def selectArchive(header, fromTime, untilTime, now = None):
+  """selectArchive(header, fromTime, untilTime, now=None)
+
+Returns a tuple of (archive, fromTime, untilTime) where archive is the
+archive fetch() reads for this time range and fromTime/untilTime the range
+adjusted to the data it holds
+
+Returns None if no data can be returned
+"""
   if now is None:
     now = int( time.time() )
   if untilTime is None:
@@ -786,7 +806,7 @@ def file_fetch(fh, fromTime, untilTime, now = None):
     if archive['retention'] >= diff:
       break
 
-  return __archive_fetch(fh, archive, fromTime, untilTime)
+  return (archive, fromTime, untilTime)
 
 def __archive_fetch(fh, archive, fromTime, untilTime):
   """
@@ -823,6 +843,36 @@ archive on a read and request data older than the archive's retention
   untilOffset = archive['offset'] + (byteDistance % archive['size'])
 
   #Read all the points in the interval
+  if MMAP_READS and isinstance(fh, io.BufferedReader):
+    unpackedSeries = __mmap_read_points(fh, archive, fromOffset, untilOffset)
+  else:
+    unpackedSeries = __read_points(fh, archive, fromOffset, untilOffset)
+
+  #Only keep the values whose timestamp is the one expected at their
+  #position, other slots hold stale data from a previous archive cycle
+  step = archive['secondsPerPoint']
+  timestamps = unpackedSeries[0::2]
+  values = unpackedSeries[1::2]
+  expected = tuple(range(fromInterval, fromInterval + len(values) * step, step))
+  if timestamps == expected:
+    valueList = list(values)
+  else:
+    valueList = [v if t == e else None for t, v, e in zip(timestamps, values, expected)]
+
+  timeInfo = (fromInterval,untilInterval,step)
+  return (timeInfo,valueList)
+
+def __series_struct(points):
+  """Returns the (cached) struct unpacking ``points`` consecutive points"""
+  seriesStruct = __seriesStructCache.get(points)
+  if seriesStruct is None:
+    if len(__seriesStructCache) >= 128:
+      __seriesStructCache.clear()
+    byteOrder,pointTypes = pointFormat[0],pointFormat[1:]
+    seriesStruct = __seriesStructCache[points] = struct.Struct(byteOrder + (pointTypes * points))
+  return seriesStruct
+
+def __read_points(fh, archive, fromOffset, untilOffset):
   fh.seek(fromOffset)
   if fromOffset < untilOffset: #If we don't wrap around the archive
     seriesString = fh.read(untilOffset - fromOffset)
@@ -832,26 +882,25 @@ archive on a read and request data older than the archive's retention
     fh.seek(archive['offset'])
     seriesString += fh.read(untilOffset - archive['offset'])
 
-  #Now we unpack the series data we just read (anything faster than unpack?)
-  byteOrder,pointTypes = pointFormat[0],pointFormat[1:]
   points = len(seriesString) // pointSize
-  seriesFormat = byteOrder + (pointTypes * points)
-  unpackedSeries = struct.unpack(seriesFormat, seriesString)
-
-  #And finally we construct a list of values (optimize this!)
-  valueList = [None] * points #pre-allocate entire list for speed
-  currentInterval = fromInterval
-  step = archive['secondsPerPoint']
-
-  for i in range(0,len(unpackedSeries),2):
-    pointTime = unpackedSeries[i]
-    if pointTime == currentInterval:
-      pointValue = unpackedSeries[i+1]
-      valueList[i//2] = pointValue #in-place reassignment is faster than append()
-    currentInterval += step
+  return __series_struct(points).unpack(seriesString)
 
-  timeInfo = (fromInterval,untilInterval,step)
-  return (timeInfo,valueList)
+def __mmap_read_points(fh, archive, fromOffset, untilOffset):
+  """Same as __read_points, unpacking the points straight from a read-only
+  memory map of the file instead of copying them into an intermediate
+  string"""
+  mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    if fromOffset < untilOffset: #If we don't wrap around the archive
+      points = (untilOffset - fromOffset) // pointSize
+      return __series_struct(points).unpack_from(mapped, fromOffset)
+    archiveEnd = archive['offset'] + archive['size']
+    points = (archiveEnd - fromOffset) // pointSize
+    unpackedSeries = __series_struct(points).unpack_from(mapped, fromOffset)
+    points = (untilOffset - archive['offset']) // pointSize
+    return unpackedSeries + __series_struct(points).unpack_from(mapped, archive['offset'])
+  finally:
+    mapped.close()
 
 def merge(path_from, path_to):
   """ Merges the data from one whisper file into another. Each file must have
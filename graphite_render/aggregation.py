@@ -0,0 +1,83 @@
+"""
+Cross-series aggregation kernels of the combining functions (sumSeries,
+averageSeries...).
+
+Like ``zip_longest(*seriesList)``, the kernels pad shorter series with None.
+None values are ignored and points without any value aggregate to None.
+"""
+import math
+from itertools import zip_longest
+
+
+def rows(seriesList):
+    """
+    Yields the list of the non-None values of the series at each point.
+    """
+    for row in zip_longest(*seriesList):
+        yield [v for v in row if v is not None]
+
+
+def row_sums(seriesList):
+    return [sum(values) if values else None for values in rows(seriesList)]
+
+
+def row_averages(seriesList):
+    return [float(sum(values)) / len(values) if values else None
+            for values in rows(seriesList)]
+
+
+def row_stddevs(seriesList):
+    stddevs = []
+    for values in rows(seriesList):
+        if not values:
+            stddevs.append(None)
+            continue
+        average = float(sum(values)) / len(values)
+        squares = sum([(v - average) * (v - average) for v in values])
+        stddevs.append(math.sqrt(squares / len(values)))
+    return stddevs
+
+
+def column_mins(seriesList):
+    """
+    Same as ``[min(values) for values in rows(seriesList)]``, folding the
+    series one after the other into the minimums: comparisons are all there
+    is to it, so going through the values of each series in order beats
+    transposing them.
+    """
+    return _fold_columns(seriesList, _min_column)
+
+
+def column_maxs(seriesList):
+    """Same as :func:`column_mins`, with maximums."""
+    return _fold_columns(seriesList, _max_column)
+
+
+def column_ranges(seriesList):
+    return [None if low is None else float(high) - float(low)
+            for high, low in zip(column_maxs(seriesList),
+                                 column_mins(seriesList))]
+
+
+def _fold_columns(seriesList, column):
+    aggregates = []
+    for series in seriesList:
+        # Iterating consolidates the series, its length is the raw one.
+        values = list(series)
+        if len(aggregates) < len(values):
+            aggregates.extend([None] * (len(values) - len(aggregates)))
+        folded = column(aggregates, values)
+        folded.extend(aggregates[len(values):])
+        aggregates = folded
+    return aggregates
+
+
+def _min_column(mins, values):
+    # Equal values keep the first one, like min().
+    return [m if v is None or (m is not None and m <= v) else v
+            for m, v in zip(mins, values)]
+
+
+def _max_column(maxs, values):
+    return [m if v is None or (m is not None and m >= v) else v
+            for m, v in zip(maxs, values)]
@@ -0,0 +1,120 @@
+"""
+Asyncio flavour of the storage API.
+
+Finders and readers can implement ``find_nodes()`` as a coroutine (or an
+asynchronous generator) and ``fetch()`` as a coroutine. Synchronous ones are
+called in the thread pool of the event loop, so that both kinds can be
+awaited alike.
+"""
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Thread
+
+from structlog import get_logger
+
+from .readers import covers, MultiReader
+from .storage import FindQuery
+
+logger = get_logger()
+
+
+class EventLoop(object):
+    """
+    Event loop running in a background thread, shared by the request
+    threads: they submit coroutines with :meth:`run` and wait for their
+    results while the loop overlaps the storage calls of every request.
+
+    Synchronous finders and readers are called in a pool of ``max_workers``
+    threads.
+    """
+    def __init__(self, max_workers):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='graphite-render-async')
+        self.loop.set_default_executor(self.executor)
+        self.thread = Thread(target=self.loop.run_forever,
+                             name='graphite-render-event-loop', daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        """Runs a coroutine on the loop and returns its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait=True)
+
+
+async def call(func, *args):
+    """Awaits ``func(*args)``, in a thread when it's synchronous."""
+    if inspect.iscoroutinefunction(func):
+        return await func(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args))
+
+
+async def find_nodes(finder, query):
+    """Returns the list of nodes a finder matches for a query."""
+    if inspect.isasyncgenfunction(finder.find_nodes):
+        return [node async for node in finder.find_nodes(query)]
+    if inspect.iscoroutinefunction(finder.find_nodes):
+        return list(await finder.find_nodes(query))
+    return await call(lambda: list(finder.find_nodes(query)))
+
+
+async def find(store, pattern, startTime=None, endTime=None):
+    """
+    Same as :meth:`Store.find`, querying the finders concurrently. Returns a
+    list of nodes.
+    """
+    query = FindQuery(pattern, startTime, endTime)
+    found = await asyncio.gather(*[find_nodes(finder, query)
+                                   for finder in store.finders])
+    matching_nodes = set()
+    for nodes in found:
+        matching_nodes.update(nodes)
+    return list(store.reduce(matching_nodes))
+
+
+async def fetch(node, startTime, endTime, now=None, requestContext=None):
+    """
+    Same as ``node.fetch()``. The nodes of a :class:`MultiReader` are
+    fetched concurrently.
+    """
+    reader = node.reader
+    if isinstance(reader, MultiReader):
+        return await fetch_multi_reader(reader, startTime, endTime, now,
+                                        requestContext)
+    if inspect.iscoroutinefunction(reader.fetch):
+        return await reader.fetch(startTime, endTime, now, requestContext)
+    return await call(node.fetch, startTime, endTime, now, requestContext)
+
+
+async def fetch_multi_reader(reader, startTime, endTime, now=None,
+                             requestContext=None):
+    async def fetch_node(node):
+        try:
+            return await fetch(node, startTime, endTime, now, requestContext)
+        except Exception:
+            logger.error("fetch error", exc_info=True)
+            return None
+
+    tasks = [asyncio.ensure_future(fetch_node(node)) for node in reader.nodes]
+    if reader.first_sufficient:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if result and covers(result, startTime, endTime):
+                for task in tasks:
+                    task.cancel()
+                return result
+    # In the order of the nodes, which decides the merge priority
+    results = [r for r in await asyncio.gather(*tasks) if r]
+    if not results:
+        raise Exception("All sub-fetches failed")
+    if len(results) == 1:
+        return results[0]
+    return reader.merge(*results)
@@ -11,8 +11,9 @@ from flask import Flask
 from structlog import get_logger
 from werkzeug.http import http_date
 
+from . import aio
 from .config import configure
-from .encoders import JSONEncoder
+from .encoders import iterencode_series, JSONEncoder
 from .render.attime import parseATTime
 from .render.datalib import fetchData
 from .render.glyph import GraphTypes
@@ -36,6 +37,24 @@ def jsonify(data, status=200, headers=None):
     return body, status, headers
 
 
+def stream_jsonify(series_data, status=200, headers=None):
+    """
+    Same as jsonify() for the series of /render, streaming the response
+    instead of encoding it at once.
+    """
+    if headers is None:
+        headers = {}
+
+    jsonp = RequestParams.get('jsonp', False)
+
+    if jsonp:
+        headers['Content-Type'] = 'text/javascript'
+    else:
+        headers['Content-Type'] = 'application/json'
+    return app.response_class(iterencode_series(series_data, jsonp),
+                              status=status, headers=headers)
+
+
 class Graphite(Flask):
     @property
     def store(self):
@@ -124,10 +143,13 @@ def metrics_find():
         return jsonify({'errors': errors}, status=400)
 
     query = RequestParams['query']
-    matches = sorted(
-        app.store.find(query, from_time, until_time),
-        key=lambda node: node.name
-    )
+    event_loop = app.config['GRAPHITE'].get('event_loop')
+    if event_loop is None:
+        nodes = app.store.find(query, from_time, until_time)
+    else:
+        nodes = event_loop.run(aio.find(app.store, query, from_time,
+                                        until_time))
+    matches = sorted(nodes, key=lambda node: node.name)
 
     base_path = query.rsplit('.', 1)[0] + '.' if '.' in query else ''
 
@@ -376,15 +398,16 @@ def render():
 
     # Gather all data to take advantage of backends with fetch_multi
     fdstart = time.time()
-    paths = []
+    targets = []
     for target in request_options['targets']:
         if request_options['graphType'] == 'pie':
             if ':' in target:
                 continue
         if target.strip():
-            paths += pathsFromTarget(context, target)
-    data_store = fetchData(context, paths)
-    logger.debug("fetched data", time=(time.time() - fdstart), paths=paths)
+            targets.append(target)
+    data_store = prefetchData(context, targets)
+    logger.debug("fetched data", time=(time.time() - fdstart),
+                 targets=targets)
 
     if request_options['graphType'] == 'pie':
         for target in request_options['targets']:
@@ -463,9 +486,14 @@ def render():
                     series_data.append({'target': series.name,
                                         'datapoints': datapoints})
 
-            response = jsonify(series_data, headers=headers)
-            if use_cache:
-                app.cache.add(request_key, response, cache_timeout)
+            # Streamed responses can't be cached
+            render_conf = app.config['GRAPHITE'].get('render') or {}
+            if render_conf.get('stream_json') and not use_cache:
+                response = stream_jsonify(series_data, headers=headers)
+            else:
+                response = jsonify(series_data, headers=headers)
+                if use_cache:
+                    app.cache.add(request_key, response, cache_timeout)
             logger.debug("rendered json", time=(time.time() - start),
                          targets=targets)
             return response
@@ -626,4 +654,5 @@ def doImageRender(graphClass, graphOptions):
     return imageData
 
 
-from .evaluator import evaluateTarget, pathsFromTarget  # noqa
+from .evaluator import (evaluateTarget, pathsFromTarget,  # noqa
+                        prefetchData)
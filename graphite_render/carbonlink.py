@@ -1,13 +1,17 @@
 import bisect
+import errno
+import os
 import pickle
 import random
+import selectors
 import socket
 import struct
 import time
 
+from collections import defaultdict
 from hashlib import md5
 from importlib import import_module
-from io import BytesIO
+from io import BufferedReader, BytesIO
 
 from structlog import get_logger
 
@@ -64,7 +68,9 @@ class SafeUnpickler(pickle.Unpickler):
 
     @classmethod
     def loads(cls, s):
-        obj = SafeUnpickler(BytesIO(s))
+        # The unpickler decodes a stream it can peek into in large blocks,
+        # as fast as pickle.loads(), instead of reading it opcode by opcode.
+        obj = SafeUnpickler(BufferedReader(BytesIO(s)))
         return obj.load()
 
 
@@ -134,8 +140,10 @@ class ConsistentHashRing(object):
 class CarbonLinkPool(object):
     def __init__(self, hosts, timeout=1, retry_delay=15,
                  carbon_prefix='carbon', replication_factor=1,
-                 hashing_keyfunc=lambda x: x, hashing_type='carbon_ch'):
+                 hashing_keyfunc=lambda x: x, hashing_type='carbon_ch',
+                 concurrent=False):
         self.carbon_prefix = carbon_prefix
+        self.concurrent = concurrent
         self.retry_delay = retry_delay
         self.hosts = []
         self.ports = {}
@@ -183,9 +191,13 @@ class CarbonLinkPool(object):
         return random.choice(available or nodes)
 
     def is_available(self, host):
+        """
+        Returns whether the host didn't fail in the last ``retry_delay``
+        seconds.
+        """
         now = time.time()
         last_fail = self.last_failure.get(host, 0)
-        return (now - last_fail) < self.retry_delay
+        return (now - last_fail) >= self.retry_delay
 
     def get_connection(self, host):
         # First try to take one out of the pool for this host
@@ -208,6 +220,33 @@ class CarbonLinkPool(object):
         connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         return connection
 
+    def start_connection(self, host):
+        """
+        Same as :meth:`get_connection`, but returns a non-blocking socket
+        whose connection may still be in progress, and whether it is.
+        """
+        try:
+            connection = self.connections[host].pop()
+        except KeyError:
+            pass
+        else:
+            connection.setblocking(False)
+            return connection, False
+
+        server, instance = host
+        logger.info("new carbonlink socket", host=str(host))
+        connection = socket.socket()
+        connection.setblocking(False)
+        try:
+            error = connection.connect_ex((server, int(self.ports[host])))
+            if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise OSError(error, os.strerror(error))
+        except Exception:
+            self.close_failed(host, connection)
+            raise
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return connection, error != 0
+
     def query(self, metric):
         if not self.hosts:
             return []
@@ -217,6 +256,52 @@ class CarbonLinkPool(object):
                      datapoints=len(results['datapoints']))
         return results['datapoints']
 
+    def query_bulk(self, metrics):
+        """
+        Returns the cached datapoints of many metrics as a dict, sending a
+        single request to each carbon instance.
+        """
+        if not self.hosts:
+            return dict((metric, []) for metric in metrics)
+        datapoints = {}
+        metrics_by_host = defaultdict(list)
+        for metric in metrics:
+            if metric.startswith(self.carbon_prefix):
+                datapoints[metric] = self.query(metric)
+            else:
+                metrics_by_host[self.select_host(metric)].append(metric)
+
+        requests = dict(
+            (host, [dict(type='cache-query-bulk', metrics=host_metrics)])
+            for host, host_metrics in metrics_by_host.items())
+        fallback_requests = {}
+        for host, results in self.send_requests_to_hosts(requests).items():
+            host_metrics = metrics_by_host[host]
+            if results is None:
+                datapoints.update((metric, []) for metric in host_metrics)
+            elif 'error' in results[0]:
+                # carbon-cache < 1.0 doesn't know about bulk queries:
+                # pipeline the queries of the metrics instead.
+                logger.debug("carbonlink bulk request unsupported",
+                             host=str(host), error=results[0]['error'])
+                fallback_requests[host] = [
+                    dict(type='cache-query', metric=metric)
+                    for metric in host_metrics]
+            else:
+                datapoints.update(results[0]['datapointsByMetric'])
+
+        fallback = self.send_requests_to_hosts(fallback_requests)
+        for host, results in fallback.items():
+            host_metrics = metrics_by_host[host]
+            if results is None:
+                results = [{'datapoints': []}] * len(host_metrics)
+            for metric, result in zip(host_metrics, results):
+                if 'error' in result:
+                    logger.info("carbonlink error", error=result['error'])
+                    raise CarbonLinkRequestError(result['error'])
+                datapoints[metric] = result['datapoints']
+        return datapoints
+
     def get_metadata(self, metric, key):
         request = dict(type='get-metadata', metric=metric, key=key)
         results = self.send_request(request)
@@ -234,63 +319,127 @@ class CarbonLinkPool(object):
 
     def send_request(self, request):
         metric = request['metric']
-        serialized_request = pickle.dumps(request, protocol=2)
-        len_prefix = struct.pack("!L", len(serialized_request))
-        request_packet = len_prefix + serialized_request
-        result = {}
-        result.setdefault('datapoints', [])
-
         if metric.startswith(self.carbon_prefix):
             return self.send_request_to_all(request)
 
         host = self.select_host(metric)
-        conn = self.get_connection(host)
         logger.debug("carbonlink request", metric=metric, host=str(host))
-        try:
-            conn.sendall(request_packet)
-            result = self.recv_response(conn)
-        except Exception:
-            self.last_failure[host] = time.time()
-            logger.info("carbonlink exception", exc_info=True, host=str(host))
-        else:
-            self.connections[host].add(conn)
-            if 'error' in result:
-                logger.info("carbonlink error", error=result['error'])
-                raise CarbonLinkRequestError(result['error'])
-            logger.debug("carbonlink finished receiving",
-                         metric=metric, host=host)
+        results = self.send_requests(host, [request])
+        if results is None:
+            return {'datapoints': []}
+        result = results[0]
+        if 'error' in result:
+            logger.info("carbonlink error", error=result['error'])
+            raise CarbonLinkRequestError(result['error'])
+        logger.debug("carbonlink finished receiving",
+                     metric=metric, host=host)
         return result
 
     def send_request_to_all(self, request):
         metric = request['metric']
-        serialized_request = pickle.dumps(request, protocol=2)
-        len_prefix = struct.pack("!L", len(serialized_request))
-        request_packet = len_prefix + serialized_request
         results = {}
         results.setdefault('datapoints', [])
 
+        logger.debug("carbonlink request", metric=metric,
+                     hosts=len(self.hosts))
+        responses = self.send_requests_to_hosts(
+            dict((host, [request]) for host in self.hosts))
         for host in self.hosts:
-            conn = self.get_connection(host)
-            logger.debug("carbonlink request", metric=metric, host=str(host))
-            try:
-                conn.sendall(request_packet)
-                result = self.recv_response(conn)
-            except Exception:
-                self.last_failure[host] = time.time()
-                logger.info("carbonlink exception", exc_info=True,
-                            host=str(host))
-            else:
-                self.connections[host].add(conn)
+            result = responses[host]
+            if result is not None:
+                result = result[0]
                 if 'error' in result:
                     logger.info("carbonlink error",
                                 host=str(host), error=result['error'])
                 else:
                     if len(result['datapoints']) > 1:
                         results['datapoints'].extend(result['datapoints'])
-            logger.debug("carbonlink finished receiving",
-                         metric=metric, host=str(host))
+        logger.debug("carbonlink finished receiving", metric=metric)
+        return results
+
+    def send_requests(self, host, requests):
+        """
+        Sends requests to a host in a row on a pooled connection, then reads
+        their responses in order. Returns None when the host failed.
+        """
+        conn = self.get_connection(host)
+        try:
+            conn.sendall(serialize_requests(requests))
+            results = [self.recv_response(conn) for _ in requests]
+        except Exception:
+            self.last_failure[host] = time.time()
+            logger.info("carbonlink exception", exc_info=True, host=str(host))
+            return None
+        self.connections[host].add(conn)
         return results
 
+    def send_requests_to_hosts(self, requests_by_host):
+        """
+        Sends lists of requests to several hosts and returns their responses
+        by host, None for the hosts that failed. In concurrent mode, all the
+        hosts are queried at the same time, connections included, and the
+        hosts which failed in the last ``retry_delay`` seconds are skipped.
+        """
+        if not self.concurrent or len(requests_by_host) < 2:
+            return dict((host, self.send_requests(host, requests))
+                        for host, requests in requests_by_host.items())
+
+        # All the hosts share the same deadline
+        deadline = time.monotonic() + self.timeout
+        responses = {}
+        selector = selectors.DefaultSelector()
+        for host, requests in requests_by_host.items():
+            responses[host] = None
+            if not self.is_available(host):
+                logger.debug("carbonlink host unavailable", host=str(host))
+                continue
+            try:
+                conn, connecting = self.start_connection(host)
+            except Exception:
+                logger.info("carbonlink exception", exc_info=True,
+                            host=str(host))
+                continue
+            selector.register(conn, selectors.EVENT_WRITE,
+                              Exchange(host, requests, connecting))
+
+        try:
+            while selector.get_map():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                for key, events in selector.select(timeout):
+                    conn, exchange = key.fileobj, key.data
+                    try:
+                        if events & selectors.EVENT_WRITE:
+                            if exchange.send(conn):
+                                selector.modify(conn, selectors.EVENT_READ,
+                                                exchange)
+                            continue
+                        done = exchange.recv(conn)
+                    except Exception:
+                        logger.info("carbonlink exception", exc_info=True,
+                                    host=str(exchange.host))
+                        selector.unregister(conn)
+                        self.close_failed(exchange.host, conn)
+                        continue
+                    if done:
+                        selector.unregister(conn)
+                        conn.settimeout(self.timeout)
+                        self.connections[exchange.host].add(conn)
+                        responses[exchange.host] = exchange.responses
+        finally:
+            # Whatever is left timed out
+            for key in list(selector.get_map().values()):
+                logger.info("carbonlink timeout", host=str(key.data.host))
+                selector.unregister(key.fileobj)
+                self.close_failed(key.data.host, key.fileobj)
+            selector.close()
+        return responses
+
+    def close_failed(self, host, conn):
+        self.last_failure[host] = time.time()
+        conn.close()
+
     def recv_response(self, conn):
         len_prefix = recv_exactly(conn, 4)
         body_size = struct.unpack("!L", len_prefix)[0]
@@ -302,12 +451,67 @@ class CarbonLinkRequestError(Exception):
     pass
 
 
-# Socket helper functions
-def recv_exactly(conn, num_bytes):
-    buf = b''
-    while len(buf) < num_bytes:
-        data = conn.recv(num_bytes - len(buf))
+class Exchange(object):
+    """
+    Requests sent to a host over a non-blocking socket, and their responses.
+    """
+    def __init__(self, host, requests, connecting=False):
+        self.host = host
+        self.connecting = connecting
+        self.expected = len(requests)
+        self.packet = memoryview(serialize_requests(requests))
+        self.buffer = bytearray()
+        self.responses = []
+
+    def send(self, conn):
+        """Sends the requests, returns True once they're all sent."""
+        if self.connecting:
+            error = conn.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise OSError(error, os.strerror(error))
+            self.connecting = False
+        sent = conn.send(self.packet)
+        self.packet = self.packet[sent:]
+        return not self.packet
+
+    def recv(self, conn):
+        """Reads responses, returns True once they're all received."""
+        data = conn.recv(65536)
         if not data:
             raise Exception("Connection lost")
-        buf += data
+        self.buffer += data
+        offset = 0
+        while len(self.buffer) - offset >= 4:
+            body_size = struct.unpack_from("!L", self.buffer, offset)[0]
+            end = offset + 4 + body_size
+            if len(self.buffer) < end:
+                break
+            with memoryview(self.buffer) as view:
+                self.responses.append(
+                    SafeUnpickler.loads(view[offset + 4:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return len(self.responses) >= self.expected
+
+
+def serialize_requests(requests):
+    packets = []
+    for request in requests:
+        serialized_request = pickle.dumps(request, protocol=2)
+        packets.append(struct.pack("!L", len(serialized_request)))
+        packets.append(serialized_request)
+    return b''.join(packets)
+
+
+# Socket helper functions
+def recv_exactly(conn, num_bytes):
+    buf = bytearray(num_bytes)
+    received = 0
+    with memoryview(buf) as view:
+        while received < num_bytes:
+            size = conn.recv_into(view[received:], num_bytes - received)
+            if not size:
+                raise Exception("Connection lost")
+            received += size
     return buf
@@ -13,7 +13,11 @@ from structlog.processors import (format_exc_info, JSONRenderer,
 from tzlocal import get_localzone
 
 from . import DEBUG
+from .aio import EventLoop
+from .lru import LRUCache
 from .middleware import CORS, TrailingSlash
+from .pool import FetchPool
+from .render.parser import get_parser, parsed_size
 from .storage import Store
 
 if DEBUG:
@@ -152,11 +156,36 @@ def configure(app):
         else:
             config['carbon']['hashing_keyfunc'] = lambda x: x
     loaded_config['carbon'] = config.get('carbon', None)
+    loaded_config['render'] = render_conf = config.get('render') or {}
+    loaded_config['fetch_pool'] = None
+    if render_conf.get('fetch_threads'):
+        loaded_config['fetch_pool'] = FetchPool(
+            int(render_conf['fetch_threads']),
+            render_conf.get('fetch_threads_per_finder'))
+    loaded_config['event_loop'] = None
+    if render_conf.get('async_threads'):
+        loaded_config['event_loop'] = EventLoop(
+            int(render_conf['async_threads']))
+    loaded_config['parser'] = get_parser(
+        render_conf.get('parser', 'pyparsing'))
+    loaded_config['parse_cache'] = None
+    if render_conf.get('parse_cache_size', 1000):
+        loaded_config['parse_cache'] = LRUCache(
+            max_items=render_conf.get('parse_cache_size', 1000),
+            max_size=render_conf.get('parse_cache_bytes', 50 * 1024 * 1024),
+            sizeof=parsed_size)
 
     finders = []
     for finder in config['finders']:
         finders.append(load_by_path(finder)(config))
-    loaded_config['store'] = Store(finders)
+    multi_fetch_pool = None
+    if render_conf.get('multi_fetch_threads'):
+        multi_fetch_pool = FetchPool(
+            int(render_conf['multi_fetch_threads']),
+            thread_name_prefix='graphite-render-multi-fetch')
+    loaded_config['store'] = Store(
+        finders, multi_fetch_pool,
+        render_conf.get('multi_fetch_first_sufficient', False))
     app.config['GRAPHITE'] = loaded_config
     app.config['TIME_ZONE'] = config['time_zone']
     logger.info("configured timezone", timezone=app.config['TIME_ZONE'])
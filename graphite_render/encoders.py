@@ -1,4 +1,5 @@
 import json
+from itertools import islice
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -16,3 +17,60 @@ class JSONEncoder(json.JSONEncoder):
         elif hasattr(o, '__iter__'):
             return [i for i in o]
         return super(JSONEncoder, self).default(o)
+
+
+# Number of datapoints encoded at once when streaming series.
+CHUNK_POINTS = 1000
+
+INFINITY = float('inf')
+
+
+def encode_value(value, float_repr=float.__repr__, int_repr=int.__repr__):
+    """
+    Encodes a datapoint value or timestamp like ``json.dumps()``, without
+    going through the encoder for the common types.
+    """
+    if value is None:
+        return 'null'
+    if value.__class__ is float:
+        if value != value:
+            return 'NaN'
+        if value == INFINITY:
+            return 'Infinity'
+        if value == -INFINITY:
+            return '-Infinity'
+        return float_repr(value)
+    if value.__class__ is int:
+        return int_repr(value)
+    return json.dumps(value, cls=JSONEncoder)
+
+
+def iterencode_series(series_data, jsonp=None):
+    """
+    Encodes a list of ``{'target': name, 'datapoints': datapoints}`` dicts
+    like ``json.dumps(series_data, cls=JSONEncoder)`` but piece by piece,
+    series by series and ``CHUNK_POINTS`` datapoints at a time, so that the
+    response can be streamed instead of being built in memory.
+    """
+    encode = encode_value
+    if jsonp:
+        yield '{0}('.format(jsonp)
+    yield '['
+    for index, series in enumerate(series_data):
+        yield '{0}{{"target": {1}, "datapoints": ['.format(
+            ', ' if index else '', json.dumps(series['target']))
+        datapoints = iter(series['datapoints'])
+        separator = ''
+        while True:
+            chunk = list(islice(datapoints, CHUNK_POINTS))
+            if not chunk:
+                break
+            yield separator + ', '.join([
+                '[%s, %s]' % (encode(value), encode(timestamp))
+                for value, timestamp in chunk
+            ])
+            separator = ', '
+        yield ']}'
+    yield ']'
+    if jsonp:
+        yield ')'
@@ -1,12 +1,30 @@
 import itertools
 import re
+from collections import defaultdict
+from datetime import timedelta
 
-from .render.datalib import fetchData, TimeSeries
-from .render.grammar import grammar
+from .render.datalib import fetch_key, fetchData, TimeSeries
+from .render.parser import get_parser
+
+
+def parseTarget(target):
+    """
+    Parses a target, reusing the tokens of an earlier parse of the same
+    target when the parse cache is enabled.
+    """
+    parse = app.config['GRAPHITE'].get('parser') or get_parser('pyparsing')
+    parse_cache = app.config['GRAPHITE'].get('parse_cache')
+    if parse_cache is None:
+        return parse(target)
+    tokens = parse_cache.get(target)
+    if tokens is None:
+        tokens = parse(target)
+        parse_cache.set(target, tokens)
+    return tokens
 
 
 def pathsFromTarget(requestContext, target):
-    tokens = grammar.parse_string(target)
+    tokens = parseTarget(target)
     paths = list(pathsFromTokens(requestContext, tokens))
     return paths
 
@@ -59,12 +77,99 @@ def pathsFromTokens(requestContext, tokens, replacements=None):
         yield path
 
 
+def prefetchData(requestContext, targets):
+    """
+    Fetches the data of targets ahead of their evaluation, with one fetch
+    per time range: functions evaluating their series again over a preview
+    window (``movingAverage(x, '1h')``...) find it already fetched.
+
+    Returns the data of the requested time range.
+    """
+    plan = defaultdict(list)
+    for target in targets:
+        planFetches(requestContext, parseTarget(target), plan)
+    startTime = requestContext['startTime']
+    prefetched = requestContext.setdefault('prefetched', {})
+    for previewStart, paths in plan.items():
+        if previewStart == startTime or not paths:
+            continue
+        context = requestContext.copy()
+        context['startTime'] = previewStart
+        prefetched[fetch_key(context)] = fetchData(context, paths)
+    data_store = fetchData(requestContext, plan[startTime])
+    prefetched[fetch_key(requestContext)] = data_store
+    return data_store
+
+
+def planFetches(requestContext, tokens, plan):
+    """
+    Adds the paths of tokens to ``plan``, a mapping of the start times they
+    are fetched from to paths.
+    """
+    if tokens.expression:
+        planFetches(requestContext, tokens.expression, plan)
+
+    elif tokens.call and tokens.call.funcname != 'template':
+        args = list(tokens.call.args) + [kwarg.args[0]
+                                         for kwarg in tokens.call.kwargs]
+        context = previewContext(requestContext, tokens.call)
+        if context is not None:
+            planFetches(context, args[0], plan)
+            func = app.functions[tokens.call.funcname]
+            if getattr(func, 'previewReplaces', False):
+                args = args[1:]
+        for arg in args:
+            planFetches(requestContext, arg, plan)
+
+    else:
+        plan[requestContext['startTime']].extend(
+            pathsFromTokens(requestContext, tokens))
+
+
+def rangePaths(requestContext, tokens):
+    """
+    Returns the paths of tokens fetched over the time range of the context,
+    leaving out the ones only evaluated over a preview window.
+    """
+    plan = defaultdict(list)
+    planFetches(requestContext, tokens, plan)
+    return plan[requestContext['startTime']]
+
+
+def previewContext(requestContext, call):
+    """
+    Returns the context in which a function evaluates its first argument
+    again over a preview window, when its length only depends on literal
+    arguments. Returns None otherwise.
+    """
+    func = app.functions.get(call.funcname)
+    previewSeconds = getattr(func, 'previewSeconds', None)
+    if previewSeconds is None or not call.args:
+        return None
+    literals = list(call.args[1:]) + [kwarg.args[0] for kwarg in call.kwargs]
+    if not all(arg.number or arg.string or arg.boolean for arg in literals):
+        return None
+    try:
+        seconds = previewSeconds(
+            *[evaluateLiteral(arg) for arg in call.args[1:]],
+            **dict((kwarg.argname, evaluateLiteral(kwarg.args[0]))
+                   for kwarg in call.kwargs))
+    except Exception:
+        return None
+    if seconds is None:
+        return None
+    context = requestContext.copy()
+    context['startTime'] = (requestContext['startTime'] -
+                            timedelta(seconds=seconds))
+    return context
+
+
 def evaluateTarget(requestContext, target, data_store=None):
-    tokens = grammar.parse_string(target)
+    tokens = parseTarget(target)
 
     if data_store is None:
-        paths = list(pathsFromTokens(requestContext, tokens))
-        data_store = fetchData(requestContext, paths)
+        data_store = fetchData(requestContext,
+                               rangePaths(requestContext, tokens))
 
     result = evaluateTokens(requestContext, tokens, data_store)
     if isinstance(result, TimeSeries):
@@ -75,8 +180,8 @@ def evaluateTarget(requestContext, target, data_store=None):
 
 def evaluateTokens(requestContext, tokens, data_store=None, replacements=None):
     if data_store is None:
-        paths = list(pathsFromTokens(requestContext, tokens))
-        data_store = fetchData(requestContext, paths)
+        data_store = fetchData(requestContext,
+                               rangePaths(requestContext, tokens))
 
     if tokens.template:
         arglist = dict()
@@ -125,8 +230,19 @@ def evaluateTokens(requestContext, tokens, data_store=None, replacements=None):
                              "arguments are allowed")
 
         func = app.functions[tokens.call.funcname]
-        args = [evaluateTokens(requestContext, arg, data_store, replacements)
-                for arg in tokens.call.args]
+        context = None
+        if replacements is None and getattr(func, 'previewReplaces', False):
+            context = previewContext(requestContext, tokens.call)
+        args = []
+        for i, arg in enumerate(tokens.call.args):
+            if i == 0 and context is not None:
+                # The function only checks that these series aren't empty
+                # before evaluating them again over its preview: pass the
+                # series of the preview, which are fetched anyway.
+                args.append(evaluateTokens(context, arg))
+            else:
+                args.append(evaluateTokens(requestContext, arg, data_store,
+                                           replacements))
         requestContext['args'] = tokens.call.args
         kwargs = dict([(kwarg.argname,
                         evaluateTokens(requestContext, kwarg.args[0],
@@ -135,7 +251,15 @@ def evaluateTokens(requestContext, tokens, data_store=None, replacements=None):
         ret = func(requestContext, *args, **kwargs)
         return ret
 
-    elif tokens.number:
+    elif tokens.number or tokens.string or tokens.boolean:
+        return evaluateLiteral(tokens)
+
+    else:
+        raise ValueError("unknown token in target evaluator")
+
+
+def evaluateLiteral(tokens):
+    if tokens.number:
         if tokens.number.integer:
             return int(tokens.number.integer)
         elif tokens.number.float:
@@ -149,7 +273,4 @@ def evaluateTokens(requestContext, tokens, data_store=None, replacements=None):
     elif tokens.boolean:
         return tokens.boolean[0] == 'true'
 
-    else:
-        raise ValueError("unknown token in target evaluator")
-
 from .app import app  # noqa
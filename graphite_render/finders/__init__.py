@@ -1,6 +1,7 @@
 import fnmatch
 import os.path
 import re
+from functools import lru_cache
 
 EXPAND_BRACES_RE = re.compile(r'.*(\{.*?[^\\]?\})')
 
@@ -46,12 +47,79 @@ def extract_variants(pattern):
 def match_entries(entries, pattern):
     """A drop-in replacement for fnmatch.filter that supports pattern
     variants (ie. {foo,bar}baz = foobaz or barbaz)."""
-    matching = []
-
-    for variant in expand_braces(pattern):
-        matching.extend(fnmatch.filter(entries, variant))
-
-    return list(_deduplicate(matching))
+    match = compile_pattern(pattern).match
+    return list(_deduplicate(entry for entry in entries if match(entry)))
+
+
+@lru_cache(maxsize=1024)
+def compile_pattern(pattern):
+    """Compile a path component pattern (fnmatch wildcards, character
+    classes, possibly nested {foo,bar} variants and backslash escapes) into
+    a single regular expression matching whole entries."""
+    regex, _ = _translate(pattern, 0, False)
+    return re.compile(r'(?s:{0})\Z'.format(regex))
+
+
+def _translate(pattern, i, in_braces):
+    """Translate pattern from index i until the end of the pattern or, when
+    in_braces, until the next top-level ',' or '}'. Return the regex and the
+    index where translation stopped."""
+    res = []
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if in_braces and c in ',}':
+            break
+        i += 1
+        if c == '\\' and i < n:
+            res.append(re.escape(pattern[i]))
+            i += 1
+        elif c == '*':
+            res.append('.*')
+        elif c == '?':
+            res.append('.')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                res.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] in ('^', '['):
+                    stuff = '\\' + stuff
+                res.append('[{0}]'.format(stuff))
+        elif c == '{':
+            variants, j = _translate_variants(pattern, i)
+            if variants is None:
+                res.append('\\{')
+            else:
+                res.append('(?:{0})'.format('|'.join(variants)))
+                i = j
+        else:
+            res.append(re.escape(c))
+    return ''.join(res), i
+
+
+def _translate_variants(pattern, i):
+    """Translate the comma-separated variants of the braces opened right
+    before index i. Return (None, i) if the braces are never closed."""
+    variants = []
+    while True:
+        regex, i = _translate(pattern, i, True)
+        if i >= len(pattern):
+            return None, i
+        variants.append(regex)
+        i += 1
+        if pattern[i - 1] == '}':
+            return variants, i
 
 
 def expand_braces(pattern):
@@ -0,0 +1,187 @@
+import gzip
+import os
+import time
+from io import BytesIO
+
+from .._vendor import whisper
+from ..lru import LRUCache
+
+# Points per cached slice of an archive.
+BUCKET_POINTS = 1024
+# Rough memory footprint of a cached point (list slot and float object).
+POINT_BYTES = 32
+
+
+def fetch_time_info(archive, fromTime, untilTime):
+    """
+    Returns the ``(fromInterval, untilInterval, step)`` time info of a
+    whisper fetch, from the result of :func:`whisper.selectArchive`.
+    """
+    step = archive['secondsPerPoint']
+    fromInterval = int(fromTime - (fromTime % step)) + step
+    untilInterval = int(untilTime - (untilTime % step)) + step
+    if fromInterval == untilInterval:
+        # Zero-length time range: always include the next point
+        untilInterval += step
+    return fromInterval, untilInterval, step
+
+
+def slice_size(key, value):
+    return len(value[0]) * POINT_BYTES
+
+
+def content_size(key, value):
+    return len(value[1])
+
+
+class HeaderCache(object):
+    """
+    Cache of the parsed headers of whisper files.
+
+    Headers are checked against the device, inode and size of their file:
+    the archives of a file can't change without changing its size, and tools
+    like whisper-resize replace the file. The mtime isn't checked since it
+    changes with every update, and headers only change on such rewrites.
+    """
+    def __init__(self, max_items):
+        self.headers = LRUCache(max_items=max_items)
+
+    def read(self, fh):
+        """Returns the header of an open whisper file."""
+        return self._header(fh.name, os.fstat(fh.fileno()),
+                            lambda: getattr(whisper, '__readHeader')(fh))
+
+    def info(self, path, opener=open):
+        """
+        Returns the header of the whisper file at ``path`` and its
+        ``stat()``, only opening the file (with ``opener``) when its header
+        isn't cached.
+        """
+        st = os.stat(path)
+
+        def read():
+            with opener(path, 'rb') as fh:
+                return getattr(whisper, '__readHeader')(fh)
+        return self._header(path, st, read), st
+
+    def _header(self, path, st, read):
+        key = (st.st_dev, st.st_ino, st.st_size)
+        cached = self.headers.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        header = read()
+        self.headers.set(path, (key, header))
+        return header
+
+
+class GzipCache(object):
+    """
+    Cache of the decompressed content of gzipped whisper files, bounded by
+    their total size in bytes.
+
+    Seeking in a gzip stream inflates it from its start, so reading a
+    gzipped file decompresses most of it. Cached files are checked against
+    the device, inode, size and mtime of their file.
+    """
+    def __init__(self, max_size):
+        self.files = LRUCache(max_size=max_size, sizeof=content_size)
+
+    def open(self, path, mode='rb'):
+        """
+        Same as ``gzip.GzipFile(path, 'rb')``, returning a file object over
+        the decompressed content.
+        """
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        cached = self.files.get(path)
+        if cached is None or cached[0] != key:
+            with gzip.GzipFile(path, mode) as fh:
+                cached = key, fh.read()
+            self.files.set(path, cached)
+        fh = BytesIO(cached[1])
+        fh.name = path
+        return fh
+
+
+class FetchCache(object):
+    """
+    Cache of the datapoints read from whisper files.
+
+    Archives are cached by slices of ``BUCKET_POINTS`` points aligned on
+    their resolution, so that requests for overlapping time ranges share
+    them whatever their bounds. Slices only hold the points of past
+    intervals: the current interval of each archive, and whatever follows
+    the cached points of a slice, are read from disk.
+
+    Points can still be written after their interval is over (carbon flushing
+    its cache, late datapoints...), so slices expire after ``ttl`` seconds or
+    the resolution of their archive, whichever is longer.
+    """
+    def __init__(self, max_items, max_size=None, ttl=60, header_cache=None):
+        self.ttl = ttl
+        self.header_cache = header_cache
+        self.slices = LRUCache(max_items=max_items, max_size=max_size,
+                               sizeof=slice_size)
+
+    def fetch(self, path, fromTime, untilTime, now=None):
+        """
+        Same as :func:`whisper.fetch`, reading cached points from memory.
+        """
+        if now is None:
+            now = int(time.time())
+        with open(path, 'rb') as fh:
+            if self.header_cache is None:
+                header = getattr(whisper, '__readHeader')(fh)
+            else:
+                header = self.header_cache.read(fh)
+            selected = whisper.selectArchive(header, fromTime, untilTime, now)
+            if selected is None:
+                return None
+            archive = selected[0]
+            fromInterval, untilInterval, step = fetch_time_info(*selected)
+            oldestTime = now - archive['retention']
+            oldestInterval = int(oldestTime - (oldestTime % step)) + step
+            settledInterval = now - (now % step)
+
+            values = []
+            span = BUCKET_POINTS * step
+            interval = fromInterval
+            while interval < untilInterval:
+                bucket = interval - (interval % span)
+                bucketEnd = min(bucket + span, untilInterval)
+                key = (path, step, bucket)
+                cached = self.slices.get(key)
+                if cached is None or cached[1] < oldestInterval:
+                    # Points older than the archive retention can't be read
+                    # along with the rest of the slice.
+                    cached = ([], max(bucket, oldestInterval))
+                points, filled = cached
+                if filled > interval:
+                    end = min(filled, bucketEnd)
+                    values.extend(points[(interval - bucket) // step:
+                                         (end - bucket) // step])
+                    interval = end
+                if interval == bucketEnd:
+                    continue
+
+                # Read the rest of the slice from where its cached points
+                # end, so that it can be extended with the settled ones.
+                read = self._read(fh, archive, filled, bucketEnd)
+                values.extend(read[(interval - filled) // step:])
+                interval = bucketEnd
+
+                settled = (min(bucketEnd, settledInterval) - filled) // step
+                if settled > 0:
+                    if not points:
+                        points = [None] * ((filled - bucket) // step)
+                    self.slices.set(key, (points + read[:settled],
+                                          filled + settled * step),
+                                    ttl=max(self.ttl, step))
+
+        return (fromInterval, untilInterval, step), values
+
+    def _read(self, fh, archive, fromInterval, untilInterval):
+        step = archive['secondsPerPoint']
+        _, values = getattr(whisper, '__archive_fetch')(
+            fh, archive, fromInterval - step, untilInterval - step)
+        return values
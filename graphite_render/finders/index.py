@@ -0,0 +1,184 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from threading import Lock, RLock, Thread
+
+from structlog import get_logger
+
+try:
+    from os import scandir, stat
+except ImportError:
+    from scandir import scandir, stat
+
+logger = get_logger()
+
+INDEX_VERSION = 1
+WHISPER_EXTENSIONS = ('.wsp', '.wsp.gz')
+# Directories modified this recently are rescanned on every lookup: entries
+# created in the same timestamp tick as a scan wouldn't change their mtime.
+RACY_DELAY_NS = 2 * 10 ** 9
+
+
+def contains(names, name):
+    """Returns whether a sorted list of names holds ``name``."""
+    index = bisect_left(names, name)
+    return index < len(names) and names[index] == name
+
+
+class MetricIndex(object):
+    """
+    Persistent index of the directory trees holding whisper files.
+
+    For each directory the index keeps its mtime and the names of its
+    subdirectories (noting those that are symbolic links) and of its whisper
+    files. Looking up a directory costs a single ``stat()``: its entries are
+    only rescanned when its mtime changed, which happens whenever an entry is
+    created, renamed or removed in it.
+
+    The index is loaded from ``path`` on startup and written back at most
+    every ``save_interval`` seconds when it changed, in a background thread.
+    """
+    def __init__(self, path, roots=(), save_interval=60):
+        self.path = path
+        self.save_interval = save_interval
+        self.directories = {}
+        self.roots = set(roots)
+        self.dirty = False
+        self.last_save = time.time()
+        self.lock = RLock()
+        self.save_lock = Lock()
+        self.save_thread = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if not isinstance(data, dict) or (
+                data.get('version') != INDEX_VERSION):
+            logger.info("ignoring metric index", path=self.path)
+            return
+        self.directories = dict(
+            (path, tuple(entry))
+            for path, entry in data['directories'].items()
+        )
+        logger.debug("loaded metric index", path=self.path,
+                     directories=len(self.directories))
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                directories = dict((path, self.directories[path])
+                                   for path in self._reachable())
+                self.directories = directories
+                self.dirty = False
+                self.last_save = time.time()
+            # Entries are replaced, never modified: the snapshot can be
+            # written without holding the lock.
+            tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION,
+                           'directories': directories}, f)
+            os.replace(tmp_path, self.path)
+        logger.debug("saved metric index", path=self.path,
+                     directories=len(directories))
+
+    def maybe_save(self):
+        """
+        Saves the index in a background thread if it changed and wasn't
+        saved in the last ``save_interval`` seconds, so that requests don't
+        wait for it to be written.
+        """
+        with self.lock:
+            if not self.dirty or (
+                    time.time() - self.last_save < self.save_interval) or (
+                    self.save_thread is not None and
+                    self.save_thread.is_alive()):
+                return
+            self.save_thread = Thread(target=self._save_in_background,
+                                      name='graphite-render-index-save',
+                                      daemon=True)
+            self.save_thread.start()
+
+    def _save_in_background(self):
+        try:
+            self.save()
+        except (IOError, OSError):
+            self.dirty = True
+            logger.warning("unable to save metric index", path=self.path,
+                           exc_info=True)
+
+    def _reachable(self):
+        pending = [root for root in self.roots if root in self.directories]
+        while pending:
+            path = pending.pop()
+            yield path
+            for subdir in self.directories[path][1]:
+                subdir_path = os.path.join(path, subdir)
+                if subdir_path in self.directories:
+                    pending.append(subdir_path)
+
+    def _entry(self, path):
+        try:
+            mtime = stat(path).st_mtime_ns
+        except OSError:
+            return None
+        entry = self.directories.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry
+
+        subdirs = []
+        links = []
+        files = []
+        for dir_entry in scandir(path):
+            name = dir_entry.name
+            if dir_entry.is_dir():
+                subdirs.append(name)
+                if dir_entry.is_symlink():
+                    links.append(name)
+            elif name.endswith(WHISPER_EXTENSIONS) and dir_entry.is_file():
+                files.append(name)
+        subdirs.sort()
+        files.sort()
+        if time.time_ns() - mtime < RACY_DELAY_NS:
+            mtime = None
+        entry = (mtime, subdirs, links, files)
+        with self.lock:
+            self.directories[path] = entry
+            self.dirty = True
+        return entry
+
+    def listdir(self, path):
+        """
+        Returns the ``(subdirs, files)`` names of a directory, rescanning it
+        only if it changed since it was last indexed.
+        """
+        entry = self._entry(path)
+        if entry is None:
+            return [], []
+        return entry[1], entry[3]
+
+    def walk(self, path):
+        """
+        Yields ``path`` and all the directories underneath it, top-down and
+        without following symbolic links, like :func:`os.walk`.
+        """
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            entry = self._entry(current)
+            if entry is None:
+                continue
+            yield current
+            _, subdirs, links, _ = entry
+            pending.extend(os.path.join(current, name)
+                           for name in reversed(subdirs) if name not in links)
+
+    def refresh(self):
+        """Brings the index of all the directory trees up to date."""
+        for root in self.roots:
+            for _ in self.walk(root):
+                pass
@@ -1,14 +1,21 @@
 import gzip
 import os.path
 import time
+from bisect import bisect_left
+from collections import defaultdict
+from operator import itemgetter
 
 from structlog import get_logger
 
 from . import fs_to_metric, get_real_metric_path, match_entries
+from .cache import fetch_time_info, FetchCache, GzipCache, HeaderCache
+from .index import contains, MetricIndex
 from .._vendor import whisper
 from ..carbonlink import CarbonLinkPool
 from ..intervals import Interval, IntervalSet
 from ..node import BranchNode, LeafNode
+from ..pool import FetchPool
+from ..readers import MultiReader
 from ..utils import is_pattern
 
 try:
@@ -27,6 +34,35 @@ class WhisperFinder(object):
             self.carbonlink = CarbonLinkPool(**config['carbon'])
         else:
             self.carbonlink = None
+        self.index = None
+        if config['whisper'].get('index') and config.get('search_index'):
+            self.index = MetricIndex(
+                config['search_index'], self.directories,
+                config['whisper'].get('index_save_interval', 60))
+        self.header_cache = None
+        if config['whisper'].get('header_cache_size', 10000):
+            self.header_cache = HeaderCache(
+                config['whisper'].get('header_cache_size', 10000))
+        self.fetch_cache = None
+        if config['whisper'].get('fetch_cache_size'):
+            self.fetch_cache = FetchCache(
+                config['whisper']['fetch_cache_size'],
+                config['whisper'].get('fetch_cache_bytes',
+                                      100 * 1024 * 1024),
+                config['whisper'].get('fetch_cache_ttl', 60),
+                self.header_cache)
+        self.gzip_cache = None
+        if config['whisper'].get('gzip_cache_bytes'):
+            self.gzip_cache = GzipCache(config['whisper']['gzip_cache_bytes'])
+        self.fetch_multi_pool = None
+        threads = config['whisper'].get('fetch_multi_threads', 0)
+        if threads:
+            # Unique per finder: datalib hands each finder the nodes that
+            # share its key.
+            self.__fetch_multi__ = 'whisper-{0:x}'.format(id(self))
+            if threads > 1:
+                self.fetch_multi_pool = FetchPool(
+                    int(threads), thread_name_prefix='graphite-render-whisper')
 
     def find_nodes(self, query):
         logger.debug("find_nodes", finder="whisper", start=query.startTime,
@@ -37,7 +73,11 @@ class WhisperFinder(object):
         for root_dir in self.directories:
             if not os.path.isdir(root_dir):
                 os.makedirs(root_dir)
-            for absolute_path in self._find_paths(root_dir, pattern_parts):
+            if self.index is None:
+                paths = self._find_paths(root_dir, pattern_parts)
+            else:
+                paths = self._find_indexed_paths(root_dir, pattern_parts)
+            for absolute_path, is_dir in paths:
                 if os.path.basename(absolute_path).startswith('.'):
                     continue
 
@@ -53,22 +93,145 @@ class WhisperFinder(object):
                 metric_path = '.'.join(metric_path_parts)
 
                 # Now we construct and yield an appropriate Node object
-                if os.path.isdir(absolute_path):
+                if is_dir:
                     yield BranchNode(metric_path)
 
-                elif os.path.isfile(absolute_path):
-                    if absolute_path.endswith('.wsp'):
-                        reader = WhisperReader(absolute_path, real_metric_path,
-                                               self.carbonlink)
+                elif absolute_path.endswith('.wsp'):
+                    reader = WhisperReader(absolute_path, real_metric_path,
+                                           self.carbonlink, self.fetch_cache,
+                                           self.header_cache)
+                    if hasattr(self, '__fetch_multi__'):
+                        yield WhisperLeafNode(metric_path, reader,
+                                              self.__fetch_multi__)
+                    else:
                         yield LeafNode(metric_path, reader)
 
-                    elif absolute_path.endswith('.wsp.gz'):
-                        reader = GzippedWhisperReader(absolute_path,
-                                                      real_metric_path,
-                                                      self.carbonlink)
-                        yield LeafNode(metric_path, reader)
+                elif absolute_path.endswith('.wsp.gz'):
+                    reader = GzippedWhisperReader(
+                        absolute_path, real_metric_path, self.carbonlink,
+                        header_cache=self.header_cache,
+                        gzip_cache=self.gzip_cache)
+                    yield LeafNode(metric_path, reader)
+
+        if self.index is not None:
+            self.index.maybe_save()
+
+    def prefetch(self, nodes):
+        """
+        Queries the carbon caches for the metrics of all the nodes at once,
+        instead of once per metric when they're fetched.
+        """
+        if self.carbonlink is None:
+            return
+        readers = [reader for reader in leaf_readers(nodes)
+                   if reader.__class__ is WhisperReader and
+                   reader.carbonlink is self.carbonlink]
+        if not readers:
+            return
+        try:
+            datapoints = self.carbonlink.query_bulk(
+                set(reader.real_metric_path for reader in readers))
+        except Exception:
+            # Readers query the caches themselves
+            logger.info("carbonlink bulk query failed", exc_info=True)
+            return
+        for reader in readers:
+            reader.cached_datapoints = datapoints.get(
+                reader.real_metric_path, [])
+
+    def fetch_multi(self, nodes, startTime, endTime, now=None,
+                    requestContext=None):
+        """
+        Fetches whisper leaves in bulk. The carbon caches are queried once
+        for all the metrics, and files are read in inode order, through
+        ``fetch_multi_threads`` threads.
+
+        Series share a single time info: only the nodes fetched with the
+        time info most of them agree on are returned, the others are left
+        to single fetches.
+        """
+        # Like single fetches, the data is read up to the current time
+        now = int(time.time())
+        groups = defaultdict(list)
+        for node in nodes:
+            try:
+                header, st = node.reader.info()
+                selected = whisper.selectArchive(header, startTime, endTime,
+                                                 now)
+            except Exception:
+                logger.info("unable to plan fetch", path=node.reader.fs_path,
+                            exc_info=True)
+                continue
+            if selected is not None:
+                groups[fetch_time_info(*selected)].append((st.st_ino, node))
+        if not groups:
+            return None, {}
+
+        time_info = max(groups, key=lambda key: len(groups[key]))
+        nodes = [node for _, node in sorted(groups[time_info],
+                                            key=itemgetter(0))]
+        self.prefetch(nodes)
+
+        def fetch(node):
+            return node.path, node.reader.fetch(startTime, endTime, now)
+
+        if self.fetch_multi_pool is None:
+            fetches = [fetch(node) for node in nodes]
+        else:
+            fetches = self.fetch_multi_pool.map(fetch, nodes)
+        return time_info, dict((path, result[1]) for path, result in fetches
+                               if result and result[0] == time_info)
 
     def _find_paths(self, current_dir, patterns):
+        """Recursively generates ``(absolute path, is_dir)`` tuples for the
+        paths whose components underneath current_dir match the
+        corresponding pattern in patterns"""
+        for absolute_path in self._find_fs_paths(current_dir, patterns):
+            if os.path.isdir(absolute_path):
+                yield absolute_path, True
+            elif os.path.isfile(absolute_path):
+                yield absolute_path, False
+
+    def _find_indexed_paths(self, current_dir, patterns):
+        """Same as _find_paths, listing directories from the metric index
+        instead of the filesystem"""
+        pattern = patterns[0]
+        patterns = patterns[1:]
+        has_wildcard = is_pattern(pattern)
+        using_globstar = pattern == "**"
+
+        subdirs, files = self.index.listdir(current_dir)
+        if using_globstar:
+            matching_subdirs = list(self.index.walk(current_dir))
+        elif has_wildcard:
+            matching_subdirs = match_entries(subdirs, pattern)
+        else:
+            matching_subdirs = [pattern] if contains(subdirs, pattern) else []
+
+        # For terminal globstar, add a pattern for all files in subdirs
+        if using_globstar and not patterns:
+            patterns = ['*']
+
+        if patterns:  # we've still got more directories to traverse
+            for subdir in matching_subdirs:
+                absolute_path = os.path.join(current_dir, subdir)
+                for match in self._find_indexed_paths(absolute_path,
+                                                      patterns):
+                    yield match
+
+        else:  # we've got the last pattern
+            if has_wildcard:
+                matching_files = match_entries(files, pattern + '.*')
+            else:
+                matching_files = [f for f in (pattern + '.wsp',
+                                              pattern + '.wsp.gz')
+                                  if contains(files, f)]
+            for _basename in matching_files:
+                yield os.path.join(current_dir, _basename), False
+            for _basename in matching_subdirs:
+                yield os.path.join(current_dir, _basename), True
+
+    def _find_fs_paths(self, current_dir, patterns):
         """Recursively generates absolute paths whose components
         underneath current_dir match the corresponding pattern in
         patterns"""
@@ -97,7 +260,7 @@ class WhisperFinder(object):
         if patterns:  # we've still got more directories to traverse
             for subdir in matching_subdirs:
                 absolute_path = os.path.join(current_dir, subdir)
-                for match in self._find_paths(absolute_path, patterns):
+                for match in self._find_fs_paths(absolute_path, patterns):
                     yield match
 
         else:  # we've got the last pattern
@@ -111,25 +274,55 @@ class WhisperFinder(object):
                 yield os.path.join(current_dir, _basename)
 
 
+class WhisperLeafNode(LeafNode):
+    """Whisper leaf fetched in bulk by its finder, see ``fetch_multi()``."""
+    __slots__ = ('__fetch_multi__',)
+
+    def __init__(self, path, reader, fetch_multi):
+        super(WhisperLeafNode, self).__init__(path, reader)
+        self.__fetch_multi__ = fetch_multi
+
+
 class WhisperReader(object):
 
-    __slots__ = ('fs_path', 'real_metric_path', 'carbonlink')
+    __slots__ = ('fs_path', 'real_metric_path', 'carbonlink', 'fetch_cache',
+                 'header_cache', 'cached_datapoints')
 
-    def __init__(self, fs_path, real_metric_path, carbonlink=None):
+    def __init__(self, fs_path, real_metric_path, carbonlink=None,
+                 fetch_cache=None, header_cache=None):
         self.fs_path = fs_path
         self.real_metric_path = real_metric_path
         self.carbonlink = carbonlink
+        self.fetch_cache = fetch_cache
+        self.header_cache = header_cache
+        # Set when the carbon caches were queried in bulk
+        self.cached_datapoints = None
+
+    def info(self):
+        """Returns the header of the whisper file and its ``stat()``."""
+        if self.header_cache is None:
+            return whisper.info(self.fs_path), stat(self.fs_path)
+        return self.header_cache.info(self.fs_path)
 
     def get_intervals(self):
-        start = time.time() - whisper.info(self.fs_path)['maxRetention']
-        end = max(stat(self.fs_path).st_mtime, start)
+        info, st = self.info()
+        start = time.time() - info['maxRetention']
+        end = max(st.st_mtime, start)
         return IntervalSet([Interval(start, end)])
 
-    def fetch(self, startTime, endTime):  # noqa
+    def fetch(self, startTime, endTime, now=None):  # noqa
         logger.debug("fetch", reader="whisper", path=self.fs_path,
                      metric_path=self.real_metric_path,
                      start=startTime, end=endTime)
-        data = whisper.fetch(self.fs_path, startTime, endTime)
+        if self.fetch_cache is not None:
+            data = self.fetch_cache.fetch(self.fs_path, startTime, endTime,
+                                          now)
+        elif self.header_cache is not None:
+            with open(self.fs_path, 'rb') as fh:
+                data = whisper.file_fetch(fh, startTime, endTime, now,
+                                          header=self.header_cache.read(fh))
+        else:
+            data = whisper.fetch(self.fs_path, startTime, endTime, now)
         if not data:
             return None
 
@@ -137,43 +330,112 @@ class WhisperReader(object):
         start, end, step = time_info
 
         if self.carbonlink:
-            cached_datapoints = self.carbonlink.query(self.real_metric_path)
+            cached_datapoints = self.cached_datapoints
+            if cached_datapoints is None:
+                cached_datapoints = self.carbonlink.query(
+                    self.real_metric_path)
             if isinstance(cached_datapoints, dict):
                 cached_datapoints = cached_datapoints.items()
-            for timestamp, value in sorted(cached_datapoints):
-                # filter only to cached datapoints within [start, end)
-                if not (timestamp >= start and timestamp < end):
-                    continue
-                interval = timestamp - (timestamp % step)
-                i = int(interval - start) // step
-                values[i] = value
+            merge_datapoints(values, time_info, cached_datapoints)
 
         return time_info, values
 
 
 class GzippedWhisperReader(WhisperReader):
+
+    __slots__ = ('gzip_cache',)
+
+    def __init__(self, fs_path, real_metric_path, carbonlink=None,
+                 fetch_cache=None, header_cache=None, gzip_cache=None):
+        super(GzippedWhisperReader, self).__init__(
+            fs_path, real_metric_path, carbonlink, fetch_cache, header_cache)
+        self.gzip_cache = gzip_cache
+
+    @property
+    def opener(self):
+        if self.gzip_cache is None:
+            return gzip.GzipFile
+        return self.gzip_cache.open
+
     def get_intervals(self):
-        fh = gzip.GzipFile(self.fs_path, 'rb')
-        try:
-            info = getattr(whisper, '__readHeader')(fh)  # evil, but necessary.
-        finally:
-            fh.close()
+        if self.header_cache is None:
+            fh = self.opener(self.fs_path, 'rb')
+            try:
+                # evil, but necessary.
+                info = getattr(whisper, '__readHeader')(fh)
+            finally:
+                fh.close()
+            st = stat(self.fs_path)
+        else:
+            info, st = self.header_cache.info(self.fs_path, self.opener)
 
         start = time.time() - info['maxRetention']
-        end = max(stat(self.fs_path).st_mtime, start)
+        end = max(st.st_mtime, start)
         return IntervalSet([Interval(start, end)])
 
     def fetch(self, startTime, endTime):
         logger.debug("fetch", reader="gzip_whisper", path=self.fs_path,
                      metric_path=self.real_metric_path,
                      start=startTime, end=endTime)
-        fh = gzip.GzipFile(self.fs_path, 'rb')
+        fh = self.opener(self.fs_path, 'rb')
         try:
             return whisper.file_fetch(fh, startTime, endTime)
         finally:
             fh.close()
 
 
+def merge_datapoints(values, time_info, datapoints):
+    """
+    Writes ``(timestamp, value)`` datapoints over the values of a fetch.
+    Datapoints outside of its time range are ignored, and the last datapoint
+    of an interval wins.
+    """
+    start, end, step = time_info
+    datapoints = sorted(datapoints, key=itemgetter(0))
+    if not datapoints:
+        return
+    timestamps, points = zip(*datapoints)
+    first = bisect_left(timestamps, start)
+    last = bisect_left(timestamps, end)
+    if first == last:
+        return
+
+    intervals = int((timestamps[last - 1] - timestamps[first]) // step) + 1
+    if last - first > 2 * intervals:
+        # Several datapoints per interval: jump from one interval to the
+        # next, only the last datapoint of each is written.
+        i = first
+        while i < last:
+            interval = int((timestamps[i] - start) // step)
+            i = bisect_left(timestamps, start + (interval + 1) * step, i, last)
+            values[interval] = points[i - 1]
+        return
+
+    # The start of a fetch is aligned on its step
+    timestamps = timestamps[first:last]
+    indexes = [(timestamp - start) // step for timestamp in timestamps]
+    if not isinstance(timestamps[0], int):
+        indexes = map(int, indexes)
+    merged = dict(zip(indexes, points[first:last]))
+    lo = next(iter(merged))
+    hi = int((timestamps[-1] - start) // step) + 1
+    if len(merged) == hi - lo:
+        values[lo:hi] = merged.values()
+    else:
+        for i, value in merged.items():
+            values[i] = value
+
+
+def leaf_readers(nodes):
+    """Yields the readers of leaf nodes, looking into MultiReaders."""
+    for node in nodes:
+        if isinstance(node.reader, MultiReader):
+            for reader in leaf_readers(node.reader.nodes):
+                yield reader
+        else:
+            yield node.reader
+
+
 def find_escaped_pattern_fields(pattern_string):
     pattern_parts = pattern_string.split('.')
     for index, part in enumerate(pattern_parts):
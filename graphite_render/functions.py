@@ -23,11 +23,15 @@ from functools import partial, reduce
 from itertools import zip_longest
 from operator import is_not, itemgetter
 
+from .aggregation import (column_maxs, column_mins, column_ranges,
+                          row_averages, row_stddevs, row_sums)
 from .render.attime import parseATTime, parseTimeOffset
-from .render.datalib import fetchData, TimeSeries
+from .render.datalib import fetchData, seriesStats, TimeSeries
 from .render.glyph import format_units
-from .render.grammar import grammar
+from .selection import highest, largest, lowest
 from .utils import epoch, to_seconds
+from .windows import (moving_average, moving_max, moving_median, moving_min,
+                      moving_sum)
 
 NAN = float('NaN')
 INF = float('inf')
@@ -113,7 +117,35 @@ def safeSubtract(a, b):
 
 
 def safeAvg(a):
-    return safeDiv(safeSum(a), safeLen(a))
+    values = list(not_none(a))
+    if not values:
+        return None
+    return float(sum(values)) / len(values)
+
+
+def statGetter(name):
+    """
+    Returns a function getting one of the statistics of a series, computed
+    once for all the functions filtering or sorting it (see ``seriesStats``).
+    """
+    def getter(series):
+        return getattr(seriesStats(series), name)
+    return getter
+
+
+seriesSum = statGetter('sum')
+seriesMin = statGetter('min')
+seriesMax = statGetter('max')
+seriesMean = statGetter('mean')
+seriesLast = statGetter('last')
+
+
+def safeVariance(a):
+    values = list(not_none(a))
+    if not values:
+        return None
+    mean = float(sum(values)) / len(values)
+    return float(sum([(v - mean) ** 2 for v in values])) / len(values)
 
 
 def safeStdDev(a):
@@ -215,7 +247,7 @@ def sumSeries(requestContext, *seriesLists):
         return []
     seriesList, start, end, step = normalize(seriesLists)
     name = "sumSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeSum(row) for row in zip_longest(*seriesList))
+    values = row_sums(seriesList)
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
     return [series]
@@ -364,8 +396,7 @@ def averageSeries(requestContext, *seriesLists):
         return []
     seriesList, start, end, step = normalize(seriesLists)
     name = "averageSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeDiv(safeSum(row), safeLen(row))
-              for row in zip_longest(*seriesList))
+    values = row_averages(seriesList)
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
     return [series]
@@ -386,7 +417,7 @@ def stddevSeries(requestContext, *seriesLists):
         return []
     seriesList, start, end, step = normalize(seriesLists)
     name = "stddevSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeStdDev(row) for row in zip_longest(*seriesList))
+    values = row_stddevs(seriesList)
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
     return [series]
@@ -406,7 +437,7 @@ def minSeries(requestContext, *seriesLists):
         return []
     seriesList, start, end, step = normalize(seriesLists)
     name = "minSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeMin(row) for row in zip_longest(*seriesList))
+    values = column_mins(seriesList)
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
     return [series]
@@ -426,7 +457,7 @@ def maxSeries(requestContext, *seriesLists):
         return []
     seriesList, start, end, step = normalize(seriesLists)
     name = "maxSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeMax(row) for row in zip_longest(*seriesList))
+    values = column_maxs(seriesList)
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
     return [series]
@@ -446,8 +477,7 @@ def rangeOfSeries(requestContext, *seriesLists):
         return []
     seriesList, start, end, step = normalize(seriesLists)
     name = "rangeOfSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeSubtract(max(row),
-                           min(row)) for row in zip_longest(*seriesList))
+    values = column_ranges(seriesList)
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
     return [series]
@@ -620,7 +650,7 @@ def asPercent(requestContext, seriesList, total=None):
     normalize([seriesList])
 
     if total is None:
-        totalValues = [safeSum(row) for row in zip_longest(*seriesList)]
+        totalValues = row_sums(seriesList)
         totalText = "sumSeries(%s)" % formatPathExpressions(seriesList)
     elif type(total) is list:
         if len(total) != 1 and len(total) != len(seriesList):
@@ -979,14 +1009,7 @@ def movingMedian(requestContext, seriesList, windowSize):
                                series.end, series.step, [])
         newSeries.pathExpression = newName
 
-        for i in range(windowPoints, len(series)):
-            window = series[i - windowPoints:i]
-            nonNull = [v for v in window if v is not None]
-            if nonNull:
-                m_index = len(nonNull) // 2
-                newSeries.append(sorted(nonNull)[m_index])
-            else:
-                newSeries.append(None)
+        newSeries.extend(moving_median(series[:], windowPoints))
         result.append(newSeries)
 
     return result
@@ -1006,8 +1029,7 @@ def scale(requestContext, seriesList, factor):
     for series in seriesList:
         series.name = "scale(%s,%g)" % (series.name, float(factor))
         series.pathExpression = series.name
-        for i, value in enumerate(series):
-            series[i] = safeMul(value, factor)
+        series[:] = [safeMul(value, factor) for value in series]
     return seriesList
 
 
@@ -1024,8 +1046,7 @@ def scaleToSeconds(requestContext, seriesList, seconds):
         series.name = "scaleToSeconds(%s,%d)" % (series.name, seconds)
         series.pathExpression = series.name
         factor = seconds * 1.0 / series.step
-        for i, value in enumerate(series):
-            series[i] = safeMul(value, factor)
+        series[:] = [safeMul(value, factor) for value in series]
     return seriesList
 
 
@@ -1043,8 +1064,7 @@ def pow(requestContext, seriesList, factor):
     for series in seriesList:
         series.name = "pow(%s,%g)" % (series.name, float(factor))
         series.pathExpression = series.name
-        for i, value in enumerate(series):
-            series[i] = safePow(value, factor)
+        series[:] = [safePow(value, factor) for value in series]
     return seriesList
 
 
@@ -1092,8 +1112,7 @@ def squareRoot(requestContext, seriesList):
     """
     for series in seriesList:
         series.name = "squareRoot(%s)" % (series.name)
-        for i, value in enumerate(series):
-            series[i] = safePow(value, 0.5)
+        series[:] = [safePow(value, 0.5) for value in series]
     return seriesList
 
 
@@ -1109,8 +1128,7 @@ def invert(requestContext, seriesList):
     """
     for series in seriesList:
         series.name = "invert(%s)" % (series.name)
-        for i, value in enumerate(series):
-            series[i] = safePow(value, -1)
+        series[:] = [safePow(value, -1) for value in series]
     return seriesList
 
 
@@ -1127,8 +1145,7 @@ def absolute(requestContext, seriesList):
     for series in seriesList:
         series.name = "absolute(%s)" % (series.name)
         series.pathExpression = series.name
-        for i, value in enumerate(series):
-            series[i] = safeAbs(value)
+        series[:] = [safeAbs(value) for value in series]
     return seriesList
 
 
@@ -1145,9 +1162,8 @@ def offset(requestContext, seriesList, factor):
     for series in seriesList:
         series.name = "offset(%s,%g)" % (series.name, float(factor))
         series.pathExpression = series.name
-        for i, value in enumerate(series):
-            if value is not None:
-                series[i] = value + factor
+        series[:] = [None if value is None else value + factor
+                     for value in series]
     return seriesList
 
 
@@ -1181,10 +1197,9 @@ def offsetToZero(requestContext, seriesList):
     """
     for series in seriesList:
         series.name = "offsetToZero(%s)" % (series.name)
-        minimum = safeMin(series)
-        for i, value in enumerate(series):
-            if value is not None:
-                series[i] = value - minimum
+        minimum = seriesMin(series)
+        series[:] = [None if value is None else value - minimum
+                     for value in series]
     return seriesList
 
 
@@ -1238,17 +1253,7 @@ def movingAverage(requestContext, seriesList, windowSize):
                                series.end, series.step, [])
         newSeries.pathExpression = newName
 
-        windowSum = safeSum(series[:windowPoints]) or 0
-        count = safeLen(series[:windowPoints])
-        newSeries.append(safeDiv(windowSum, count))
-        for n, last in enumerate(series[windowPoints:-1]):
-            if series[n] is not None:
-                windowSum -= series[n]
-                count -= 1
-            if last is not None:
-                windowSum += last
-                count += 1
-            newSeries.append(safeDiv(windowSum, count))
+        newSeries.extend(moving_average(series[:], windowPoints))
 
         result.append(newSeries)
 
@@ -1306,14 +1311,7 @@ def movingSum(requestContext, seriesList, windowSize):
                                series.end, series.step, [])
         newSeries.pathExpression = newName
 
-        window_sum = safeSum(series[:windowPoints])
-        newSeries.append(window_sum)
-        for n, last in enumerate(series[windowPoints:-1]):
-            if series[n] is not None:
-                window_sum -= series[n]
-            if last is not None:
-                window_sum = (window_sum or 0) + last
-            newSeries.append(window_sum)
+        newSeries.extend(moving_sum(series[:], windowPoints))
 
         result.append(newSeries)
 
@@ -1371,9 +1369,7 @@ def movingMin(requestContext, seriesList, windowSize):
         newSeries = TimeSeries(newName, series.start + previewSeconds,
                                series.end, series.step, [])
         newSeries.pathExpression = newName
-        for i in range(windowPoints, len(series)):
-            window = series[i - windowPoints:i]
-            newSeries.append(safeMin(window))
+        newSeries.extend(moving_min(series[:], windowPoints))
 
         result.append(newSeries)
 
@@ -1431,9 +1427,7 @@ def movingMax(requestContext, seriesList, windowSize):
         newSeries = TimeSeries(newName, series.start + previewSeconds,
                                series.end, series.step, [])
         newSeries.pathExpression = newName
-        for i in range(windowPoints, len(series)):
-            window = series[i - windowPoints:i]
-            newSeries.append(safeMax(window))
+        newSeries.extend(moving_max(series[:], windowPoints))
 
         result.append(newSeries)
 
@@ -1467,13 +1461,13 @@ def consolidateBy(requestContext, seriesList, consolidationFunc):
     Takes one metric or a wildcard seriesList and a consolidation function
     name.
 
-    Valid function names are 'sum', 'average', 'min', and 'max'.
+    Valid function names are 'sum', 'average', 'min', 'max' and 'last'.
 
     When a graph is drawn where width of the graph size in pixels is smaller
     than the number of datapoints to be graphed, Graphite consolidates the
     values to to prevent line overlap. The consolidateBy() function changes
     the consolidation function from the default of 'average' to one of 'sum',
-    'max', or 'min'. This is especially useful in sales graphs, where
+    'max', 'min' or 'last'. This is especially useful in sales graphs, where
     fractional values make no sense and a 'sum' of consolidated values is
     appropriate.
 
@@ -1889,16 +1883,16 @@ def cactiStyle(requestContext, seriesList, system=None, units=None):
             else:
                 return "%.2f" % x
     nameLen = max([0] + [len(series.name) for series in seriesList])
-    lastLen = max([0] + [len(fmt(int(safeLast(series) or 3)))
+    lastLen = max([0] + [len(fmt(int(seriesLast(series) or 3)))
                          for series in seriesList]) + 3
-    maxLen = max([0] + [len(fmt(int(safeMax(series) or 3)))
+    maxLen = max([0] + [len(fmt(int(seriesMax(series) or 3)))
                         for series in seriesList]) + 3
-    minLen = max([0] + [len(fmt(int(safeMin(series) or 3)))
+    minLen = max([0] + [len(fmt(int(seriesMin(series) or 3)))
                         for series in seriesList]) + 3
     for series in seriesList:
-        last = safeLast(series)
-        maximum = safeMax(series)
-        minimum = safeMin(series)
+        last = seriesLast(series)
+        maximum = seriesMax(series)
+        minimum = seriesMin(series)
         if last is None:
             last = NAN
         else:
@@ -1921,7 +1915,7 @@ def cactiStyle(requestContext, seriesList, system=None, units=None):
 
 def _getFirstPathExpression(name):
     """Returns the first metric path in an expression."""
-    tokens = grammar.parse_string(name)
+    tokens = parseTarget(name)
     pathExpression = None
     while pathExpression is None:
         if tokens.pathExpression:
@@ -1978,11 +1972,11 @@ def legendValue(requestContext, seriesList, *valueTypes):
 
     """
     valueFuncs = {
-        'avg': lambda s: safeDiv(safeSum(s), safeLen(s)),
-        'total': safeSum,
-        'min': safeMin,
-        'max': safeMax,
-        'last': safeLast,
+        'avg': seriesMean,
+        'total': seriesSum,
+        'min': seriesMin,
+        'max': seriesMax,
+        'last': seriesLast,
     }
     system = None
     if valueTypes[-1] in ('si', 'binary'):
@@ -2105,7 +2099,7 @@ def maximumAbove(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeMax(series)
+        val = seriesMax(series)
         if val is not None and val > n:
             results.append(series)
     return results
@@ -2125,7 +2119,7 @@ def minimumAbove(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeMin(series)
+        val = seriesMin(series)
         if val is not None and val > n:
             results.append(series)
     return results
@@ -2145,7 +2139,7 @@ def maximumBelow(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeMax(series)
+        val = seriesMax(series)
         if val is None or val <= n:
             results.append(series)
     return results
@@ -2165,7 +2159,7 @@ def minimumBelow(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeMin(series)
+        val = seriesMin(series)
         if val is None or val <= n:
             results.append(series)
     return results
@@ -2184,7 +2178,7 @@ def highestCurrent(requestContext, seriesList, n=1):
     Draws the 5 servers with the highest busy threads.
 
     """
-    return sorted(seriesList, key=safeLast)[-n:]
+    return highest(seriesList, n, seriesLast)
 
 
 def highestMax(requestContext, seriesList, n=1):
@@ -2202,8 +2196,8 @@ def highestMax(requestContext, seriesList, n=1):
     period specified.
 
     """
-    result_list = sorted(seriesList, key=lambda s: safeMax(s))[-n:]
-    return sorted(result_list, key=lambda s: max(s), reverse=True)
+    top = highest(seriesList, n, seriesMax)
+    return largest(top, len(top), seriesMax)
 
 
 def lowestCurrent(requestContext, seriesList, n=1):
@@ -2219,7 +2213,7 @@ def lowestCurrent(requestContext, seriesList, n=1):
     Draws the 5 servers with the least busy threads right now.
 
     """
-    return sorted(seriesList, key=safeLast)[:n]
+    return lowest(seriesList, n, seriesLast)
 
 
 def currentAbove(requestContext, seriesList, n):
@@ -2237,7 +2231,7 @@ def currentAbove(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeLast(series)
+        val = seriesLast(series)
         if val is not None and val >= n:
             results.append(series)
     return results
@@ -2258,7 +2252,7 @@ def currentBelow(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeLast(series)
+        val = seriesLast(series)
         if val is None or val <= n:
             results.append(series)
     return results
@@ -2277,7 +2271,7 @@ def highestAverage(requestContext, seriesList, n=1):
     Draws the top 5 servers with the highest average value.
 
     """
-    return sorted(seriesList, key=safeAvg)[-n:]
+    return highest(seriesList, n, seriesMean)
 
 
 def lowestAverage(requestContext, seriesList, n=1):
@@ -2293,7 +2287,7 @@ def lowestAverage(requestContext, seriesList, n=1):
     Draws the bottom 5 servers with the lowest average value.
 
     """
-    return sorted(seriesList, key=safeAvg)[:n]
+    return lowest(seriesList, n, seriesMean)
 
 
 def averageAbove(requestContext, seriesList, n):
@@ -2311,7 +2305,7 @@ def averageAbove(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeAvg(series)
+        val = seriesMean(series)
         if val is not None and val >= n:
             results.append(series)
     return results
@@ -2332,7 +2326,7 @@ def averageBelow(requestContext, seriesList, n):
     """
     results = []
     for series in seriesList:
-        val = safeAvg(series)
+        val = seriesMean(series)
         if val is None or val <= n:
             results.append(series)
     return results
@@ -2456,6 +2450,9 @@ def removeAboveValue(requestContext, seriesList, n):
     for s in seriesList:
         s.name = 'removeAboveValue(%s, %g)' % (s.name, n)
         s.pathExpression = s.name
+        maximum = seriesMax(s)
+        if maximum is None or maximum <= n:
+            continue
         for (index, val) in enumerate(s):
             if val is None:
                 continue
@@ -2494,6 +2491,9 @@ def removeBelowValue(requestContext, seriesList, n):
     for s in seriesList:
         s.name = 'removeBelowValue(%s, %g)' % (s.name, n)
         s.pathExpression = s.name
+        minimum = seriesMin(s)
+        if minimum is None or minimum >= n:
+            continue
         for index, val in enumerate(s):
             if val is None:
                 continue
@@ -2549,7 +2549,7 @@ def sortByTotal(requestContext, seriesList):
     Sorts the list of metrics by the sum of values across the time period
     specified.
     """
-    return list(sorted(seriesList, key=safeSum, reverse=True))
+    return list(sorted(seriesList, key=seriesSum, reverse=True))
 
 
 def sortByMaxima(requestContext, seriesList):
@@ -2565,7 +2565,7 @@ def sortByMaxima(requestContext, seriesList):
         &target=sortByMaxima(server*.instance*.memory.free)
 
     """
-    return list(sorted(seriesList, key=max))
+    return list(sorted(seriesList, key=seriesMax))
 
 
 def sortByMinima(requestContext, seriesList):
@@ -2580,7 +2580,7 @@ def sortByMinima(requestContext, seriesList):
         &target=sortByMinima(server*.instance*.memory.free)
 
     """
-    return list(sorted(seriesList, key=min))
+    return list(sorted(seriesList, key=seriesMin))
 
 
 def useSeriesAbove(requestContext, seriesList, value, search, replace):
@@ -2641,20 +2641,10 @@ def mostDeviant(requestContext, seriesList, n):
     Draws the 5 instances furthest from the average memory free.
     """
 
-    deviants = []
-    for series in seriesList:
-        mean = safeAvg(series)
-        if mean is None:
-            continue
-        square_sum = sum([(value - mean) ** 2 for value in series
-                          if value is not None])
-        sigma = safeDiv(square_sum, safeLen(series))
-        if sigma is None:
-            continue
-        deviants.append((sigma, series))
-    return [series for sig, series in sorted(deviants,  # sort by sigma
-                                             key=itemgetter(0),
-                                             reverse=True)][:n]
+    deviants = [(variance, series) for variance, series in
+                zip(map(safeVariance, seriesList), seriesList)
+                if variance is not None]
+    return [series for _, series in largest(deviants, n, itemgetter(0))]
 
 
 def stdev(requestContext, seriesList, points, windowTolerance=0.1):
@@ -4197,6 +4187,44 @@ def pieMinimum(requestContext, series):
     return safeMin(series)
 
 
+def windowPreview(windowSize):
+    """
+    Preview of the moving* functions, when their window is a time interval.
+    Windows in points depend on the step of the series.
+    """
+    if isinstance(windowSize, str):
+        return to_seconds(parseTimeOffset(windowSize)) or None
+    return None
+
+
+def absoluteWindowPreview(windowSize):
+    """Same as ``windowPreview``, for exponentialMovingAverage."""
+    seconds = windowPreview(windowSize)
+    return abs(seconds) if seconds is not None else None
+
+
+def weekPreview(delta=3):
+    """Preview of the holtWinters* functions, bootstrapped over a week."""
+    return 7 * 86400
+
+
+# Functions evaluating their first argument again over a preview window before
+# the requested range. ``previewSeconds`` computes its length from the other
+# arguments of the function, and ``previewReplaces`` tells that the series of
+# the first argument are only checked for emptiness: the evaluator can pass
+# the series of the preview instead, fetching them only once.
+for func in (movingAverage, movingSum, movingMin, movingMax, movingMedian):
+    func.previewSeconds = windowPreview
+    func.previewReplaces = True
+exponentialMovingAverage.previewSeconds = absoluteWindowPreview
+exponentialMovingAverage.previewReplaces = True
+for func in (holtWintersForecast, holtWintersConfidenceBands,
+             holtWintersConfidenceArea):
+    func.previewSeconds = weekPreview
+    func.previewReplaces = True
+holtWintersAberration.previewSeconds = weekPreview
+
+
 PieFunctions = {
     'average': pieAverage,
     'maximum': pieMaximum,
@@ -4346,4 +4374,5 @@ SeriesFunctions = {
 }
 
 from .app import app  # noqa
-from .evaluator import evaluateTarget, evaluateTokens, pathsFromTarget  # noqa
+from .evaluator import (evaluateTarget, evaluateTokens, parseTarget,  # noqa
+                        pathsFromTarget)
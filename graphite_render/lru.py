@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """
+    Thread-safe least recently used cache, bounded in number of entries and
+    in total size of the entries.
+
+    ``sizeof(key, value)`` estimates the size of an entry, in whatever unit
+    ``max_size`` is expressed in. Entries can also be given a time to live,
+    in seconds. Hits, misses and evictions are counted.
+    """
+    def __init__(self, max_items=None, max_size=None, sizeof=None):
+        self.max_items = max_items
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, size, expires = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                self.size -= size
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(key, value) if self.sizeof is not None else 0
+        if self.max_size is not None and size > self.max_size:
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = value, size, expires
+            self.size += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self.lock:
+            try:
+                value, size, _ = self.entries.pop(key)
+            except KeyError:
+                return default
+            self.size -= size
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _evict(self):
+        while self.entries and (
+            (self.max_items is not None and
+             len(self.entries) > self.max_items) or
+            (self.max_size is not None and self.size > self.max_size)
+        ):
+            _, (value, size, _) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'items': len(self.entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
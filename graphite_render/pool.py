@@ -0,0 +1,96 @@
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+
+class FetchPool(object):
+    """
+    Thread pool overlapping blocking storage calls (disk reads, carbonlink
+    queries...).
+
+    ``max_workers`` bounds the total number of concurrent calls, and
+    ``max_workers_per_key`` optionally bounds the concurrent calls sharing
+    the same key, so that one slow backend can't hold every worker: calls
+    over the limit of their key wait in a queue of the key, without a
+    worker, until one of its running calls completes.
+    """
+    def __init__(self, max_workers, max_workers_per_key=None,
+                 thread_name_prefix='graphite-render-fetch'):
+        self.max_workers = max_workers
+        if max_workers_per_key is not None and (
+                max_workers_per_key >= max_workers):
+            max_workers_per_key = None
+        self.max_workers_per_key = max_workers_per_key
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix=thread_name_prefix)
+        self.running = defaultdict(int)
+        self.pending = defaultdict(deque)
+        self.lock = Lock()
+
+    def submit(self, func, item, key=None):
+        if self.max_workers_per_key is None:
+            return self.executor.submit(func, item)
+        future = Future()
+        with self.lock:
+            if self.running[key] >= self.max_workers_per_key:
+                self.pending[key].append((future, func, item))
+                return future
+            self.running[key] += 1
+        self._start(future, func, item, key)
+        return future
+
+    def _start(self, future, func, item, key):
+        # Calls cancelled while queued are skipped
+        while not future.set_running_or_notify_cancel():
+            call = self._next(key)
+            if call is None:
+                return
+            future, func, item = call
+        try:
+            call = self.executor.submit(func, item)
+        except Exception as e:  # Shut down
+            future.set_exception(e)
+            self._done(key, None)
+            return
+        call.add_done_callback(partial(self._copy, future))
+        call.add_done_callback(partial(self._done, key))
+
+    @staticmethod
+    def _copy(future, call):
+        exception = call.exception()
+        if exception is None:
+            future.set_result(call.result())
+        else:
+            future.set_exception(exception)
+
+    def _next(self, key):
+        """Pops the next queued call of a key, or releases its slot."""
+        with self.lock:
+            if self.pending[key]:
+                return self.pending[key].popleft()
+            self.running[key] -= 1
+            if not self.running[key]:
+                del self.running[key]
+                del self.pending[key]
+        return None
+
+    def _done(self, key, call):
+        next_call = self._next(key)
+        if next_call is not None:
+            self._start(*next_call, key=key)
+
+    def map(self, func, items, key=None):
+        """
+        Calls ``func`` on every item concurrently and returns the results in
+        the order of ``items``. Exceptions are raised in the caller.
+        """
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        futures = [self.submit(func, item, key(item) if key else None)
+                   for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
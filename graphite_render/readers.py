@@ -1,3 +1,5 @@
+from concurrent.futures import as_completed
+
 from structlog import get_logger
 
 from .intervals import IntervalSet
@@ -6,10 +8,21 @@ logger = get_logger()
 
 
 class MultiReader(object):
-    __slots__ = ('nodes',)
-
-    def __init__(self, nodes):
+    """
+    Reader of the leaf nodes found under the same path by several finders
+    or in several directories, merging their series.
+
+    With a ``fetch_pool`` (see :class:`graphite_render.pool.FetchPool`) the
+    nodes are fetched concurrently. With ``first_sufficient``, the first
+    series covering the whole requested interval without gaps is returned
+    as is, without waiting for the other nodes.
+    """
+    __slots__ = ('nodes', 'fetch_pool', 'first_sufficient')
+
+    def __init__(self, nodes, fetch_pool=None, first_sufficient=False):
         self.nodes = nodes
+        self.fetch_pool = fetch_pool
+        self.first_sufficient = first_sufficient
 
     def get_intervals(self):
         interval_sets = []
@@ -18,64 +31,107 @@ class MultiReader(object):
         return IntervalSet(sorted(interval_sets))
 
     def fetch(self, startTime, endTime, now=None, requestContext=None):
-        # Start the fetch on each node
-        results = []
-
-        for node in self.nodes:
+        def fetch(node):
             try:
-                results.append(node.fetch(startTime, endTime, now,
-                                          requestContext))
+                return node.fetch(startTime, endTime, now, requestContext)
             except Exception:
                 logger.error("fetch error", exc_info=True)
-
-        data = None
-        for r in filter(None, results):
-            if data is None:
-                data = r
-            else:
-                data = self.merge(data, r)
-        if data is None:
+                return None
+
+        def sufficient(result):
+            return (result and self.first_sufficient and
+                    covers(result, startTime, endTime))
+
+        if self.fetch_pool is None or len(self.nodes) < 2:
+            results = []
+            for node in self.nodes:
+                result = fetch(node)
+                if sufficient(result):
+                    return result
+                results.append(result)
+        else:
+            futures = [self.fetch_pool.submit(fetch, node)
+                       for node in self.nodes]
+            for future in as_completed(futures):
+                result = future.result()
+                if sufficient(result):
+                    for pending in futures:
+                        pending.cancel()
+                    return result
+            # In the order of the nodes, which decides the merge priority
+            results = [future.result() for future in futures]
+
+        results = [r for r in results if r]
+        if not results:
             raise Exception("All sub-fetches failed")
-        return data
-
-    def merge(self, results1, results2):
-        # Ensure results1 is finer than results2
-        if results1[0][2] > results2[0][2]:
-            results1, results2 = results2, results1
-
-        time_info1, values1 = results1
-        time_info2, values2 = results2
-        start1, end1, step1 = time_info1
-        start2, end2, step2 = time_info2
-
-        step = step1  # finest step
-        start = min(start1, start2)  # earliest start
-        end = max(end1, end2)  # latest end
+        if len(results) == 1:
+            return results[0]
+        return self.merge(*results)
+
+    def merge(self, *results):
+        """
+        Merges the results of several fetches into a single series at the
+        finest step, spanning all of them. Where several series have a
+        value, the value of the finest series wins, then the value of the
+        first one.
+        """
+        # sorted() is stable: series with the same step keep their order
+        results = sorted(results, key=lambda result: result[0][2])
+        start = min(time_info[0] for time_info, _ in results)
+        end = max(time_info[1] for time_info, _ in results)
+        step = results[0][0][2]  # finest step
         time_info = start, end, step
-        values = []
-
-        t = start
-        while t < end:
-            # Look for the finer precision value first if available
-            i1 = (t - start1) // step1
+        length = -((start - end) // step)
 
-            if len(values1) > i1:
-                v1 = values1[i1]
+        values = None
+        for result in results:
+            aligned = align(result, start, step, length)
+            if values is None:
+                values = aligned
             else:
-                v1 = None
-
-            if v1 is None:
-                i2 = (t - start2) // step2
-
-                if len(values2) > i2:
-                    v2 = values2[i2]
-                else:
-                    v2 = None
+                values = [value if value is not None else other
+                          for value, other in zip(values, aligned)]
+            if None not in values:
+                break
 
-                values.append(v2)
-            else:
-                values.append(v1)
+        return (time_info, values)
 
-            t += step
 
-        return (time_info, values)
+def covers(result, startTime, endTime):
+    """
+    Whether a fetch result has values for the whole ``[startTime, endTime]``
+    interval, at its own step.
+    """
+    (start, end, step), values = result
+    return (start <= startTime + step and end >= endTime and
+            len(values) >= (end - start) // step and None not in values)
+
+
+def align(result, start, step, length):
+    """
+    Returns the values of a fetch result on a finer or equal step, over
+    ``length`` intervals from ``start``. Intervals the result doesn't cover
+    are None.
+    """
+    (start1, _, step1), values1 = result
+    offset, misaligned = divmod(start1 - start, step)
+    if misaligned or step1 % step:
+        # Steps that don't line up: look the values up one by one
+        count = len(values1)
+        return [values1[i] if 0 <= i < count else None
+                for i in [(t - start1) // step1
+                          for t in range(start, start + length * step, step)]]
+
+    ratio = step1 // step
+    if ratio == 1 and offset == 0:
+        values = list(values1[:length])
+        values.extend([None] * (length - len(values)))
+        return values
+
+    # Each value of the coarser series is repeated ``ratio`` times
+    values = [None] * length
+    for k in range(ratio):
+        first = offset + k
+        count = min(len(values1), max(0, -((first - length) // ratio)))
+        values[first:first + count * ratio:ratio] = values1[:count]
+    return values
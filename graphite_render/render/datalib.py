@@ -11,7 +11,10 @@ distributed under the License is distributed on an "AS IS" BASIS,
 WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
+import asyncio
+from array import array
 from collections import defaultdict
+from math import isnan
 
 from structlog import get_logger
 
@@ -19,6 +22,42 @@ from ..utils import epoch
 
 logger = get_logger()
 
+NaN = float('nan')
+
+
+class SeriesStats(object):
+    """
+    Statistics of the values of a series, ignoring None values. They are all
+    None, except ``count``, when there are no values.
+
+    They are computed over the values the series iterates over, which are
+    consolidated, except ``last``: the "current" value of a series is its
+    last raw value.
+    """
+    __slots__ = ('sum', 'count', 'min', 'max', 'mean', 'last')
+
+    def __init__(self, series):
+        values = [v for v in series if v is not None]
+        self.count = len(values)
+        if not values:
+            self.sum = self.min = self.max = self.mean = self.last = None
+            return
+        self.sum = sum(values)
+        self.min = min(values)
+        self.max = max(values)
+        self.mean = float(self.sum) / self.count
+        self.last = next(v for v in reversed(series) if v is not None)
+
+
+def seriesStats(series):
+    """
+    Returns the :class:`SeriesStats` of a series, shared with the other
+    callers when it's a :class:`TimeSeries`.
+    """
+    if isinstance(series, TimeSeries):
+        return series.stats()
+    return SeriesStats(series)
+
 
 class TimeSeries(list):
     def __init__(self, name, start, end, step, values, consolidate='average'):
@@ -31,6 +70,60 @@ class TimeSeries(list):
         self.valuesPerPoint = 1
         self.options = {}
         self.pathExpression = name
+        self._stats = None
+
+    def stats(self):
+        """
+        Returns the :class:`SeriesStats` of the values of the series, as
+        iterated over. They are computed once and kept until the series is
+        modified or consolidated differently.
+
+        Only appending values keeps the number of values growing, so it's
+        caught by the length of the series. Any other change discards the
+        statistics.
+        """
+        key = (len(self), self.valuesPerPoint, self.consolidationFunc)
+        cached = getattr(self, '_stats', None)
+        if cached is None or cached[0] != key:
+            cached = key, SeriesStats(self)
+            self._stats = cached
+        return cached[1]
+
+    def __setitem__(self, index, value):
+        self._stats = None
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        self._stats = None
+        list.__delitem__(self, index)
+
+    def __imul__(self, n):
+        self._stats = None
+        return list.__imul__(self, n)
+
+    def insert(self, index, value):
+        self._stats = None
+        list.insert(self, index, value)
+
+    def pop(self, index=-1):
+        self._stats = None
+        return list.pop(self, index)
+
+    def remove(self, value):
+        self._stats = None
+        list.remove(self, value)
+
+    def reverse(self):
+        self._stats = None
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self._stats = None
+        list.sort(self, *args, **kwargs)
+
+    def clear(self):
+        self._stats = None
+        list.clear(self)
 
     def __eq__(self, other):
         if isinstance(other, TimeSeries):
@@ -47,66 +140,238 @@ class TimeSeries(list):
                      self.valuesPerPoint, self.options) ==
                     (other.name, other.start, other.step,
                      other.consolidationFunc, other.valuesPerPoint,
-                     other.options)) and list.__eq__(self, other) and color_eq
+                     other.options)) and self._values_eq(other) and color_eq
         return False
 
+    def _values_eq(self, other):
+        if isinstance(other, ArrayTimeSeries):
+            return list(self._values()) == list(other._values())
+        return list.__eq__(self, other)
+
+    def _values(self):
+        """Iterate over the raw, unconsolidated values."""
+        return list.__iter__(self)
+
     def __iter__(self):
         if self.valuesPerPoint > 1:
-            return self.__consolidatingGenerator(list.__iter__(self))
+            return iter(self._consolidated())
         else:
-            return list.__iter__(self)
+            return self._values()
 
     def consolidate(self, valuesPerPoint):
         self.valuesPerPoint = int(valuesPerPoint)
 
-    def __consolidatingGenerator(self, gen):
-        buf = []
-        for x in gen:
-            buf.append(x)
-            if len(buf) == self.valuesPerPoint:
-                while None in buf:
-                    buf.remove(None)
-                if buf:
-                    yield self.__consolidate(buf)
-                    buf = []
-                else:
-                    yield None
-        while None in buf:
-            buf.remove(None)
-        if buf:
-            yield self.__consolidate(buf)
-        else:
-            yield None
-        return
-
-    def __consolidate(self, values):
-        usable = [v for v in values if v is not None]
-        if not usable:
-            return None
-        if self.consolidationFunc == 'sum':
-            return sum(usable)
-        if self.consolidationFunc == 'average':
-            return float(sum(usable)) / len(usable)
-        if self.consolidationFunc == 'max':
-            return max(usable)
-        if self.consolidationFunc == 'min':
-            return min(usable)
-        raise Exception(
-            "Invalid consolidation function: '%s'" % self.consolidationFunc)
+    def _consolidated(self):
+        return consolidate(self, self.valuesPerPoint, self.consolidationFunc)
 
     def __repr__(self):
         return 'TimeSeries(name=%s, start=%s, end=%s, step=%s)' % (
             self.name, self.start, self.end, self.step)
 
 
+class ArrayTimeSeries(TimeSeries):
+    """
+    A TimeSeries keeping its values in a float64 buffer instead of a list of
+    Python objects, with NaN standing for missing points.
+
+    It takes about a quarter of the memory of a list of floats and behaves
+    like a list of values (with None for missing points) for functions that
+    index, slice, iterate over or modify it.
+    """
+    def __init__(self, name, start, end, step, values, consolidate='average'):
+        super(ArrayTimeSeries, self).__init__(name, start, end, step, (),
+                                              consolidate)
+        self.buffer = to_buffer(values)
+
+    def _values_eq(self, other):
+        return list(self._values()) == list(other._values())
+
+    def _values(self):
+        return (None if v != v else v for v in self.buffer)
+
+    def _consolidated(self):
+        return consolidate(self.buffer, self.valuesPerPoint,
+                           self.consolidationFunc, usable=_usable_buffer)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __bool__(self):
+        return len(self.buffer) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return from_buffer(self.buffer[index])
+        value = self.buffer[index]
+        return None if value != value else value
+
+    def __setitem__(self, index, value):
+        self._stats = None
+        if isinstance(index, slice):
+            self.buffer[index] = to_buffer(value)
+        else:
+            self.buffer[index] = NaN if value is None else value
+
+    def __delitem__(self, index):
+        self._stats = None
+        del self.buffer[index]
+
+    def __contains__(self, value):
+        if value is None:
+            return any(v != v for v in self.buffer)
+        return value in self.buffer
+
+    def __reversed__(self):
+        return (None if v != v else v for v in reversed(self.buffer))
+
+    def __add__(self, other):
+        return from_buffer(self.buffer) + list(other)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __reduce_ex__(self, protocol):
+        state = dict((k, v) for k, v in self.__dict__.items()
+                     if k != 'buffer')
+        return (_rebuild_array_series,
+                (self.name, self.start, self.end, self.step, self.buffer,
+                 self.consolidationFunc), state)
+
+    def append(self, value):
+        self.buffer.append(NaN if value is None else value)
+
+    def extend(self, values):
+        self.buffer.extend(to_buffer(values))
+
+    def insert(self, index, value):
+        self._stats = None
+        self.buffer.insert(index, NaN if value is None else value)
+
+    def pop(self, index=-1):
+        self._stats = None
+        value = self.buffer.pop(index)
+        return None if value != value else value
+
+    def remove(self, value):
+        self._stats = None
+        del self.buffer[self.index(value)]
+
+    def index(self, value, *args):
+        return from_buffer(self.buffer).index(value, *args)
+
+    def count(self, value):
+        if value is None:
+            return sum(1 for v in self.buffer if v != v)
+        return self.buffer.count(value)
+
+    def reverse(self):
+        self._stats = None
+        self.buffer.reverse()
+
+    def sort(self, *args, **kwargs):
+        self._stats = None
+        values = from_buffer(self.buffer)
+        values.sort(*args, **kwargs)
+        self.buffer = to_buffer(values)
+
+    def clear(self):
+        self._stats = None
+        del self.buffer[:]
+
+    def copy(self):
+        return from_buffer(self.buffer)
+
+
+def _average(values):
+    return float(sum(values)) / len(values)
+
+
+def _last(values):
+    return values[-1]
+
+
+consolidationFuncs = {
+    'sum': sum,
+    'average': _average,
+    'max': max,
+    'min': min,
+    'last': _last,
+}
+
+
+def _usable_list(values):
+    if None in values:
+        return [v for v in values if v is not None]
+    return values
+
+
+def _usable_buffer(values):
+    if any(map(isnan, values)):
+        return [v for v in values if v == v]
+    return values
+
+
+def consolidate(values, valuesPerPoint, consolidationFunc='average',
+                usable=_usable_list):
+    """
+    Consolidates ``values`` by blocks of ``valuesPerPoint`` consecutive
+    values and returns the list of consolidated values.
+
+    Missing values are ignored and blocks without any value consolidate to
+    None. Like the series iteration it backs, the result always ends with
+    the consolidation of the trailing (possibly empty) partial block.
+    """
+    func = consolidationFuncs.get(consolidationFunc)
+    length = len(values)
+    result = []
+    for index in range(0, length - length % valuesPerPoint + 1,
+                       valuesPerPoint):
+        block = usable(values[index:index + valuesPerPoint])
+        if not block:
+            result.append(None)
+        elif func is None:
+            raise Exception(
+                "Invalid consolidation function: '%s'" % consolidationFunc)
+        else:
+            result.append(func(block))
+    return result
+
+
+def _rebuild_array_series(name, start, end, step, buffer, consolidate):
+    return ArrayTimeSeries(name, start, end, step, buffer, consolidate)
+
+
+def is_buffer(values):
+    return isinstance(values, array) and values.typecode == 'd'
+
+
+def to_buffer(values):
+    """Pack values into a float64 array, missing points becoming NaN."""
+    if is_buffer(values):
+        return array('d', values)
+    return array('d', [NaN if v is None else v for v in values])
+
+
+def from_buffer(buffer):
+    """Unpack a float64 array into a list of values, NaN becoming None."""
+    return [None if v != v else v for v in buffer]
+
+
 class DataStore(object):
     """
     Simple object to store results of multi fetches.
     Also aids in looking up data by pathExpressions.
+
+    With ``array_series`` set, fetched values are kept in float64 buffers and
+    handed out as :class:`ArrayTimeSeries`.
     """
-    def __init__(self):
+    def __init__(self, array_series=False):
+        # Path expressions fetched into the store
+        self.path_exprs = set()
         self.paths = defaultdict(set)
         self.data = defaultdict(list)
+        self.array_series = array_series
 
     def get_paths(self, path_expr):
         """
@@ -127,17 +392,21 @@ class DataStore(object):
         # Add data to path
         for expr in exprs:
             self.paths[expr].add(path)
+        if self.array_series and not is_buffer(data):
+            # Buffers returned by readers are only copied into the series
+            data = to_buffer(data)
         self.data[path].append({
             'time_info': time_info,
             'values': data
         })
 
     def get_series_list(self, path_expr):
+        series_class = ArrayTimeSeries if self.array_series else TimeSeries
         series_list = []
         for path in self.get_paths(path_expr):
             for data in self.data.get(path):
                 start, end, step = data['time_info']
-                series = TimeSeries(path, start, end, step, data['values'])
+                series = series_class(path, start, end, step, data['values'])
                 series.pathExpression = path_expr
                 series_list.append(series)
         return series_list
@@ -145,34 +414,26 @@ class DataStore(object):
 
 def fetchData(requestContext, pathExprs):
     from ..app import app
-    startTime = int(epoch(requestContext['startTime']))
-    endTime = int(epoch(requestContext['endTime']))
-    if 'now' in requestContext:
-        now = int(epoch(requestContext['now']))
-    else:
-        now = None
-
     # Convert to list if given single path
     if not isinstance(pathExprs, list):
         pathExprs = [pathExprs]
 
-    data_store = DataStore()
-    multi_nodes = defaultdict(list)
-    single_nodes = []
+    prefetched = requestContext.get('prefetched', {}).get(
+        fetch_key(requestContext))
+    if prefetched is not None and prefetched.path_exprs.issuperset(pathExprs):
+        return prefetched
 
-    path_to_exprs = defaultdict(list)
+    event_loop = app.config['GRAPHITE'].get('event_loop')
+    if event_loop is not None:
+        return event_loop.run(fetchDataAsync(requestContext, pathExprs))
 
-    # Group nodes that support multiple fetches
-    for pathExpr in pathExprs:
-        for node in app.store.find(pathExpr, startTime, endTime):
-            if not node.is_leaf:
-                continue
-            if node.path not in path_to_exprs:
-                if hasattr(node, '__fetch_multi__'):
-                    multi_nodes[node.__fetch_multi__].append(node)
-                else:
-                    single_nodes.append(node)
-            path_to_exprs[node.path].append(pathExpr)
+    startTime, endTime, now = fetch_times(requestContext)
+
+    data_store = new_data_store()
+    data_store.path_exprs.update(pathExprs)
+    found = [(pathExpr, app.store.find(pathExpr, startTime, endTime))
+             for pathExpr in pathExprs]
+    multi_nodes, single_nodes, path_to_exprs = group_nodes(found)
 
     # Multi fetches
     for finder in app.store.finders:
@@ -189,12 +450,135 @@ def fetchData(requestContext, pathExprs):
         for path, values in series.items():
             data_store.add_data(path, time_info, values,
                                 path_to_exprs[path])
+        # Nodes left out by the finder are fetched one by one
+        single_nodes.extend(node for node in nodes if node.path not in series)
+
+    # Let finders batch the work shared by single fetches
+    for finder in app.store.finders:
+        if hasattr(finder, 'prefetch'):
+            finder.prefetch(single_nodes)
+
+    # Single fetches
+    def fetch(node):
+        return node.path, node.fetch(startTime, endTime, now, requestContext)
+
+    fetch_pool = app.config['GRAPHITE'].get('fetch_pool')
+    if fetch_pool is None:
+        fetches = [fetch(node) for node in single_nodes]
+    else:
+        fetches = fetch_pool.map(fetch, single_nodes, key=reader_type)
+    add_fetches(data_store, fetches, path_to_exprs, startTime, endTime)
+
+    return data_store
+
+
+async def fetchDataAsync(requestContext, pathExprs):
+    """
+    Same as :func:`fetchData`, as a coroutine: finders are queried and nodes
+    fetched concurrently, through :mod:`graphite_render.aio`.
+    """
+    from .. import aio
+    from ..app import app
+    startTime, endTime, now = fetch_times(requestContext)
+
+    # Convert to list if given single path
+    if not isinstance(pathExprs, list):
+        pathExprs = [pathExprs]
+
+    data_store = new_data_store()
+    data_store.path_exprs.update(pathExprs)
+    found = await asyncio.gather(*[
+        aio.find(app.store, pathExpr, startTime, endTime)
+        for pathExpr in pathExprs])
+    multi_nodes, single_nodes, path_to_exprs = group_nodes(
+        zip(pathExprs, found))
+
+    # Multi fetches
+    async def fetch_multi(finder, nodes):
+        try:
+            return await aio.call(finder.fetch_multi, nodes, startTime,
+                                  endTime, now, requestContext)
+        except TypeError:
+            return await aio.call(finder.fetch_multi, nodes, startTime,
+                                  endTime)
+
+    multi_fetches = [(finder, multi_nodes[finder.__fetch_multi__])
+                     for finder in app.store.finders
+                     if hasattr(finder, '__fetch_multi__') and
+                     multi_nodes[finder.__fetch_multi__]]
+    results = await asyncio.gather(*[fetch_multi(finder, nodes)
+                                     for finder, nodes in multi_fetches])
+    for (_, nodes), (time_info, series) in zip(multi_fetches, results):
+        for path, values in series.items():
+            data_store.add_data(path, time_info, values,
+                                path_to_exprs[path])
+        # Nodes left out by the finder are fetched one by one
+        single_nodes.extend(node for node in nodes if node.path not in series)
+
+    # Let finders batch the work shared by single fetches
+    await asyncio.gather(*[aio.call(finder.prefetch, single_nodes)
+                           for finder in app.store.finders
+                           if hasattr(finder, 'prefetch')])
 
     # Single fetches
-    fetches = [
-        (node.path, node.fetch(startTime, endTime, now, requestContext))
-        for node in single_nodes
-    ]
+    async def fetch(node):
+        return node.path, await aio.fetch(node, startTime, endTime, now,
+                                          requestContext)
+
+    fetches = await asyncio.gather(*[fetch(node) for node in single_nodes])
+    add_fetches(data_store, fetches, path_to_exprs, startTime, endTime)
+
+    return data_store
+
+
+def fetch_key(requestContext):
+    """Key of the data fetched for a request context, see ``prefetched``."""
+    return (requestContext['startTime'], requestContext['endTime'],
+            requestContext.get('now'))
+
+
+def fetch_times(requestContext):
+    """Returns the start, end and current times of a fetch, in seconds."""
+    startTime = int(epoch(requestContext['startTime']))
+    endTime = int(epoch(requestContext['endTime']))
+    if 'now' in requestContext:
+        now = int(epoch(requestContext['now']))
+    else:
+        now = None
+    return startTime, endTime, now
+
+
+def new_data_store():
+    from ..app import app
+    render_conf = app.config['GRAPHITE'].get('render') or {}
+    return DataStore(array_series=render_conf.get('array_series', False))
+
+
+def group_nodes(found):
+    """
+    Groups the nodes found for ``(pathExpr, nodes)`` pairs by the way they
+    are fetched. Returns the nodes supporting multiple fetches by key, the
+    other nodes, and the path expressions of every path.
+    """
+    multi_nodes = defaultdict(list)
+    single_nodes = []
+    path_to_exprs = defaultdict(list)
+
+    # Group nodes that support multiple fetches
+    for pathExpr, nodes in found:
+        for node in nodes:
+            if not node.is_leaf:
+                continue
+            if node.path not in path_to_exprs:
+                if hasattr(node, '__fetch_multi__'):
+                    multi_nodes[node.__fetch_multi__].append(node)
+                else:
+                    single_nodes.append(node)
+            path_to_exprs[node.path].append(pathExpr)
+    return multi_nodes, single_nodes, path_to_exprs
+
+
+def add_fetches(data_store, fetches, path_to_exprs, startTime, endTime):
     for path, results in fetches:
         if not results:
             logger.info("no results", path=path, start=startTime,
@@ -208,10 +592,15 @@ def fetchData(requestContext, pathExprs):
                             "'%s': %s" % (path, e))
         data_store.add_data(path, time_info, values, path_to_exprs[path])
 
-    return data_store
+
+def reader_type(node):
+    """Key grouping the nodes read by the same storage backend."""
+    return type(getattr(node, 'reader', node))
 
 
 def nonempty(series):
+    if isinstance(series, array):
+        return any(v == v for v in series)
     for value in series:
         if value is not None:
             return True
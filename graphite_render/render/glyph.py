@@ -21,7 +21,7 @@ from io import BytesIO
 from urllib.parse import unquote_plus
 from zoneinfo import ZoneInfo
 
-from .datalib import TimeSeries
+from .datalib import seriesStats, TimeSeries
 from ..utils import to_seconds
 
 # Lazy import for cairocffi - only loaded when actually used in the render pipeline
@@ -2184,6 +2184,31 @@ def safeSum(values):
     return sum(safeArgs(values))
 
 
+def isFinite(value):
+    return (value is not None and not math.isnan(value) and
+            not math.isinf(value))
+
+
+def seriesMin(series):
+    """
+    Same as ``safeMin(series)``, through the statistics of the series. A
+    finite minimum is also the minimum of the finite values: comparisons
+    with NaN are false, so it's only picked when it comes first.
+    """
+    minimum = seriesStats(series).min
+    if isFinite(minimum):
+        return minimum
+    return safeMin(series)
+
+
+def seriesMax(series):
+    """Same as ``safeMax(series)``, see :func:`seriesMin`."""
+    maximum = seriesStats(series).max
+    if isFinite(maximum):
+        return maximum
+    return safeMax(series)
+
+
 def dataLimits(data, drawNullAsZero=False, stacked=False):
     """Return the range of values in data as (yMinValue, yMaxValue).
 
@@ -2193,7 +2218,7 @@ def dataLimits(data, drawNullAsZero=False, stacked=False):
     finiteData = [series for series in data
                   if not series.options.get('drawAsInfinite')]
 
-    yMinValue = safeMin(safeMin(series) for series in finiteData)
+    yMinValue = safeMin(seriesMin(series) for series in finiteData)
 
     if yMinValue is None:
         # This can only happen if there are no valid, non-infinite data.
@@ -2210,7 +2235,7 @@ def dataLimits(data, drawNullAsZero=False, stacked=False):
             sumSeries.append(safeSum(series[i] for series in finiteData))
         yMaxValue = safeMax(sumSeries)
     else:
-        yMaxValue = safeMax(safeMax(series) for series in finiteData)
+        yMaxValue = safeMax(seriesMax(series) for series in finiteData)
 
     if yMaxValue < 0.0 and drawNullAsZero and missingValues:
         yMaxValue = 0.0
@@ -0,0 +1,253 @@
+"""
+Recursive-descent parser for render targets.
+
+This is a hand-written equivalent of the pyparsing grammar in
+:mod:`graphite_render.render.grammar`: it accepts the same targets and
+produces the same token structure, but parses an order of magnitude faster
+and doesn't need pyparsing to be imported at all.
+"""
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+BOOLEAN = re.compile(r'(?i)(true|false)(?![A-Za-z0-9_$])')
+
+# A number is only a number when it's followed by ',', ')' or the end of the
+# line: '1.2.3' or '1e5x' are metric paths.
+NUMBER = re.compile(
+    r'(-?\d+)(\.\d+)?(?:[eE](-?\d+))?'
+    r'(?=[ \t\n\r]*[,)]|[ \t\r]*(?:\n|\Z))'
+)
+
+# Same as pyparsing's quoted_string, the closing quote is matched separately.
+STRINGS = {
+    '"': re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'),
+    "'": re.compile(r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"),
+}
+
+SYMBOLS = '''(){},=.'"\\'''
+METRIC_CHARS = ''.join(chr(c) for c in range(33, 127)
+                       if chr(c) not in SYMBOLS)
+_partial = r'(?:\\[{0}]|[{1}])+'.format(re.escape(SYMBOLS),
+                                        re.escape(METRIC_CHARS))
+_element = r'(?:{0}|\{{{0}(?:,{0})*\}})+'.format(_partial)
+PATH_EXPRESSION = re.compile(r'{0}(?:\.{0})*'.format(_element))
+ESCAPED_CHAR = re.compile(r'\\(.)')
+
+# Rough memory footprint of parsed tokens, per character of the target.
+PARSED_BYTES_PER_CHAR = 200
+
+
+class ParseError(ValueError):
+    def __init__(self, target, pos=0):
+        super(ParseError, self).__init__(
+            "invalid target {0!r} at position {1}".format(target, pos))
+        self.target = target
+        self.pos = pos
+
+
+class Tokens(dict):
+    """
+    Parsed tokens. Like pyparsing's ``ParseResults``, named tokens are
+    exposed as attributes and missing ones are empty strings.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.get(name, '')
+
+    def __repr__(self):
+        return 'Tokens({0})'.format(dict.__repr__(self))
+
+
+class Parser(object):
+    def __init__(self, target):
+        self.target = target
+
+    def skip(self, pos):
+        return WHITESPACE.match(self.target, pos).end()
+
+    def literal(self, pos, char):
+        pos = self.skip(pos)
+        if self.target.startswith(char, pos):
+            return pos + 1
+        return None
+
+    def expression(self, pos):
+        return (self.template(pos) or self.call(pos) or
+                self.path_expression(pos))
+
+    def template(self, pos):
+        pos = self.skip(pos)
+        if not self.target.startswith('template', pos):
+            return None
+        pos = self.literal(pos + 8, '(')
+        if pos is None:
+            return None
+        result = self.call(pos) or self.path_expression(pos)
+        if result is None:
+            return None
+        template, pos = result
+        template = Tokens(template)
+
+        after_comma = self.literal(pos, ',')
+        if after_comma is not None:
+            result = self.literal_kwarg(after_comma)
+            if result is not None:
+                template['kwargs'], pos = self.delimited(
+                    result, self.literal_kwarg)
+            else:
+                result = self.literal_arg(after_comma)
+                if result is not None:
+                    template['args'], pos = self.delimited(
+                        result, self.literal_arg)
+
+        pos = self.literal(pos, ')')
+        if pos is None:
+            return None
+        return Tokens(template=template), pos
+
+    def call(self, pos):
+        pos = self.skip(pos)
+        match = NAME.match(self.target, pos)
+        if match is None:
+            return None
+        pos = self.literal(match.end(), '(')
+        if pos is None:
+            return None
+        call = Tokens(funcname=match.group())
+
+        # Positional arguments must come first: when the first argument is
+        # a keyword argument, the call doesn't parse.
+        if self.kwarg(pos) is None:
+            result = self.arg(pos)
+            if result is not None:
+                args = [result[0]]
+                pos = result[1]
+                while True:
+                    after_comma = self.literal(pos, ',')
+                    if after_comma is None:
+                        break
+                    result = self.kwarg(after_comma)
+                    if result is not None:
+                        call['kwargs'], pos = self.delimited(result,
+                                                             self.kwarg)
+                        break
+                    result = self.arg(after_comma)
+                    if result is None:
+                        break
+                    args.append(result[0])
+                    pos = result[1]
+                call['args'] = args
+
+        pos = self.literal(pos, ')')
+        if pos is None:
+            return None
+        return Tokens(call=call), pos
+
+    def delimited(self, result, parse):
+        items = [result[0]]
+        pos = result[1]
+        while True:
+            after_comma = self.literal(pos, ',')
+            if after_comma is None:
+                break
+            result = parse(after_comma)
+            if result is None:
+                break
+            items.append(result[0])
+            pos = result[1]
+        return items, pos
+
+    def kwarg(self, pos, arg=None):
+        pos = self.skip(pos)
+        match = NAME.match(self.target, pos)
+        if match is None:
+            return None
+        pos = self.literal(match.end(), '=')
+        if pos is None:
+            return None
+        result = (arg or self.arg)(pos)
+        if result is None:
+            return None
+        return Tokens(argname=match.group(), args=[result[0]]), result[1]
+
+    def literal_kwarg(self, pos):
+        return self.kwarg(pos, self.literal_arg)
+
+    def arg(self, pos):
+        pos = self.skip(pos)
+        match = BOOLEAN.match(self.target, pos)
+        if match is not None:
+            return Tokens(boolean=[match.group().lower()]), match.end()
+        result = self.literal_arg(pos)
+        if result is not None:
+            return result
+        result = self.expression(pos)
+        if result is not None:
+            return Tokens(expression=result[0]), result[1]
+        return None
+
+    def literal_arg(self, pos):
+        pos = self.skip(pos)
+        match = NUMBER.match(self.target, pos)
+        if match is not None:
+            integer, decimals, exponent = match.groups()
+            if exponent is not None:
+                number = Tokens(scientific=['{0}{1}e{2}'.format(
+                    integer, decimals or '', exponent)])
+            elif decimals is not None:
+                number = Tokens(float=integer + decimals)
+            else:
+                number = Tokens(integer=integer)
+            return Tokens(number=number), match.end()
+        regex = STRINGS.get(self.target[pos:pos + 1])
+        if regex is not None:
+            end = regex.match(self.target, pos).end()
+            if self.target.startswith(self.target[pos], end):
+                return Tokens(string=self.target[pos:end + 1]), end + 1
+        return None
+
+    def path_expression(self, pos):
+        pos = self.skip(pos)
+        match = PATH_EXPRESSION.match(self.target, pos)
+        if match is None:
+            return None
+        expression = match.group()
+        if '\\' in expression:
+            expression = ESCAPED_CHAR.sub(r'\1', expression)
+        return Tokens(pathExpression=expression), match.end()
+
+
+def parse(target):
+    """
+    Parses a target into the same token structure as
+    ``grammar.parse_string(target)``. Like the pyparsing grammar, anything
+    following a complete expression is ignored.
+    """
+    parser = Parser(target)
+    result = parser.expression(0)
+    if result is None:
+        raise ParseError(target, parser.skip(0))
+    return Tokens(expression=result[0])
+
+
+def get_parser(name):
+    """
+    Returns the function parsing targets for the ``parser`` setting:
+    ``pyparsing`` (the default) or ``fast``.
+    """
+    if name == 'pyparsing':
+        from .grammar import grammar
+        return grammar.parse_string
+    if name == 'fast':
+        return parse
+    raise ValueError("unknown parser {0!r}".format(name))
+
+
+def parsed_size(target, tokens):
+    return len(target) * PARSED_BYTES_PER_CHAR
@@ -0,0 +1,68 @@
+"""
+Top-N selection of series, for the highest* and lowest* functions.
+
+Selecting the N highest of M series with a heap takes O(M log N) instead of
+the O(M log M) of sorting them all, and the key of each series is computed
+once. Series without a key (None) rank below all the others.
+"""
+import heapq
+
+
+def highest(seriesList, n, key):
+    """
+    Same as ``sorted(seriesList, key=key)[-n:]``: the ``n`` series with the
+    highest keys, in ascending order. Among equal keys, the series coming
+    last are selected.
+    """
+    keys, valued, missing = _keys(seriesList, key)
+    if n <= 0:
+        return _sorted(seriesList, keys, valued, missing)[-n:]
+    # nlargest() keeps the first of equal keys: go through the series
+    # backwards to keep the last ones.
+    top = heapq.nlargest(n, reversed(valued), key=keys.__getitem__)
+    top.reverse()
+    if len(top) < n:
+        top = missing[max(len(missing) - (n - len(top)), 0):] + top
+    return [seriesList[i] for i in top]
+
+
+def lowest(seriesList, n, key):
+    """
+    Same as ``sorted(seriesList, key=key)[:n]``: the ``n`` series with the
+    lowest keys, in ascending order.
+    """
+    keys, valued, missing = _keys(seriesList, key)
+    if n <= 0:
+        return _sorted(seriesList, keys, valued, missing)[:n]
+    bottom = missing[:n]
+    if len(bottom) < n:
+        bottom += heapq.nsmallest(n - len(bottom), valued,
+                                  key=keys.__getitem__)
+    return [seriesList[i] for i in bottom]
+
+
+def largest(seriesList, n, key):
+    """
+    Same as ``sorted(seriesList, key=key, reverse=True)[:n]``: the ``n``
+    series with the highest keys, in descending order. Among equal keys, the
+    series coming first are selected.
+    """
+    keys, valued, missing = _keys(seriesList, key)
+    if n <= 0:
+        return _sorted(seriesList, keys, valued, missing, reverse=True)[:n]
+    top = heapq.nlargest(n, valued, key=keys.__getitem__)
+    top += missing[:n - len(top)]
+    return [seriesList[i] for i in top]
+
+
+def _keys(seriesList, key):
+    keys = [key(series) for series in seriesList]
+    valued = [i for i, k in enumerate(keys) if k is not None]
+    missing = [i for i, k in enumerate(keys) if k is None]
+    return keys, valued, missing
+
+
+def _sorted(seriesList, keys, valued, missing, reverse=False):
+    valued = sorted(valued, key=keys.__getitem__, reverse=reverse)
+    order = valued + missing if reverse else missing + valued
+    return [seriesList[i] for i in order]
@@ -9,8 +9,16 @@ from .utils import is_pattern
 
 
 class Store(object):
-    def __init__(self, finders=None):
+    """
+    Finds nodes across finders. Leaf nodes found several times under the
+    same path are read by a :class:`MultiReader`, created with
+    ``multi_fetch_pool`` and ``first_sufficient``.
+    """
+    def __init__(self, finders=None, multi_fetch_pool=None,
+                 first_sufficient=False):
         self.finders = finders
+        self.multi_fetch_pool = multi_fetch_pool
+        self.first_sufficient = first_sufficient
 
     def find(self, pattern, startTime=None, endTime=None, local=True):
         query = FindQuery(pattern, startTime, endTime)
@@ -22,6 +30,14 @@ class Store(object):
             for node in finder.find_nodes(query):
                 matching_nodes.add(node)
 
+        for node in self.reduce(matching_nodes):
+            yield node
+
+    def reduce(self, matching_nodes):
+        """
+        Yields the branch nodes and a single leaf node per path, reading
+        the leaves found several times with a :class:`MultiReader`.
+        """
         # Group matching nodes by their path
         nodes_by_path = defaultdict(list)
         for node in matching_nodes:
@@ -49,7 +65,8 @@ class Store(object):
             if len(leaf_nodes) == 1:
                 yield leaf_nodes.pop()
             elif len(leaf_nodes) > 1:
-                reader = MultiReader(leaf_nodes)
+                reader = MultiReader(leaf_nodes, self.multi_fetch_pool,
+                                     self.first_sufficient)
                 yield LeafNode(path, reader)
 
 
@@ -0,0 +1,126 @@
+"""
+Sliding window kernels of the moving* functions.
+
+Each kernel takes the values of a series and a window length in points, and
+returns the aggregate of every full window ``values[i - points:i]`` for ``i``
+in ``range(points, len(values))``, ignoring None values. Windows without
+values yield None.
+"""
+from bisect import bisect_left, insort
+from collections import deque
+from operator import gt, lt
+
+
+def moving_sum(values, points):
+    """
+    Moving sums, starting with the window of the first ``points`` values.
+    Windows whose values were all dropped again sum to 0.
+    """
+    window_sum = _sum(values[:points])
+    sums = [window_sum]
+    for n, last in enumerate(values[points:-1]):
+        if values[n] is not None:
+            window_sum -= values[n]
+        if last is not None:
+            window_sum = (window_sum or 0) + last
+        sums.append(window_sum)
+    return sums
+
+
+def moving_average(values, points):
+    """Moving averages, starting with the window of the first ``points``
+    values.
+    """
+    first = [v for v in values[:points] if v is not None]
+    window_sum = sum(first)
+    count = len(first)
+    averages = [_div(window_sum, count)]
+    for n, last in enumerate(values[points:-1]):
+        if values[n] is not None:
+            window_sum -= values[n]
+            count -= 1
+        if last is not None:
+            window_sum += last
+            count += 1
+        averages.append(_div(window_sum, count))
+    return averages
+
+
+def moving_min(values, points):
+    """Moving minimums, in O(n) with a monotonic queue."""
+    return _moving_extreme(values, points, gt, min)
+
+
+def moving_max(values, points):
+    """Moving maximums, in O(n) with a monotonic queue."""
+    return _moving_extreme(values, points, lt, max)
+
+
+def moving_median(values, points):
+    """
+    Moving medians: the upper median of the values of each window, which is
+    kept sorted as values enter and leave it.
+    """
+    if points < 1:
+        return _naive(values, points, _median)
+    window = []
+    medians = []
+    for value in values[:points]:
+        if value is not None:
+            insort(window, value)
+    for i in range(points, len(values)):
+        medians.append(window[len(window) // 2] if window else None)
+        if values[i] is not None:
+            insort(window, values[i])
+        old = values[i - points]
+        if old is not None:
+            # Equal values keep their insertion order: the oldest one comes
+            # first, like with a stable sort of the window.
+            del window[bisect_left(window, old)]
+    return medians
+
+
+def _moving_extreme(values, points, dominated, extreme):
+    if points < 1:
+        return _naive(values, points, extreme)
+    # Indexes of the values which can still be the extreme of a window:
+    # their values are monotonic, the first one is the extreme. Equal values
+    # are kept, the first one of a window being the one min() and max()
+    # return.
+    queue = deque()
+    extremes = []
+    for i in range(len(values) - 1):
+        value = values[i]
+        if value is not None:
+            while queue and dominated(values[queue[-1]], value):
+                queue.pop()
+            queue.append(i)
+        if i + 1 < points:
+            continue
+        if queue and queue[0] <= i - points:
+            queue.popleft()
+        extremes.append(values[queue[0]] if queue else None)
+    return extremes
+
+
+def _naive(values, points, aggregate):
+    results = []
+    for i in range(points, len(values)):
+        window = [v for v in values[i - points:i] if v is not None]
+        results.append(aggregate(window) if window else None)
+    return results
+
+
+def _median(window):
+    return sorted(window)[len(window) // 2]
+
+
+def _sum(values):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def _div(a, b):
+    if a is None or b in (0, None):
+        return None
+    return float(a) / float(b)
@@ -0,0 +1,59 @@
+import random
+from itertools import zip_longest
+
+from graphite_render.aggregation import (column_maxs, column_mins,
+                                         column_ranges, row_averages,
+                                         row_stddevs, row_sums, rows)
+from graphite_render.functions import (safeDiv, safeLen, safeMax, safeMin,
+                                       safeStdDev, safeSum)
+from graphite_render.render.datalib import TimeSeries
+
+from . import TestCase
+
+
+def reference(seriesList, aggregate):
+    """Row by row, as the combining functions were."""
+    return [aggregate(row) for row in zip_longest(*seriesList)]
+
+
+class AggregationTest(TestCase):
+    def random_series(self, rng):
+        seriesList = []
+        for i in range(rng.randint(1, 10)):
+            values = []
+            for _ in range(rng.randint(0, 20)):
+                choice = rng.random()
+                if choice < 0.2:
+                    values.append(None)
+                elif choice < 0.5:
+                    values.append(rng.randint(-3, 3))
+                else:
+                    values.append(rng.uniform(-3, 3))
+            series = TimeSeries('s{0}'.format(i), 0, len(values), 1, values)
+            if rng.random() < 0.2:
+                series.consolidate(2)
+            seriesList.append(series)
+        return seriesList
+
+    def test_random(self):
+        rng = random.Random(42)
+        for _ in range(500):
+            seriesList = self.random_series(rng)
+            for result, aggregate in [
+                (row_sums(seriesList), safeSum),
+                (row_averages(seriesList),
+                 lambda row: safeDiv(safeSum(row), safeLen(row))),
+                (row_stddevs(seriesList), safeStdDev),
+                (column_mins(seriesList), safeMin),
+                (column_maxs(seriesList), safeMax),
+            ]:
+                expected = reference(seriesList, aggregate)
+                self.assertEqual(result, expected)
+                self.assertEqual([type(v) for v in result],
+                                 [type(v) for v in expected])
+
+    def test_ranges(self):
+        seriesList = [TimeSeries('a', 0, 4, 1, [1, None, 3, None]),
+                      TimeSeries('b', 0, 3, 1, [2, 5, 0])]
+        self.assertEqual(column_ranges(seriesList), [1.0, 0.0, 3.0, None])
+        self.assertEqual(list(rows(seriesList)), [[1, 2], [5], [3, 0], []])
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import time
+from unittest.mock import patch
+
+from graphite_render import aio
+from graphite_render._vendor import whisper
+from graphite_render.app import app
+from graphite_render.intervals import Interval, IntervalSet
+from graphite_render.node import BranchNode, LeafNode
+from graphite_render.readers import MultiReader
+from graphite_render.storage import Store
+
+from . import TestCase, WHISPER_DIR
+
+
+class AsyncReader(object):
+    __slots__ = ('value', 'delay')
+
+    def __init__(self, value, delay=0):
+        self.value = value
+        self.delay = delay
+
+    async def fetch(self, startTime, endTime, now=None, requestContext=None):
+        await asyncio.sleep(self.delay)
+        return (startTime, endTime, 60), [self.value] * (
+            (endTime - startTime) // 60)
+
+    def get_intervals(self):
+        return IntervalSet([Interval(time.time() - 3600, time.time())])
+
+
+class AsyncFinder(object):
+    def __init__(self, count, delay=0):
+        self.count = count
+        self.delay = delay
+
+    async def find_nodes(self, query):
+        await asyncio.sleep(self.delay)
+        if query.pattern == 'remote':
+            yield BranchNode('remote')
+            return
+        for i in range(self.count):
+            yield LeafNode('remote.{0}'.format(i),
+                           AsyncReader(float(i), self.delay))
+
+
+class CoroutineFinder(object):
+    async def find_nodes(self, query):
+        if query.pattern == 'remote':
+            return []
+        return [LeafNode('remote.0', AsyncReader(10.0))]
+
+
+class EventLoopTest(TestCase):
+    def setUp(self):
+        super(EventLoopTest, self).setUp()
+        self.event_loop = aio.EventLoop(4)
+        self.addCleanup(self.event_loop.shutdown)
+
+    def test_run(self):
+        async def add(a, b):
+            await asyncio.sleep(0)
+            return a + b
+        self.assertEqual(self.event_loop.run(add(1, 2)), 3)
+        self.assertEqual(self.event_loop.run(aio.call(max, 1, 2)), 2)
+        with self.assertRaises(ZeroDivisionError):
+            self.event_loop.run(aio.call(divmod, 1, 0))
+
+    def test_find(self):
+        store = Store([AsyncFinder(3), CoroutineFinder(),
+                       app.config['GRAPHITE']['store'].finders[0]])
+        os.makedirs(os.path.join(WHISPER_DIR, 'remote'))
+        whisper.create(os.path.join(WHISPER_DIR, 'remote', '3.wsp'),
+                       [(60, 60)])
+        nodes = self.event_loop.run(aio.find(store, 'remote.*'))
+        self.assertEqual([node.path for node in nodes],
+                         ['remote.0', 'remote.1', 'remote.2', 'remote.3'])
+        # remote.0 is found by two finders
+        self.assertIsInstance(nodes[0].reader, MultiReader)
+        self.assertEqual(
+            [node.path for node in self.event_loop.run(
+                aio.find(store, 'remote'))],
+            ['remote'])
+
+    def test_fetch(self):
+        node = LeafNode('foo', MultiReader([
+            LeafNode('foo', AsyncReader(None)),
+            LeafNode('foo', AsyncReader(2.0, delay=0.05))]))
+        self.assertEqual(self.event_loop.run(aio.fetch(node, 0, 180)),
+                         ((0, 180, 60), [2.0, 2.0, 2.0]))
+
+        node.reader.first_sufficient = True
+        node.reader.nodes.append(LeafNode('foo', AsyncReader(3.0)))
+        self.assertEqual(self.event_loop.run(aio.fetch(node, 0, 180)),
+                         ((0, 180, 60), [3.0, 3.0, 3.0]))
+
+    def test_render(self):
+        store = Store([AsyncFinder(50, delay=0.2)])
+        query = {'target': 'sumSeries(remote.*)', 'format': 'json',
+                 'noCache': 1, 'from': '-5min'}
+        with patch.dict(app.config['GRAPHITE'],
+                        {'store': store, 'event_loop': self.event_loop}):
+            start = time.time()
+            response = self.app.get('/render', query_string=query)
+            # 50 fetches of 0.2s, overlapped
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(response.status_code, 200)
+            series, = response.json
+            self.assertEqual(series['datapoints'][0][0], sum(range(50)))
+
+            response = self.app.get('/metrics/find',
+                                    query_string={'query': 'remote.*'})
+            self.assertEqual(len(response.json), 50)
+
+    def test_render_whisper(self):
+        ts = int(time.time())
+        db = os.path.join(WHISPER_DIR, 'test.wsp')
+        whisper.create(db, [(1, 60)])
+        for i in range(5):
+            whisper.update(db, i, ts - i)
+        query = {'target': 'test', 'format': 'json', 'noCache': 1,
+                 'from': ts - 10, 'until': ts}
+        expected = self.app.get('/render', query_string=query).data
+        with patch.dict(app.config['GRAPHITE'],
+                        {'event_loop': self.event_loop}):
+            response = self.app.get('/render', query_string=query)
+        self.assertEqual(response.data, expected)
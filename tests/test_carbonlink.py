@@ -1,10 +1,14 @@
 import pickle
+import socketserver
 import struct
+import threading
+import time
+from io import BytesIO
 
 try:
-    from unittest.mock import patch
+    from unittest.mock import Mock, patch
 except ImportError:
-    from mock import patch
+    from mock import Mock, patch
 
 from graphite_render import carbonlink
 from graphite_render.carbonlink import CarbonLinkPool, ConsistentHashRing
@@ -12,6 +16,15 @@ from graphite_render.carbonlink import CarbonLinkPool, ConsistentHashRing
 from . import TestCase
 
 
+def recv_into(recv):
+    """Turns a side effect of ``conn.recv()`` into one of ``recv_into()``."""
+    def side_effect(buffer, nbytes):
+        data = recv(nbytes)
+        buffer[:len(data)] = data
+        return len(data)
+    return side_effect
+
+
 class CarbonLinkTestCase(TestCase):
     def test_allowed_modules(self):
         with self.assertRaises(pickle.UnpicklingError) as context:
@@ -27,6 +40,29 @@ class CarbonLinkTestCase(TestCase):
         self.assertIsNotNone(carbonlink.allowed_module('collections', 'deque'))
         self.assertIsNotNone(carbonlink.allowed_module('__builtin__', 'list'))
 
+    def test_safe_unpickler(self):
+        response = dict(datapoints=[(i, float(i)) for i in range(10000)])
+        data = pickle.dumps(response, protocol=2)
+        self.assertEqual(carbonlink.SafeUnpickler.loads(data), response)
+        self.assertEqual(
+            carbonlink.SafeUnpickler.loads(memoryview(bytearray(data))),
+            response)
+        with self.assertRaises(pickle.UnpicklingError):
+            carbonlink.SafeUnpickler.loads(pickle.dumps(
+                dict(datapoints=[1, 2, 3], extra=set([4])), protocol=2))
+
+    def test_recv_exactly(self):
+        conn = Mock()
+        conn.recv_into.side_effect = recv_into(BytesIO(b'abcdefghij').read)
+        self.assertEqual(carbonlink.recv_exactly(conn, 4), b'abcd')
+        chunks = iter([b'ab', b'cde', b'f'])
+        conn.recv_into.side_effect = recv_into(lambda size: next(chunks))
+        self.assertEqual(carbonlink.recv_exactly(conn, 6), b'abcdef')
+        chunks = iter([b'ab', b''])
+        conn.recv_into.side_effect = recv_into(lambda size: next(chunks))
+        with self.assertRaises(Exception):
+            carbonlink.recv_exactly(conn, 6)
+
 
 class ConsistentHashRingTest(TestCase):
     def test_chr_compute_ring_position(self):
@@ -174,7 +210,7 @@ class CarbonLinkPoolTest(TestCase):
             else:
                 raise ValueError('unexpected size %s' % size)
 
-        conn.recv.side_effect = mock_recv_query
+        conn.recv_into.side_effect = recv_into(mock_recv_query)
         datapoints = carbonlink.query('hosts.worker1.cpu')
         self.assertEqual(datapoints, [1, 2, 3])
 
@@ -190,7 +226,7 @@ class CarbonLinkPoolTest(TestCase):
             else:
                 raise ValueError('unexpected size %s' % size)
 
-        conn.recv.side_effect = mock_recv_get_metadata
+        conn.recv_into.side_effect = recv_into(mock_recv_get_metadata)
         metadata = carbonlink.get_metadata('hosts.worker1.cpu', 'key')
         self.assertEqual(metadata, 'foo')
 
@@ -203,6 +239,195 @@ class CarbonLinkPoolTest(TestCase):
             else:
                 raise ValueError('unexpected size %s' % size)
 
-        conn.recv.side_effect = mock_recv_set_metadata
+        conn.recv_into.side_effect = recv_into(mock_recv_set_metadata)
         results = carbonlink.set_metadata('hosts.worker1.cpu', 'foo', 'bar')
         self.assertEqual(results, {'old_value': 'foo', 'new_value': 'bar'})
+
+    def mock_carbonlink(self, hosts, *responses):
+        carbonlink = CarbonLinkPool(hosts)
+        conn = Mock()
+        stream = BytesIO()
+        for response in responses:
+            data = pickle.dumps(response)
+            stream.write(struct.pack('!I', len(data)) + data)
+        stream.seek(0)
+        conn.recv_into.side_effect = recv_into(stream.read)
+        for host in carbonlink.hosts:
+            carbonlink.connections[host].add(conn)
+        return carbonlink, conn
+
+    def sent_requests(self, conn):
+        requests = []
+        for call in conn.sendall.call_args_list:
+            stream = BytesIO(call[0][0])
+            while True:
+                len_prefix = stream.read(4)
+                if not len_prefix:
+                    break
+                size = struct.unpack('!L', len_prefix)[0]
+                requests.append(pickle.loads(stream.read(size)))
+        return requests
+
+    def test_clp_query_bulk(self):
+        carbonlink, conn = self.mock_carbonlink(
+            ['10.0.0.1:2003'],
+            dict(datapointsByMetric={'foo': [(1, 2)], 'bar': []}))
+        self.assertEqual(carbonlink.query_bulk(['foo', 'bar']),
+                         {'foo': [(1, 2)], 'bar': []})
+        self.assertEqual(self.sent_requests(conn), [
+            dict(type='cache-query-bulk', metrics=['foo', 'bar'])])
+
+    def test_clp_query_bulk_fallback(self):
+        carbonlink, conn = self.mock_carbonlink(
+            ['10.0.0.1:2003'],
+            dict(error='Invalid request type "cache-query-bulk"'),
+            dict(datapoints=[(1, 2)]),
+            dict(datapoints=[]))
+        self.assertEqual(carbonlink.query_bulk(['foo', 'bar']),
+                         {'foo': [(1, 2)], 'bar': []})
+        # Queries are pipelined
+        self.assertEqual(conn.sendall.call_count, 2)
+        self.assertEqual(self.sent_requests(conn)[1:], [
+            dict(type='cache-query', metric='foo'),
+            dict(type='cache-query', metric='bar')])
+
+    def test_clp_query_bulk_hosts(self):
+        hosts = ['10.0.0.1:2003:a', '10.0.0.2:2003:b']
+        carbonlink, conn = self.mock_carbonlink(
+            hosts,
+            dict(datapointsByMetric={}),
+            dict(datapointsByMetric={}))
+        metrics = ['metric{0}'.format(i) for i in range(20)]
+        carbonlink.query_bulk(metrics)
+        requests = self.sent_requests(conn)
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(sorted(requests[0]['metrics'] +
+                                requests[1]['metrics']), sorted(metrics))
+        for request in requests:
+            host = carbonlink.select_host(request['metrics'][0])
+            for metric in request['metrics']:
+                self.assertEqual(carbonlink.select_host(metric), host)
+
+    def test_clp_query_bulk_failure(self):
+        carbonlink, conn = self.mock_carbonlink(['10.0.0.1:2003'])
+        self.assertEqual(carbonlink.query_bulk(['foo']), {'foo': []})
+        self.assertIn(('10.0.0.1', None), carbonlink.last_failure)
+
+
+class CarbonCacheHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            len_prefix = self.request.recv(4)
+            if not len_prefix:
+                return
+            size = struct.unpack('!L', len_prefix)[0]
+            body = b''
+            while len(body) < size:
+                body += self.request.recv(size - len(body))
+            request = pickle.loads(body)
+            time.sleep(self.server.delay)
+            if request['type'] == 'cache-query':
+                response = dict(datapoints=[(1, self.server.port)] * 2)
+            else:
+                response = dict(datapointsByMetric=dict(
+                    (metric, [(1, self.server.port)])
+                    for metric in request['metrics']))
+            data = pickle.dumps(response, protocol=2)
+            self.request.sendall(struct.pack('!L', len(data)) + data)
+
+
+class CarbonCache(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', 0), CarbonCacheHandler)
+        self.delay = delay
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, args=(0.05,),
+                         daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ConcurrentCarbonLinkPoolTest(TestCase):
+    def setUp(self):
+        super(ConcurrentCarbonLinkPoolTest, self).setUp()
+        self.caches = [CarbonCache(delay=0.2) for _ in range(4)]
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        super(ConcurrentCarbonLinkPoolTest, self).tearDown()
+
+    def carbonlink(self, **kwargs):
+        hosts = ['127.0.0.1:{0}:{1}'.format(cache.port, i)
+                 for i, cache in enumerate(self.caches)]
+        return CarbonLinkPool(hosts, concurrent=True, **kwargs)
+
+    def test_send_request_to_all(self):
+        carbonlink = self.carbonlink()
+        for _ in range(2):  # New then pooled connections
+            start = time.monotonic()
+            datapoints = carbonlink.query('carbon.agents.foo')
+            self.assertLess(time.monotonic() - start, 0.6)
+            self.assertEqual(sorted(datapoints), sorted(
+                (1, cache.port) for cache in self.caches for _ in range(2)))
+        for host in carbonlink.hosts:
+            self.assertEqual(len(carbonlink.connections[host]), 1)
+
+    def test_query_bulk(self):
+        carbonlink = self.carbonlink()
+        # Skip the metrics hashed right on a host of the ring, which the
+        # ring can't compare.
+        ring = carbonlink.hash_ring
+        positions = set(position for position, _ in ring.ring)
+        metrics = [metric for metric in ('metric{0}'.format(i)
+                                         for i in range(60))
+                   if ring.compute_ring_position(metric) not in positions]
+        start = time.monotonic()
+        datapoints = carbonlink.query_bulk(metrics)
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(sorted(datapoints), sorted(metrics))
+        for metric in metrics:
+            host = carbonlink.select_host(metric)
+            self.assertEqual(datapoints[metric],
+                             [(1, int(carbonlink.ports[host]))])
+
+    def test_deadline(self):
+        self.caches[0].delay = 2
+        carbonlink = self.carbonlink(timeout=0.5)
+        start = time.monotonic()
+        datapoints = carbonlink.query('carbon.agents.foo')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(datapoints), 2 * 3)
+        self.assertNotIn((1, self.caches[0].port), datapoints)
+        slow_host = ('127.0.0.1', '0')
+        self.assertIn(slow_host, carbonlink.last_failure)
+        self.assertEqual(carbonlink.connections[slow_host], set())
+
+    def test_unreachable_hosts(self):
+        # Connections to a non-routable address hang or fail right away,
+        # in both cases without delaying the other hosts.
+        unreachable = [('10.255.255.1', 'x{0}'.format(i)) for i in range(4)]
+        hosts = ['127.0.0.1:{0}:{1}'.format(cache.port, i)
+                 for i, cache in enumerate(self.caches)]
+        hosts += ['{0}:2003:{1}'.format(*host) for host in unreachable]
+        carbonlink = CarbonLinkPool(hosts, concurrent=True, timeout=0.5)
+        start = time.monotonic()
+        datapoints = carbonlink.query('carbon.agents.foo')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(datapoints), 2 * 4)
+        self.assertEqual([host for host in carbonlink.hosts
+                          if not carbonlink.is_available(host)], unreachable)
+
+    def test_unavailable_host(self):
+        carbonlink = self.carbonlink()
+        failed_host = ('127.0.0.1', '0')
+        carbonlink.last_failure[failed_host] = time.time()
+        datapoints = carbonlink.query('carbon.agents.foo')
+        self.assertEqual(len(datapoints), 2 * 3)
+        self.assertNotIn((1, self.caches[0].port), datapoints)
+        self.assertEqual(carbonlink.connections[failed_host], set())
@@ -1,4 +1,8 @@
-from graphite_render.encoders import JSONEncoder
+import json
+from unittest.mock import patch
+
+from graphite_render.encoders import (encode_value, iterencode_series,
+                                      JSONEncoder)
 
 from . import TestCase
 
@@ -14,6 +18,29 @@ class EncoderTestCase(TestCase):
         self.assertEqual(encoder.default(set([4, 5, 6])), [4, 5, 6])
         self.assertEqual(encoder.default(DummyObject()), [7, 8, 9])
 
+    def test_encode_value(self):
+        for value in (None, 0, -12, 1.5, 1e300, -0.0, 1e-7, float('nan'),
+                      float('inf'), float('-inf'), True, 'foo', [1, 2]):
+            self.assertEqual(encode_value(value), json.dumps(value))
+
+    @patch('graphite_render.encoders.CHUNK_POINTS', 3)
+    def test_iterencode_series(self):
+        series_data = [
+            {'target': 'foo', 'datapoints': zip([1.0, None, 3, 4.5],
+                                                range(10, 14))},
+            {'target': 'b\u00e4r', 'datapoints': []},
+            {'target': 'baz', 'datapoints': [(float('nan'), 1)]},
+        ]
+        expected = json.dumps(
+            [dict(series, datapoints=list(series['datapoints']))
+             for series in series_data], cls=JSONEncoder)
+        series_data[0]['datapoints'] = zip([1.0, None, 3, 4.5],
+                                           range(10, 14))
+        chunks = list(iterencode_series(series_data))
+        self.assertEqual(''.join(chunks), expected)
+        self.assertIn('[1.0, 10], [null, 11], [3, 12]', chunks)
+        self.assertEqual(''.join(iterencode_series([], 'cb')), 'cb([])')
+
 
 class DummyObject(object):
     def tolist(self):
@@ -1,8 +1,10 @@
 import gzip
+import json
 import os
 import random
 import shutil
 import time
+from threading import Event
 
 try:
     from unittest.mock import patch
@@ -11,12 +13,17 @@ except ImportError:
 
 from graphite_render._vendor import whisper
 from graphite_render.app import app
-from graphite_render.finders.whisper import scandir
+from graphite_render.finders import compile_pattern, match_entries
+from graphite_render.finders.cache import (FetchCache, GzipCache,
+                                           HeaderCache)
+from graphite_render.finders.index import MetricIndex
+from graphite_render.finders.whisper import (merge_datapoints, scandir,
+                                             WhisperFinder, WhisperLeafNode)
 from graphite_render.intervals import Interval, IntervalSet
 from graphite_render.node import BranchNode, LeafNode
-from graphite_render.storage import Store
+from graphite_render.storage import FindQuery, Store
 
-from . import TestCase, WHISPER_DIR
+from . import SEARCH_INDEX, TestCase, WHISPER_DIR
 
 
 class FinderTest(TestCase):
@@ -52,6 +59,41 @@ class FinderTest(TestCase):
         self.assertEqual(len(series), 10)
 
 
+class MatchEntriesTest(TestCase):
+    entries = ['foo', 'bar', 'baz', 'foobar', 'foobaz', 'bar.wsp',
+               'bar.wsp.gz', 'qux', 'a{b', '*', 'fo']
+
+    def test_match_entries(self):
+        for pattern, expected in (
+            ('foo', ['foo']),
+            ('ba?', ['bar', 'baz']),
+            ('fo*', ['foo', 'foobar', 'foobaz', 'fo']),
+            ('[bq]*', ['bar', 'baz', 'bar.wsp', 'bar.wsp.gz', 'qux']),
+            ('[!bq]??', ['foo', 'a{b']),
+            ('{foo,qux}', ['foo', 'qux']),
+            ('foo{bar,baz}', ['foobar', 'foobaz']),
+            ('{fo{o,},ba{r,z}}', ['foo', 'bar', 'baz', 'fo']),
+            ('fo{o}', ['foo']),
+            ('foo{}', ['foo']),
+            ('bar.*', ['bar.wsp', 'bar.wsp.gz']),
+            ('a{b', ['a{b']),
+            ('\\*', ['*']),
+            ('{nope,none}', []),
+        ):
+            self.assertEqual(match_entries(self.entries, pattern), expected,
+                             pattern)
+
+    def test_compile_pattern_cache(self):
+        self.assertIs(compile_pattern('{a,b}.*'), compile_pattern('{a,b}.*'))
+
+    def test_many_variants(self):
+        variants = ['host{0}'.format(i) for i in range(60)]
+        entries = ['host{0}'.format(i) for i in range(0, 120, 2)]
+        pattern = '{{{0}}}'.format(','.join(variants))
+        self.assertEqual(match_entries(entries, pattern),
+                         ['host{0}'.format(i) for i in range(0, 60, 2)])
+
+
 class DummyReader(object):
     __slots__ = ('path',)
 
@@ -192,6 +234,26 @@ class WhisperFinderTest(TestCase):
         finally:
             scandir_mocked.call_count = 0
 
+    def test_whisper_fetch_mmap(self):
+        db_path = os.path.join(WHISPER_DIR, 'mmap.wsp')
+        whisper.create(db_path, [(1, 60)])
+        now = int(time.time())
+        # Fill a first archive cycle then overwrite a few points: the other
+        # slots hold stale values that must not be returned.
+        with patch('time.time', return_value=now - 200):
+            whisper.update_many(db_path, [(now - 259 + i, 1)
+                                          for i in range(60)])
+        whisper.update_many(db_path, [(now - i, 2) for i in range(10)])
+
+        results = []
+        for mmap_reads in (True, False):
+            with patch.object(whisper, 'MMAP_READS', mmap_reads):
+                results.append(whisper.fetch(db_path, now - 59, now, now))
+        self.assertEqual(results[0], results[1])
+        time_info, values = results[0]
+        self.assertEqual(time_info, (now - 58, now + 1, 1))
+        self.assertEqual(values, [None] * 49 + [2.0] * 10)
+
     def test_globstar(self):
         store = app.config['GRAPHITE']['store']
         query = "x.**.x"
@@ -248,3 +310,478 @@ class WhisperFinderTest(TestCase):
             self.assertIn(hit, paths)
         for miss in misses:
             self.assertNotIn(miss, paths)
+
+
+class MetricIndexTest(TestCase):
+    paths = ['a.b.c', 'a.b.d', 'a.e.c', 'b.b.c', 'a.f']
+
+    def setUp(self):
+        super(MetricIndexTest, self).setUp()
+        for path in self.paths:
+            self.create(path)
+        self.fs_finder = WhisperFinder(
+            {'whisper': {'directories': [WHISPER_DIR]}})
+
+    def create(self, path):
+        db_path = os.path.join(WHISPER_DIR, path.replace('.', os.sep))
+        if not os.path.exists(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        whisper.create(db_path + '.wsp', [(1, 60)])
+
+    def age(self):
+        """Moves directory mtimes out of the racy window of the index"""
+        past = time.time() - 60
+        for dirpath, _, _ in os.walk(WHISPER_DIR):
+            os.utime(dirpath, (past, past))
+
+    def make_finder(self):
+        return WhisperFinder({
+            'whisper': {'directories': [WHISPER_DIR], 'index': True},
+            'search_index': SEARCH_INDEX,
+        })
+
+    def find(self, finder, pattern):
+        return sorted((node.path, node.is_leaf)
+                      for node in Store([finder]).find(pattern))
+
+    def test_same_results(self):
+        finder = self.make_finder()
+        for pattern in ('a', 'a.b', 'a.b.c', 'a.*', '*.b.*', 'a.{b,e}.c',
+                        'a.b.[cd]', 'a.?', '**', 'a.**', '**.c', 'nope.*'):
+            self.assertEqual(self.find(finder, pattern),
+                             self.find(self.fs_finder, pattern), pattern)
+
+    def test_refresh(self):
+        finder = self.make_finder()
+        self.assertEqual(len(self.find(finder, 'a.b.*')), 2)
+        self.create('a.b.new')
+        self.assertEqual(len(self.find(finder, 'a.b.*')), 3)
+        os.remove(os.path.join(WHISPER_DIR, 'a', 'b', 'c.wsp'))
+        self.assertEqual(self.find(finder, 'a.b.*'),
+                         [('a.b.d', True), ('a.b.new', True)])
+
+    def test_persistence(self):
+        self.age()
+        finder = self.make_finder()
+        finder.index.refresh()
+        finder.index.save()
+        self.assertTrue(os.path.exists(SEARCH_INDEX))
+
+        finder = self.make_finder()
+        with patch('graphite_render.finders.index.scandir',
+                   wraps=scandir) as scandir_mocked:
+            self.assertEqual(self.find(finder, '*.*.c'),
+                             self.find(self.fs_finder, '*.*.c'))
+            self.assertEqual(scandir_mocked.call_count, 0)
+
+            self.create('b.b.new')
+            self.assertEqual(len(self.find(finder, 'b.b.*')), 2)
+            self.assertEqual(scandir_mocked.call_count, 1)
+
+            # b/b was just modified, it is rescanned until its mtime is old
+            # enough to tell later changes apart
+            self.assertEqual(len(self.find(finder, 'b.b.*')), 2)
+            self.assertEqual(scandir_mocked.call_count, 2)
+
+    def test_background_save(self):
+        self.age()
+        finder = WhisperFinder({
+            'whisper': {'directories': [WHISPER_DIR], 'index': True,
+                        'index_save_interval': 0},
+            'search_index': SEARCH_INDEX,
+        })
+        event = Event()
+        self.addCleanup(event.set)
+        dump = json.dump
+
+        def blocked_dump(*args, **kwargs):
+            event.wait(5)
+            return dump(*args, **kwargs)
+
+        with patch('graphite_render.finders.index.json.dump',
+                   side_effect=blocked_dump):
+            # The find doesn't wait for the index to be written
+            self.assertEqual(len(self.find(finder, 'a.b.*')), 2)
+            self.assertTrue(finder.index.save_thread.is_alive())
+            self.assertFalse(os.path.exists(SEARCH_INDEX))
+            event.set()
+            finder.index.save_thread.join(5)
+        self.assertEqual(MetricIndex(SEARCH_INDEX).directories,
+                         finder.index.directories)
+
+    def test_prune(self):
+        index = MetricIndex(SEARCH_INDEX, [WHISPER_DIR])
+        index.refresh()
+        self.assertIn(os.path.join(WHISPER_DIR, 'b', 'b'), index.directories)
+        shutil.rmtree(os.path.join(WHISPER_DIR, 'b'))
+        index.refresh()
+        index.save()
+        self.assertNotIn(os.path.join(WHISPER_DIR, 'b', 'b'),
+                         MetricIndex(SEARCH_INDEX).directories)
+
+
+class FetchCacheTest(TestCase):
+    def setUp(self):
+        super(FetchCacheTest, self).setUp()
+        self.db_path = os.path.join(WHISPER_DIR, 'cached.wsp')
+        whisper.create(self.db_path, [(1, 120), (10, 120)])
+        self.now = 1700000000
+
+    def update(self, now):
+        with patch('time.time', return_value=now):
+            whisper.update(self.db_path, now % 100, now)
+
+    @patch('graphite_render.finders.cache.BUCKET_POINTS', 16)
+    def test_same_results(self):
+        cache = FetchCache(1000)
+        rng = random.Random(42)
+        for now in range(self.now, self.now + 1500, 7):
+            self.update(now)
+            for _ in range(5):
+                until = now - rng.randint(-10, 1400)
+                start = until - rng.randint(0, 1400)
+                self.assertEqual(
+                    cache.fetch(self.db_path, start, until, now),
+                    whisper.fetch(self.db_path, start, until, now),
+                    (now, start, until))
+        self.assertGreater(cache.slices.hits, 0)
+
+    def test_suffix_reads(self):
+        cache = FetchCache(1000)
+        for now in range(self.now, self.now + 100):
+            self.update(now)
+        cache.fetch(self.db_path, self.now, self.now + 100, self.now + 100)
+        self.update(self.now + 100)
+        with patch.object(FetchCache, '_read',
+                          autospec=True,
+                          side_effect=FetchCache._read) as read:
+            time_info, values = cache.fetch(self.db_path, self.now + 10,
+                                            self.now + 101, self.now + 101)
+        self.assertEqual(time_info, (self.now + 11, self.now + 102, 1))
+        self.assertEqual(values[-3:], [99.0, 0.0, None])
+        # Only the points of the last two intervals were read from disk
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(read.call_args[0][3:],
+                         (self.now + 100, self.now + 102))
+
+    def test_ttl(self):
+        cache = FetchCache(1000, ttl=60)
+        for now in range(self.now, self.now + 100):
+            self.update(now)
+        with patch('time.monotonic', return_value=0):
+            cache.fetch(self.db_path, self.now, self.now + 100, self.now + 100)
+        # Late write of a past point
+        with patch('time.time', return_value=self.now + 100):
+            whisper.update(self.db_path, 42, self.now + 50)
+        with patch('time.monotonic', return_value=59):
+            _, values = cache.fetch(self.db_path, self.now, self.now + 100,
+                                    self.now + 100)
+            self.assertEqual(values[49], 50.0)
+        with patch('time.monotonic', return_value=60):
+            _, values = cache.fetch(self.db_path, self.now, self.now + 100,
+                                    self.now + 100)
+            self.assertEqual(values[49], 42.0)
+
+    def test_finder(self):
+        finder = WhisperFinder({'whisper': {'directories': [WHISPER_DIR],
+                                            'fetch_cache_size': 10}})
+        self.assertIsInstance(finder.fetch_cache, FetchCache)
+        self.assertEqual(finder.fetch_cache.slices.max_items, 10)
+        node = next(finder.find_nodes(FindQuery('cached', None, None)))
+        self.assertIs(node.reader.fetch_cache, finder.fetch_cache)
+
+
+class HeaderCacheTest(TestCase):
+    def setUp(self):
+        super(HeaderCacheTest, self).setUp()
+        self.db_path = os.path.join(WHISPER_DIR, 'header.wsp')
+        whisper.create(self.db_path, [(1, 60)])
+        self.read_header = getattr(whisper, '__readHeader')
+        self.header = whisper.info(self.db_path)
+
+    def test_info(self):
+        cache = HeaderCache(10)
+        with patch.object(whisper, '__readHeader',
+                          side_effect=self.read_header) as read:
+            for _ in range(3):
+                header, st = cache.info(self.db_path)
+                self.assertEqual(header, self.header)
+                self.assertEqual(st.st_size, os.path.getsize(self.db_path))
+            self.assertEqual(read.call_count, 1)
+
+        # Updates don't invalidate the header
+        whisper.update(self.db_path, 1)
+        with patch.object(whisper, '__readHeader',
+                          side_effect=self.read_header) as read:
+            cache.info(self.db_path)
+            self.assertEqual(read.call_count, 0)
+
+        # Replacing the file does
+        os.remove(self.db_path)
+        whisper.create(self.db_path, [(1, 60), (60, 60)])
+        header, _ = cache.info(self.db_path)
+        self.assertEqual(len(header['archives']), 2)
+
+    def test_read(self):
+        cache = HeaderCache(10)
+        with patch.object(whisper, '__readHeader',
+                          side_effect=self.read_header) as read:
+            for _ in range(3):
+                with open(self.db_path, 'rb') as fh:
+                    self.assertEqual(cache.read(fh), self.header)
+            self.assertEqual(cache.info(self.db_path)[0], self.header)
+            self.assertEqual(read.call_count, 1)
+
+    def test_gzip(self):
+        gz_path = self.db_path + '.gz'
+        with open(self.db_path, 'rb') as f_in:
+            with gzip.open(gz_path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        header, _ = HeaderCache(10).info(gz_path, gzip.GzipFile)
+        self.assertEqual(header, self.header)
+
+    def test_finder(self):
+        finder = WhisperFinder({'whisper': {'directories': [WHISPER_DIR]}})
+        self.assertEqual(finder.header_cache.headers.max_items, 10000)
+        node = next(finder.find_nodes(FindQuery('header', None, None)))
+        self.assertIs(node.reader.header_cache, finder.header_cache)
+        now = int(time.time())
+        whisper.update(self.db_path, 42.0, now)
+        with patch.object(whisper, '__readHeader',
+                          side_effect=self.read_header) as read:
+            for _ in range(2):
+                interval, = node.intervals
+                _, values = node.fetch(now - 10, now + 1)
+            self.assertEqual(read.call_count, 1)
+        self.assertEqual(values[-1], 42.0)
+        self.assertAlmostEqual(interval.start, now - 60, delta=5)
+
+        finder = WhisperFinder({'whisper': {'directories': [WHISPER_DIR],
+                                            'header_cache_size': 0}})
+        self.assertIsNone(finder.header_cache)
+
+
+class GzipCacheTest(TestCase):
+    def setUp(self):
+        super(GzipCacheTest, self).setUp()
+        self.now = int(time.time())
+        self.gz_path = os.path.join(WHISPER_DIR, 'archived.wsp.gz')
+        self.compress([(1, 60), (60, 60)], 1.0)
+
+    def compress(self, archives, value):
+        db_path = os.path.join(WHISPER_DIR, 'archived.wsp')
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        whisper.create(db_path, archives)
+        whisper.update(db_path, value, self.now)
+        with open(db_path, 'rb') as f_in:
+            with gzip.open(self.gz_path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        os.remove(db_path)
+
+    def test_open(self):
+        cache = GzipCache(1024 * 1024)
+        with gzip.GzipFile(self.gz_path, 'rb') as fh:
+            content = fh.read()
+            expected = whisper.file_fetch(fh, self.now - 10, self.now)
+        with patch('gzip.GzipFile', wraps=gzip.GzipFile) as gzip_file:
+            for _ in range(3):
+                with cache.open(self.gz_path) as fh:
+                    self.assertEqual(fh.name, self.gz_path)
+                    self.assertEqual(
+                        whisper.file_fetch(fh, self.now - 10, self.now),
+                        expected)
+        self.assertEqual(gzip_file.call_count, 1)
+        self.assertEqual(cache.files.size, len(content))
+
+        # Rewritten files are decompressed again
+        self.compress([(1, 60)], 2.0)
+        with cache.open(self.gz_path) as fh:
+            _, values = whisper.file_fetch(fh, self.now - 10, self.now)
+        self.assertEqual(values[-1], 2.0)
+
+    def test_max_size(self):
+        cache = GzipCache(100)
+        with patch('gzip.GzipFile', wraps=gzip.GzipFile) as gzip_file:
+            for _ in range(2):
+                with cache.open(self.gz_path) as fh:
+                    self.assertEqual(len(fh.read()), 1480)
+        self.assertEqual(gzip_file.call_count, 2)
+        self.assertEqual(len(cache.files), 0)
+
+    def test_finder(self):
+        finder = WhisperFinder({'whisper': {'directories': [WHISPER_DIR],
+                                            'gzip_cache_bytes': 1024 * 1024}})
+        node = next(finder.find_nodes(FindQuery('archived', None, None)))
+        self.assertIs(node.reader.gzip_cache, finder.gzip_cache)
+        with patch('gzip.GzipFile', wraps=gzip.GzipFile) as gzip_file:
+            for _ in range(2):
+                self.assertEqual(len(node.intervals), 1)
+                _, values = node.fetch(self.now - 10, self.now)
+                self.assertEqual(values[-1], 1.0)
+        self.assertEqual(gzip_file.call_count, 1)
+
+
+class CarbonLinkPrefetchTest(TestCase):
+    def setUp(self):
+        super(CarbonLinkPrefetchTest, self).setUp()
+        for name in ('foo', 'bar'):
+            whisper.create(os.path.join(WHISPER_DIR, name + '.wsp'),
+                           [(1, 60)])
+        self.finder = WhisperFinder({
+            'whisper': {'directories': [WHISPER_DIR]},
+            'carbon': {'hosts': ['127.0.0.1:7002']},
+        })
+        self.nodes = list(self.finder.find_nodes(
+            FindQuery('{foo,bar}', None, None)))
+        self.now = int(time.time())
+
+    def test_prefetch(self):
+        carbonlink = self.finder.carbonlink
+        with patch.object(carbonlink, 'query_bulk', return_value={
+                'foo': [(self.now - 1, 42.0)]}) as query_bulk, \
+                patch.object(carbonlink, 'query') as query:
+            self.finder.prefetch(self.nodes)
+            results = dict((node.path, node.fetch(self.now - 10, self.now))
+                           for node in self.nodes)
+        query_bulk.assert_called_once_with(set(['foo', 'bar']))
+        self.assertFalse(query.called)
+        self.assertEqual(results['foo'][1][-2:], [42.0, None])
+        self.assertEqual(results['bar'][1], [None] * 10)
+
+    def test_prefetch_failure(self):
+        carbonlink = self.finder.carbonlink
+        with patch.object(carbonlink, 'query_bulk',
+                          side_effect=Exception('boom')), \
+                patch.object(carbonlink, 'query',
+                             return_value=[]) as query:
+            self.finder.prefetch(self.nodes)
+            for node in self.nodes:
+                node.fetch(self.now - 10, self.now)
+        self.assertEqual(query.call_count, 2)
+
+
+class FetchMultiTest(TestCase):
+    def setUp(self):
+        super(FetchMultiTest, self).setUp()
+        self.now = int(time.time())
+        for name, archives in (('foo', [(1, 60)]), ('bar', [(1, 120)]),
+                               ('baz', [(10, 60)])):
+            path = os.path.join(WHISPER_DIR, 'multi', name + '.wsp')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            whisper.create(path, archives)
+            for i in range(1, 10):
+                whisper.update(path, i + len(name), self.now - i)
+        self.finder = WhisperFinder({
+            'whisper': {'directories': [WHISPER_DIR],
+                        'fetch_multi_threads': 2},
+            'carbon': {'hosts': ['127.0.0.1:7002']},
+        })
+        self.addCleanup(self.finder.fetch_multi_pool.shutdown)
+
+    def test_fetch_multi(self):
+        nodes = list(self.finder.find_nodes(
+            FindQuery('multi.*', None, None)))
+        self.assertEqual(len(nodes), 3)
+        for node in nodes:
+            self.assertIsInstance(node, WhisperLeafNode)
+            self.assertEqual(node.__fetch_multi__,
+                             self.finder.__fetch_multi__)
+
+        carbonlink = self.finder.carbonlink
+        with patch.object(carbonlink, 'query_bulk', return_value={
+                'multi.foo': [(self.now, 42.0)]}) as query_bulk, \
+                patch.object(carbonlink, 'query') as query:
+            time_info, series = self.finder.fetch_multi(
+                nodes, self.now - 30, self.now)
+        query_bulk.assert_called_once_with(set(['multi.foo', 'multi.bar']))
+        self.assertFalse(query.called)
+        # multi.baz has another step, it's left to single fetches
+        self.assertEqual(sorted(series), ['multi.bar', 'multi.foo'])
+        self.assertEqual(time_info, (self.now - 29, self.now + 1, 1))
+        self.assertEqual(series['multi.foo'][-4:], [6.0, 5.0, 4.0, 42.0])
+        self.assertEqual(series['multi.bar'][-4:], [6.0, 5.0, 4.0, None])
+
+    def test_missing_file(self):
+        nodes = list(self.finder.find_nodes(
+            FindQuery('multi.foo', None, None)))
+        os.remove(nodes[0].reader.fs_path)
+        with patch.object(self.finder.carbonlink, 'query_bulk',
+                          return_value={}):
+            self.assertEqual(self.finder.fetch_multi(nodes, self.now - 30,
+                                                     self.now), (None, {}))
+
+    def test_render(self):
+        query = {'target': 'multi.*', 'format': 'json', 'noCache': 1,
+                 'from': self.now - 30, 'until': self.now}
+        with patch.object(self.finder.carbonlink, 'query_bulk',
+                          return_value={}), \
+                patch('graphite_render.carbonlink.CarbonLinkPool.query',
+                      return_value=[]):
+            expected = self.app.get('/render', query_string=query).data
+            with patch.dict(app.config['GRAPHITE'],
+                            {'store': Store([self.finder])}), \
+                    patch.object(WhisperFinder, 'fetch_multi', autospec=True,
+                                 side_effect=WhisperFinder.fetch_multi) as fm:
+                response = self.app.get('/render', query_string=query)
+        self.assertEqual(fm.call_count, 1)
+        self.assertEqual(response.data, expected)
+        self.assertEqual(len(json.loads(response.data.decode('utf-8'))), 3)
+
+
+def reference_merge(values, time_info, datapoints):
+    start, end, step = time_info
+    for timestamp, value in sorted(datapoints, key=lambda p: p[0]):
+        if not (timestamp >= start and timestamp < end):
+            continue
+        interval = timestamp - (timestamp % step)
+        i = int(interval - start) // step
+        values[i] = value
+
+
+class MergeDatapointsTest(TestCase):
+    def assertMerges(self, time_info, datapoints):
+        start, end, step = time_info
+        expected = [float(i) for i in range((end - start) // step)]
+        values = list(expected)
+        reference_merge(expected, time_info, datapoints)
+        merge_datapoints(values, time_info, datapoints)
+        self.assertEqual(values, expected)
+
+    def test_merge(self):
+        time_info = (600, 1200, 60)
+        self.assertMerges(time_info, [])
+        self.assertMerges(time_info, [(0, 1.0), (1200, 2.0), (5000, 3.0)])
+        self.assertMerges(time_info, [(600, None), (1199, 2.0), (1200, 3.0)])
+        # Gaps and several datapoints per interval
+        self.assertMerges(time_info, [(660, 1.0), (900, 2.0), (910, 3.0)])
+        self.assertMerges(time_info, [(t, t * 2.0) for t in range(0, 1500)])
+        self.assertMerges(time_info, [(t + 0.5, t) for t in range(580, 1300)])
+        self.assertMerges(time_info, [(t, -t) for t in range(950, 550, -7)])
+
+    def test_random(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            step = rng.choice([1, 10, 60])
+            start = 1000 * step
+            end = start + rng.randint(1, 50) * step
+            datapoints = [(rng.randint(start - 5 * step, end + 5 * step),
+                           rng.random())
+                          for _ in range(rng.randint(0, 200))]
+            # Unique timestamps: ties are resolved differently
+            datapoints = list(dict(datapoints).items())
+            rng.shuffle(datapoints)
+            self.assertMerges((start, end, step), datapoints)
+
+    def test_fetch(self):
+        whisper.create(os.path.join(WHISPER_DIR, 'merged.wsp'), [(1, 60)])
+        finder = WhisperFinder({
+            'whisper': {'directories': [WHISPER_DIR]},
+            'carbon': {'hosts': ['127.0.0.1:7002']},
+        })
+        node = next(finder.find_nodes(FindQuery('merged', None, None)))
+        now = int(time.time())
+        with patch.object(finder.carbonlink, 'query', return_value=[
+                (now - 3, 3.0), (now - 1, 1.0), (now - 2, 2.0)]):
+            _, values = node.fetch(now - 10, now)
+        self.assertEqual(values[-4:], [3.0, 2.0, 1.0, None])
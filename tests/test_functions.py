@@ -394,6 +394,15 @@ class FunctionsTest(TestCase):
         # Test the function works properly with an empty seriesList provided.
         self.assertEqual([], functions.highestMax({}, [], 1))
 
+    def test_highest_missing_values(self):
+        seriesList = [[None, None], [1, None], [None, 3]]
+        self.assertEqual(functions.highestMax({}, seriesList, 2),
+                         [seriesList[2], seriesList[1]])
+        self.assertEqual(functions.highestCurrent({}, seriesList, 3),
+                         seriesList)
+        self.assertEqual(functions.lowestCurrent({}, seriesList, 2),
+                         [seriesList[0], seriesList[1]])
+
     def testGetPercentile(self):
         seriesList = [
             ([None, None, 15, 20, 35, 40, 50], 20),
@@ -0,0 +1,71 @@
+from unittest.mock import patch
+
+from graphite_render.lru import LRUCache
+
+from . import TestCase
+
+
+class LRUCacheTest(TestCase):
+    def test_get_set(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get('foo'))
+        cache.set('foo', 1)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertIn('foo', cache)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_max_items(self):
+        cache = LRUCache(max_items=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(sorted(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_max_size(self):
+        cache = LRUCache(max_size=10, sizeof=lambda key, value: len(value))
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        self.assertEqual(cache.size, 8)
+        cache.set('c', 'xxxx')
+        self.assertEqual(sorted(cache.entries), ['b', 'c'])
+        self.assertEqual(cache.size, 8)
+
+        # Replacing an entry accounts for the new size only
+        cache.set('c', 'xx')
+        self.assertEqual(cache.size, 6)
+
+        # Entries bigger than the cache aren't stored
+        cache.set('d', 'x' * 11)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.size, 6)
+
+    def test_pop_clear(self):
+        cache = LRUCache(sizeof=lambda key, value: value)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertEqual(cache.size, 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.stats(), {'items': 0, 'size': 0, 'hits': 0,
+                                         'misses': 0, 'evictions': 0})
+
+    def test_ttl(self):
+        cache = LRUCache(sizeof=lambda key, value: value)
+        with patch('time.monotonic', return_value=100):
+            cache.set('a', 1, ttl=10)
+            cache.set('b', 2)
+        with patch('time.monotonic', return_value=109):
+            self.assertEqual(cache.get('a'), 1)
+        with patch('time.monotonic', return_value=110):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.size, 2)
+        self.assertEqual(cache.misses, 1)
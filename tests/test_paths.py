@@ -1,4 +1,7 @@
-from graphite_render.app import pathsFromTarget
+from unittest.mock import patch
+
+from graphite_render.app import app, pathsFromTarget
+from graphite_render.lru import LRUCache
 
 from . import TestCase
 
@@ -70,3 +73,23 @@ class PathsTest(TestCase):
         target = 'outerFunc(innerFunc(%s, %s), s=innerFunc(%s, %s))' % paths
         expected = list(paths)
         self.validate_paths(expected, pathsFromTarget({}, target))
+
+    def test_parse_cache(self):
+        """
+        Tests that a target is only parsed once when the parse cache is
+        enabled.
+
+        """
+        target = 'sumSeries(test.a.metric, test.b.*)'
+        cache = LRUCache(max_items=10)
+        with patch.dict(app.config['GRAPHITE'], {'parse_cache': cache}):
+            for _ in range(3):
+                self.validate_paths(['test.a.metric', 'test.b.*'],
+                                    pathsFromTarget({}, target))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+
+        with patch.dict(app.config['GRAPHITE'], {'parse_cache': None}):
+            self.validate_paths(['test.a.metric', 'test.b.*'],
+                                pathsFromTarget({}, target))
+        self.assertEqual(cache.hits, 2)
@@ -0,0 +1,180 @@
+import random
+import time
+from threading import Event
+
+from graphite_render.node import LeafNode
+from graphite_render.pool import FetchPool
+from graphite_render.readers import covers, MultiReader
+from graphite_render.storage import Store
+
+from . import TestCase
+
+
+class FailingNode(object):
+    def fetch(self, startTime, endTime, now=None, requestContext=None):
+        raise Exception("boom")
+
+
+class DummyNode(object):
+    def __init__(self, result, delay=0, event=None):
+        self.result = result
+        self.delay = delay
+        self.event = event
+        self.fetched = False
+
+    def fetch(self, startTime, endTime, now=None, requestContext=None):
+        self.fetched = True
+        if self.event is not None:
+            self.event.wait(5)
+        time.sleep(self.delay)
+        return self.result
+
+
+class DummyFinder(object):
+    def __init__(self, result):
+        self.result = result
+
+    def find_nodes(self, query):
+        yield LeafNode('foo', DummyNode(self.result))
+
+
+def reference_merge(results):
+    """Picks the value of each interval the way merge() is documented to."""
+    results = sorted(results, key=lambda result: result[0][2])
+    start = min(time_info[0] for time_info, _ in results)
+    end = max(time_info[1] for time_info, _ in results)
+    step = results[0][0][2]
+    values = []
+    for t in range(start, end, step):
+        value = None
+        for (start1, _, step1), values1 in results:
+            i = (t - start1) // step1
+            if 0 <= i < len(values1) and values1[i] is not None:
+                value = values1[i]
+                break
+        values.append(value)
+    return (start, end, step), values
+
+
+class MultiReaderTest(TestCase):
+    def test_merge(self):
+        reader = MultiReader([])
+        fine = ((60, 120, 10), [1, None, 3, None, None, 6])
+        coarse = ((0, 180, 60), [10, 20, 30])
+        self.assertEqual(reader.merge(fine, coarse), (
+            (0, 180, 10),
+            [10] * 6 + [1, 20, 3, 20, 20, 6] + [30] * 6,
+        ))
+        self.assertEqual(reader.merge(coarse, fine),
+                         reader.merge(fine, coarse))
+
+        # Same step: the first series wins
+        first = ((0, 30, 10), [1, None, 3])
+        second = ((0, 30, 10), [4, 5, 6])
+        third = ((0, 40, 10), [7, 8, 9, 10])
+        self.assertEqual(reader.merge(first, second, third),
+                         ((0, 40, 10), [1, 5, 3, 10]))
+
+        # Steps that don't line up
+        self.assertEqual(reader.merge(((0, 30, 10), [None, None, None]),
+                                      ((5, 35, 15), [1, 2])),
+                         ((0, 35, 10), [None, 1, 2, 2]))
+
+    def test_random(self):
+        rng = random.Random(15)
+        reader = MultiReader([])
+        for _ in range(300):
+            results = []
+            for _ in range(rng.randint(2, 4)):
+                step = rng.choice([1, 2, 5, 10, 15, 60])
+                start = rng.randint(0, 10) * rng.choice([1, step])
+                count = rng.randint(0, 30)
+                results.append(((start, start + count * step, step), [
+                    rng.choice([None, 1.0, 2.0, 3.0]) for _ in range(count)]))
+            self.assertEqual(reader.merge(*results), reference_merge(results),
+                             results)
+
+    def test_fetch(self):
+        result = ((0, 30, 10), [1, None, 3])
+        reader = MultiReader([FailingNode(), DummyNode(result)])
+        self.assertIs(reader.fetch(0, 30), result)
+
+        reader = MultiReader([DummyNode(result), FailingNode(),
+                              DummyNode(((0, 60, 20), [4, 5, 6]))])
+        self.assertEqual(reader.fetch(0, 30),
+                         ((0, 60, 10), [1, 4, 3, 5, 6, 6]))
+
+        reader = MultiReader([FailingNode(), FailingNode()])
+        with self.assertRaises(Exception):
+            reader.fetch(0, 30)
+
+    def test_covers(self):
+        self.assertTrue(covers(((10, 40, 10), [1, 2, 3]), 5, 40))
+        self.assertFalse(covers(((10, 40, 10), [1, None, 3]), 5, 40))
+        self.assertFalse(covers(((10, 40, 10), [1, 2]), 5, 40))
+        self.assertFalse(covers(((20, 40, 10), [1, 2]), 5, 40))
+        self.assertFalse(covers(((10, 40, 10), [1, 2, 3]), 5, 45))
+
+    def test_fetch_pool(self):
+        pool = FetchPool(4)
+        self.addCleanup(pool.shutdown)
+        nodes = [DummyNode(((0, 30, 10), [None, 2, 3]), delay=0.2),
+                 DummyNode(((0, 30, 10), [1, None, 3]), delay=0.2),
+                 DummyNode(((0, 30, 10), [4, 5, None]), delay=0.2)]
+        reader = MultiReader(nodes, fetch_pool=pool)
+        start = time.time()
+        # Merged in the order of the nodes, whatever the order of the fetches
+        self.assertEqual(reader.fetch(0, 30), ((0, 30, 10), [1, 2, 3]))
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_fetch_pool_per_key(self):
+        pool = FetchPool(2, max_workers_per_key=1)
+        self.addCleanup(pool.shutdown)
+        event = Event()
+        self.addCleanup(event.set)
+        slow = [pool.submit(event.wait, 5, key='slow') for _ in range(3)]
+        # The queued slow calls don't hold the other worker
+        fast = [pool.submit(abs, -i, key='fast') for i in range(3)]
+        self.assertEqual([f.result(timeout=1) for f in fast], [0, 1, 2])
+        self.assertFalse(any(f.done() for f in slow))
+        self.assertTrue(slow[2].cancel())
+        event.set()
+        self.assertEqual([f.result(timeout=1) for f in slow[:2]],
+                         [True, True])
+
+        failing = pool.submit(int, 'foo', key='slow')
+        with self.assertRaises(ValueError):
+            failing.result(timeout=1)
+
+    def test_first_sufficient(self):
+        full = ((0, 30, 10), [1, 2, 3])
+        nodes = [DummyNode(((0, 30, 10), [None, 5, 6])), DummyNode(full),
+                 DummyNode(((0, 30, 10), [7, 8, 9]))]
+        reader = MultiReader(nodes, first_sufficient=True)
+        self.assertIs(reader.fetch(0, 30), full)
+        self.assertFalse(nodes[2].fetched)
+
+        reader = MultiReader(nodes[:1] + nodes[2:])
+        self.assertEqual(reader.fetch(0, 30), ((0, 30, 10), [7, 5, 6]))
+
+    def test_first_sufficient_pool(self):
+        pool = FetchPool(2)
+        self.addCleanup(pool.shutdown)
+        event = Event()
+        self.addCleanup(event.set)
+        full = ((0, 30, 10), [1, 2, 3])
+        nodes = [DummyNode(((0, 30, 10), [4, 5, 6]), event=event),
+                 DummyNode(full)]
+        reader = MultiReader(nodes, fetch_pool=pool, first_sufficient=True)
+        # The slow node isn't waited for
+        self.assertIs(reader.fetch(0, 30), full)
+
+    def test_store(self):
+        pool = FetchPool(2)
+        self.addCleanup(pool.shutdown)
+        store = Store([DummyFinder(((0, 30, 10), [1, 2, 3])),
+                       DummyFinder(((0, 30, 10), [4, 5, 6]))],
+                      multi_fetch_pool=pool, first_sufficient=True)
+        node, = store.find('foo')
+        self.assertIs(node.reader.fetch_pool, pool)
+        self.assertTrue(node.reader.first_sufficient)
@@ -3,8 +3,12 @@
 import json
 import os
 import time
+from unittest.mock import patch
 
 from graphite_render._vendor import whisper
+from graphite_render.app import app
+from graphite_render.finders.whisper import WhisperReader
+from graphite_render.pool import FetchPool
 
 from . import TestCase, WHISPER_DIR
 
@@ -288,6 +292,54 @@ class RenderTest(TestCase):
         self.assertEqual(path, 'test')
         self.assertEqual(int(step), 1)
 
+    def test_array_series(self):
+        self.create_db()
+        query = {'target': ['test', 'scale(test, 2)'], 'format': 'json',
+                 'from': self.ts - 30, 'until': self.ts, 'noCache': 'true'}
+        expected = json.loads(
+            self.app.get(self.url, query_string=query).data.decode('utf-8'))
+        with patch.dict(app.config['GRAPHITE']['render'],
+                        {'array_series': True}):
+            response = self.app.get(self.url, query_string=query)
+        self.assertEqual(json.loads(response.data.decode('utf-8')), expected)
+
+    def test_fetch_pool(self):
+        self.create_db()
+        whisper.create(os.path.join(WHISPER_DIR, 'test2.wsp'), [(1, 60)])
+        query = {'target': ['test*'], 'format': 'json',
+                 'from': self.ts - 30, 'until': self.ts, 'noCache': 'true'}
+        expected = json.loads(
+            self.app.get(self.url, query_string=query).data.decode('utf-8'))
+        self.assertEqual(len(expected), 2)
+        pool = FetchPool(4, max_workers_per_key=2)
+        try:
+            with patch.dict(app.config['GRAPHITE'], {'fetch_pool': pool}):
+                response = self.app.get(self.url, query_string=query)
+        finally:
+            pool.shutdown()
+        self.assertEqual(json.loads(response.data.decode('utf-8')), expected)
+
+    def test_stream_json(self):
+        self.create_db()
+        queries = [
+            {'target': ['test', 'scale(test, 2)', 'alias(test, "é")']},
+            {'target': 'test', 'maxDataPoints': 5},
+            {'target': 'test', 'noNullPoints': 1},
+            {'target': 'test', 'jsonp': 'foo'},
+            {'target': 'nonexistent'},
+        ]
+        for query in queries:
+            query.update({'format': 'json', 'noCache': 'true',
+                          'from': self.ts - 30, 'until': self.ts})
+            expected = self.app.get(self.url, query_string=query)
+            with patch.dict(app.config['GRAPHITE']['render'],
+                            {'stream_json': True}):
+                response = self.app.get(self.url, query_string=query)
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(response.data, expected.data)
+            self.assertEqual(response.headers['Content-Type'],
+                             expected.headers['Content-Type'])
+
     def test_jsonp(self):
         whisper.create(self.db, [(1, 60)])
 
@@ -370,3 +422,34 @@ class RenderTest(TestCase):
             response = self.app.get(self.url, query_string=query)
             data = json.loads(response.data.decode('utf-8'))
             self.assertEqual(data[0]['target'], expected)
+
+    def test_preview_fetches(self):
+        self.create_db()
+        for i in range(3, 40):
+            whisper.update(self.db, i, self.ts - i)
+        query = {'format': 'json', 'noCache': 'true',
+                 'from': self.ts - 30, 'until': self.ts}
+        fetch = WhisperReader.fetch
+        results = {}
+        for target, fetches in [
+            ('movingAverage(test, "5s")', 1),
+            ('movingAverage(test, 5)', 2),
+            ('movingSum(test, "5s")', 1),
+            ('movingSum(test, 5)', 2),
+            ('sumSeries(test, movingMax(test, "5s"))', 2),
+            ('movingMax(movingMax(test, "5s"), "5s")', 1),
+            ('holtWintersForecast(test)', 1),
+        ]:
+            query['target'] = target
+            with patch.object(WhisperReader, 'fetch', autospec=True,
+                              side_effect=fetch) as patched:
+                response = self.app.get(self.url, query_string=query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(patched.call_count, fetches, target)
+            data = json.loads(response.data.decode('utf-8'))
+            results[target] = [point[0] for point in data[0]['datapoints']]
+        self.assertTrue(any(results['movingAverage(test, "5s")']))
+        self.assertEqual(results['movingAverage(test, "5s")'],
+                         results['movingAverage(test, 5)'])
+        self.assertEqual(results['movingSum(test, "5s")'],
+                         results['movingSum(test, 5)'])
@@ -1,4 +1,12 @@
-from graphite_render.render.datalib import nonempty, TimeSeries
+import copy
+import threading
+import time
+from array import array
+
+from graphite_render.render.datalib import (ArrayTimeSeries, consolidate,
+                                            DataStore, nonempty, seriesStats,
+                                            TimeSeries)
+from graphite_render.pool import FetchPool
 
 from . import TestCase
 
@@ -123,6 +131,13 @@ class TimeSeriesTest(TestCase):
                               0, 5, 1, list(range(0, 100, 2)) + [None])
         self.assertEqual(list(series), list(expected))
 
+    def test_TimeSeries_iterate_valuesPerPoint_3_last(self):
+        values = [1, 2, 3, 4, None, None, None, None, None, 10]
+        series = TimeSeries("collectd.test-db.load.value",
+                            0, 10, 1, values, consolidate='last')
+        series.consolidate(3)
+        self.assertEqual(list(series), [3, 4, None, 10])
+
     def test_TimeSeries_iterate_valuesPerPoint_2_invalid(self):
         values = range(0, 100)
         series = TimeSeries("collectd.test-db.load.value",
@@ -133,8 +148,145 @@ class TimeSeriesTest(TestCase):
         with self.assertRaises(Exception):
             list(series)
 
+    def test_TimeSeries_stats(self):
+        series = TimeSeries("collectd.test-db.load.value",
+                            0, 5, 1, [1, None, 3, 2, None])
+        stats = series.stats()
+        self.assertEqual((stats.sum, stats.count, stats.min, stats.max,
+                          stats.mean, stats.last), (6, 3, 1, 3, 2.0, 2))
+        self.assertIs(series.stats(), stats)
+        self.assertIs(seriesStats(series), stats)
+
+        series.append(4)
+        self.assertEqual(series.stats().last, 4)
+        series[0] = 10
+        self.assertEqual(series.stats().max, 10)
+        series.pop()
+        series.append(None)
+        self.assertEqual(series.stats().last, 2)
+        series.consolidate(2)
+        self.assertEqual(series.stats().count, 2)
+        self.assertEqual(series.stats().sum, 12.5)
+        # The current value isn't consolidated
+        self.assertEqual(series.stats().last, 2)
+        series.consolidationFunc = 'sum'
+        self.assertEqual(series.stats().sum, 15)
+
+    def test_TimeSeries_stats_empty(self):
+        series = TimeSeries("collectd.test-db.load.value",
+                            0, 2, 1, [None, None])
+        stats = series.stats()
+        self.assertEqual(stats.count, 0)
+        for name in ('sum', 'min', 'max', 'mean', 'last'):
+            self.assertIsNone(getattr(stats, name))
+        self.assertEqual(seriesStats([None, 2]).sum, 2)
+
+
+class ArrayTimeSeriesTest(TestCase):
+    def test_ArrayTimeSeries_buffer(self):
+        series = ArrayTimeSeries("collectd.test-db.load.value",
+                                 0, 4, 1, [1, None, 3, None])
+        self.assertIsInstance(series.buffer, array)
+        self.assertEqual(series.buffer.typecode, 'd')
+        self.assertEqual(len(series), 4)
+        self.assertEqual(list(series), [1.0, None, 3.0, None])
+
+    def test_ArrayTimeSeries_list_api(self):
+        series = ArrayTimeSeries("collectd.test-db.load.value",
+                                 0, 4, 1, [1, None, 3, None])
+        self.assertEqual(series[1], None)
+        self.assertEqual(series[-2], 3.0)
+        self.assertEqual(series[1:3], [None, 3.0])
+        self.assertIn(None, series)
+        self.assertIn(3, series)
+        self.assertEqual(list(reversed(series)), [None, 3.0, None, 1.0])
+        self.assertEqual(series.count(None), 2)
+        self.assertEqual(series.index(3), 2)
+
+        series[0] = None
+        series[1] = 2
+        series.append(None)
+        series.extend([5, None])
+        del series[:1]
+        self.assertEqual(list(series), [2.0, 3.0, None, None, 5.0, None])
+        self.assertEqual(series.pop(), None)
+        self.assertEqual(len(series), 5)
+
+    def test_ArrayTimeSeries_equal_TimeSeries(self):
+        values = [1, None, 3, None]
+        series = ArrayTimeSeries("collectd.test-db.load.value",
+                                 0, 4, 1, values)
+        expected = TimeSeries("collectd.test-db.load.value",
+                              0, 4, 1, values)
+        self.assertEqual(series, expected)
+        self.assertEqual(expected, series)
+        expected[0] = 2
+        self.assertNotEqual(series, expected)
+
+    def test_ArrayTimeSeries_consolidate(self):
+        values = [0, 1, None, None, 4, None, 6]
+        series = ArrayTimeSeries("collectd.test-db.load.value",
+                                 0, 7, 1, values)
+        series.consolidate(2)
+        self.assertEqual(list(series), [0.5, None, 4.0, 6.0])
+
+    def test_ArrayTimeSeries_stats(self):
+        series = ArrayTimeSeries("collectd.test-db.load.value",
+                                 0, 3, 1, [1, None, 3])
+        self.assertEqual(series.stats().max, 3.0)
+        series[1] = 5
+        self.assertEqual(series.stats().max, 5.0)
+        series.reverse()
+        self.assertEqual(series.stats().last, 1.0)
+
+    def test_ArrayTimeSeries_copy(self):
+        series = ArrayTimeSeries("collectd.test-db.load.value",
+                                 0, 3, 1, [1, None, 3])
+        series.color = 'white'
+        for copied in (copy.copy(series), copy.deepcopy(series)):
+            self.assertEqual(series, copied)
+            copied[0] = 2
+            self.assertEqual(series[0], 1)
+
+    def test_DataStore_array_series(self):
+        data_store = DataStore(array_series=True)
+        data_store.add_data('foo', (0, 3, 1), [1, None, 3], ['foo'])
+        data_store.add_data('foo', (0, 3, 1), [None, None, None], ['foo'])
+        series_list = data_store.get_series_list('foo')
+        self.assertEqual(len(series_list), 1)
+        series = series_list[0]
+        self.assertIsInstance(series, ArrayTimeSeries)
+        self.assertEqual(list(series), [1.0, None, 3.0])
+
+        # Series don't share the stored buffer
+        series[0] = None
+        self.assertEqual(data_store.get_series_list('foo')[0][0], 1.0)
+
+        # Buffers returned by readers are stored as is
+        buffer = array('d', [1, 2])
+        data_store.add_data('bar', (0, 2, 1), buffer, ['bar'])
+        self.assertIs(data_store.data['bar'][0]['values'], buffer)
+        series = data_store.get_series_list('bar')[0]
+        series[0] = None
+        self.assertEqual(buffer[0], 1)
+
 
 class DatalibFunctionTest(TestCase):
+    def test_consolidate(self):
+        values = [1, None, 3, 4, None, None, 7]
+        self.assertEqual(consolidate(values, 2), [1.0, 3.5, None, 7.0])
+        self.assertEqual(consolidate(values, 2, 'sum'), [1, 7, None, 7])
+        self.assertEqual(consolidate(values, 3, 'max'), [3, 4, 7])
+        self.assertEqual(consolidate(values, 3, 'min'), [1, 4, 7])
+        self.assertEqual(consolidate(values, 7), [3.75, None])
+        self.assertEqual(consolidate([], 2), [None])
+
+    def test_consolidate_invalid(self):
+        self.assertEqual(consolidate([None, None], 2, 'bogus'),
+                         [None, None])
+        with self.assertRaises(Exception):
+            consolidate([1, None], 2, 'bogus')
+
     def test_nonempty_true(self):
         values = range(0, 100)
         series = TimeSeries("collectd.test-db.load.value",
@@ -149,3 +301,54 @@ class DatalibFunctionTest(TestCase):
         series = TimeSeries("collectd.test-db.load.value",
                             0, 4, 1, [None, None, None, None])
         self.assertFalse(nonempty(series))
+
+    def test_nonempty_array(self):
+        self.assertTrue(nonempty(array('d', [float('nan'), 1])))
+        self.assertFalse(nonempty(array('d', [float('nan')])))
+
+
+class FetchPoolTest(TestCase):
+    def test_map_order(self):
+        pool = FetchPool(4)
+        try:
+            self.assertEqual(pool.map(lambda x: x * 2, range(20)),
+                             list(range(0, 40, 2)))
+            self.assertEqual(pool.map(lambda x: x, []), [])
+        finally:
+            pool.shutdown()
+
+    def test_map_exception(self):
+        def fetch(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        pool = FetchPool(4)
+        try:
+            with self.assertRaises(ValueError):
+                pool.map(fetch, range(5))
+        finally:
+            pool.shutdown()
+
+    def test_max_workers_per_key(self):
+        lock = threading.Lock()
+        running = {'a': 0, 'b': 0}
+        peaks = {'a': 0, 'b': 0}
+
+        def fetch(key):
+            with lock:
+                running[key] += 1
+                peaks[key] = max(peaks[key], running[key])
+            time.sleep(0.01)
+            with lock:
+                running[key] -= 1
+            return key
+
+        pool = FetchPool(8, max_workers_per_key=2)
+        try:
+            keys = ['a', 'b'] * 8
+            self.assertEqual(pool.map(fetch, keys, key=lambda k: k), keys)
+        finally:
+            pool.shutdown()
+        self.assertLessEqual(peaks['a'], 2)
+        self.assertLessEqual(peaks['b'], 2)
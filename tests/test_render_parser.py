@@ -0,0 +1,244 @@
+import os
+import random
+import time
+from unittest.mock import patch
+
+from pyparsing import ParseException
+
+from graphite_render._vendor import whisper
+from graphite_render.app import app
+from graphite_render.render.grammar import grammar
+from graphite_render.render.parser import (get_parser, parse, ParseError,
+                                           Tokens)
+
+from . import TestCase, WHISPER_DIR
+
+TARGETS = [
+    'a.b.c',
+    '  a.b.c',
+    'a.b  c',
+    'a.b.',
+    '.a',
+    'a.*.b?[c-d]',
+    'a.{b,c}.d',
+    'a.x{b,c}y{d}.e',
+    'a.{b,c',
+    'a.{}.b',
+    'a.{b{c,d}}.e',
+    'a:b#c.d@e',
+    r'a\.b{c,d}x.*',
+    r'a\(b\)\\c',
+    r'a\x',
+    '1.5',
+    '-1',
+    '1.2.3',
+    'sum(a.b)',
+    'sum (a.b)',
+    'sum( a.b , c.d )',
+    'f()',
+    'f( )',
+    'f(a,)',
+    'f(,a)',
+    'f(a)(b)',
+    'f(a) trailing',
+    'f.g(a)',
+    'f(a',
+    'f(g(h(a.b), 1), i(c))',
+    'f(1, 2.5, -3, -4.25, 1e5, 1.5E-3, -2e+1, 1e-5)',
+    'f(1 ,2 )',
+    'f(1\n)',
+    'f(1\n',
+    'f(1',
+    'f(1.)',
+    'f(1.e5)',
+    'f(1e5x)',
+    'f(1.b)',
+    'f(01)',
+    'f(true, false, TRUE, False)',
+    'f(truex)',
+    'f(true.x)',
+    'f(true_)',
+    'f(true$)',
+    'f(a, "x", \'y\')',
+    'f("a, b")',
+    'f("a\\"b")',
+    "f('a\\'b')",
+    'f("a""b")',
+    'f("a"")',
+    'f("a\nb")',
+    'f("a\\x41")',
+    'f("a\\xZ")',
+    'f("unterminated)',
+    'f(a, k=1)',
+    'f(a, k = 1)',
+    'f(k=1)',
+    'f(a, k=1, 2)',
+    'f(a, k=1, j="x", l=g(b), m=true)',
+    'f(a, k=)',
+    'f(a=, 1)',
+    'f(a == 1)',
+    'f(a.b=1)',
+    'f(1, a.b)',
+    'template(a.$x)',
+    'template(a.$x, 1)',
+    'template(a.$x, "b")',
+    'template(a.$x, "b", 2.5)',
+    'template(a.$x, x="b")',
+    'template(a.$x, x="b", y=1)',
+    'template(a.$x, 1, x="b")',
+    'template(a.$x, f(x))',
+    'template(a.$x, true)',
+    'template(sum(a.$x), x="b")',
+    'template ( a.$x , x = "b" )',
+    'template(a.$x,)',
+    'templates(a.b)',
+    'template.a.b',
+    'sum(template(a.$x, x="b"))',
+    'é',
+    '',
+    '   ',
+    '(',
+    ')',
+    ',',
+]
+
+NAMES = ('expression', 'template', 'call', 'pathExpression', 'funcname',
+         'argname', 'number', 'integer', 'float', 'string')
+LISTS = ('args', 'kwargs')
+FIRSTS = ('boolean', 'scientific')
+
+
+def normalize(tokens):
+    """Turns parse results into plain data to compare parsers."""
+    if isinstance(tokens, str):
+        return tokens
+    normalized = {}
+    for name in NAMES + LISTS + FIRSTS:
+        value = getattr(tokens, name)
+        if isinstance(value, str) and value == '':
+            continue
+        if name in LISTS:
+            value = [normalize(item) for item in value]
+        elif name in FIRSTS:
+            value = value[0]
+        else:
+            value = normalize(value)
+        normalized[name] = value
+    return normalized
+
+
+CHUNKS = [
+    'a', 'b1', 'g_', 'x.', '.', ',', '(', ')', '{', '}', '=', ' ', '*', '?',
+    '[', ']', '-', '$', '\\', '"', "'", '1', '2.5', 'e', 'E', 'true',
+    'False', 'template', '\n',
+]
+
+
+def random_target(rng, depth=0):
+    """Generates a random, mostly valid, target."""
+    choice = rng.randint(0, 9 if depth < 3 else 3)
+    if choice == 0:
+        return rng.choice(['1', '-2', '3.5', '1e5', '2.5E-1', '"s"', "'t'",
+                           'true', 'FALSE'])
+    if choice <= 3:
+        return '.'.join(rng.choice(['a', 'b*', '{c,d}', 'e{f,g}h', r'i\.j',
+                                    '$x', '[k-l]'])
+                        for _ in range(rng.randint(1, 3)))
+    args = [random_target(rng, depth + 1)
+            for _ in range(rng.randint(0, 3))]
+    args.extend('{0}={1}'.format(rng.choice(['k', 'l']),
+                                 random_target(rng, depth + 1))
+                for _ in range(rng.randint(0, 2)))
+    name = 'template' if choice == 9 else rng.choice(['f', 'sum', 'g_1'])
+    return '{0}({1})'.format(name, rng.choice([',', ', ', ' , ']).join(args))
+
+
+def reference(target):
+    try:
+        return normalize(grammar.parse_string(target))
+    except ParseException:
+        return None
+
+
+def candidate(target):
+    try:
+        return normalize(parse(target))
+    except ParseError:
+        return None
+
+
+class ParserTest(TestCase):
+    def assertConforms(self, target):
+        self.assertEqual(candidate(target), reference(target),
+                         'target: {0!r}'.format(target))
+
+    def test_targets(self):
+        for target in TARGETS:
+            self.assertConforms(target)
+
+    def test_random_targets(self):
+        rng = random.Random(42)
+        for _ in range(1000):
+            target = random_target(rng)
+            for _ in range(rng.randint(0, 2)):
+                # Garble the target a bit
+                pos = rng.randint(0, len(target))
+                target = (target[:pos] + rng.choice(CHUNKS) +
+                          target[pos + rng.randint(0, 2):])
+            self.assertConforms(target)
+
+    def test_tokens(self):
+        tokens = parse('sum(a.b, 1.5e3, k=true)').expression.call
+        self.assertEqual(tokens.funcname, 'sum')
+        self.assertEqual(tokens.args[0].expression.pathExpression, 'a.b')
+        self.assertEqual(tokens.args[1].number.scientific[0], '1.5e3')
+        self.assertEqual(tokens.args[1].number.integer, '')
+        self.assertEqual(tokens.kwargs[0].argname, 'k')
+        self.assertEqual(tokens.kwargs[0].args[0].boolean[0], 'true')
+        self.assertEqual(parse('f()').expression.call.args, '')
+        self.assertIsInstance(tokens, Tokens)
+        with self.assertRaises(AttributeError):
+            tokens.__deepcopy__
+
+    def test_parse_error(self):
+        with self.assertRaises(ParseError) as context:
+            parse('  (a)')
+        self.assertEqual(context.exception.pos, 2)
+        self.assertIsInstance(context.exception, ValueError)
+
+    def test_get_parser(self):
+        self.assertIs(get_parser('fast'), parse)
+        self.assertEqual(get_parser('pyparsing'), grammar.parse_string)
+        with self.assertRaises(ValueError):
+            get_parser('unknown')
+
+    def test_render(self):
+        ts = int(time.time())
+        for path in ('test', 'hosts/worker1/cpu'):
+            db = os.path.join(WHISPER_DIR, path + '.wsp')
+            os.makedirs(os.path.dirname(db), exist_ok=True)
+            whisper.create(db, [(1, 60)])
+            for i in range(5):
+                whisper.update(db, i, ts - i)
+
+        targets = [
+            'sum(test)',
+            'template(sumSeries(hosts.$hostname.cpu), hostname="worker1")',
+            'movingAverage(test, 2)',
+            'aliasByNode(test, 0)',
+            'legendValue(test, "avg")',
+            'sortByName(test)',
+            'asPercent(test, 10)',
+        ]
+        for target in targets:
+            responses = []
+            for name in ('pyparsing', 'fast'):
+                with patch.dict(app.config['GRAPHITE'],
+                                {'parser': get_parser(name)}):
+                    response = self.app.get('/render', query_string={
+                        'target': target, 'format': 'json',
+                        'from': ts - 10, 'until': ts})
+                self.assertEqual(response.status_code, 200)
+                responses.append(response.data)
+            self.assertNotEqual(responses[0], b'[]')
+            self.assertEqual(responses[0], responses[1])
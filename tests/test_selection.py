@@ -0,0 +1,36 @@
+import random
+
+from graphite_render.selection import highest, largest, lowest
+
+from . import TestCase
+
+
+def none_first(key):
+    return lambda item: (key(item) is not None, key(item) or 0)
+
+
+class SelectionTest(TestCase):
+    def test_random(self):
+        rng = random.Random(42)
+        for _ in range(500):
+            items = [(i, rng.choice([None, 0, 1, 1.0, 2, rng.random()]))
+                     for i in range(rng.randint(0, 20))]
+
+            def key(item):
+                return item[1]
+            for n in range(-3, len(items) + 3):
+                msg = 'items: {0!r}, n: {1}'.format(items, n)
+                ordered = sorted(items, key=none_first(key))
+                self.assertEqual(highest(items, n, key), ordered[-n:], msg)
+                self.assertEqual(lowest(items, n, key), ordered[:n], msg)
+                ordered = sorted(items, key=none_first(key), reverse=True)
+                self.assertEqual(largest(items, n, key), ordered[:n], msg)
+
+    def test_keys_computed_once(self):
+        calls = []
+
+        def key(item):
+            calls.append(item)
+            return item
+        self.assertEqual(highest([3, 1, 2], 2, key), [2, 3])
+        self.assertEqual(calls, [3, 1, 2])
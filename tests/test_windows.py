@@ -0,0 +1,69 @@
+import random
+
+from graphite_render.windows import (moving_average, moving_max,
+                                     moving_median, moving_min, moving_sum)
+
+from . import TestCase
+
+
+def reference(values, points, aggregate):
+    """The moving* functions as they were, rescanning every window."""
+    results = []
+    for i in range(points, len(values)):
+        window = [v for v in values[i - points:i] if v is not None]
+        results.append(aggregate(window) if window else None)
+    return results
+
+
+def median(window):
+    return sorted(window)[len(window) // 2]
+
+
+class WindowsTest(TestCase):
+    def random_values(self, rng):
+        values = []
+        for _ in range(rng.randint(0, 50)):
+            choice = rng.random()
+            if choice < 0.3:
+                values.append(None)
+            elif choice < 0.6:
+                values.append(rng.randint(-3, 3))
+            else:
+                values.append(float(rng.randint(-3, 3)))
+        return values
+
+    def assertSameValues(self, result, expected, msg):
+        self.assertEqual(result, expected, msg)
+        # Equal ints and floats are rendered differently
+        self.assertEqual([type(v) for v in result],
+                         [type(v) for v in expected], msg)
+
+    def test_random(self):
+        rng = random.Random(42)
+        for _ in range(500):
+            values = self.random_values(rng)
+            points = rng.randint(1, len(values) + 2)
+            msg = 'values: {0!r}, points: {1}'.format(values, points)
+            self.assertSameValues(moving_min(values, points),
+                                  reference(values, points, min), msg)
+            self.assertSameValues(moving_max(values, points),
+                                  reference(values, points, max), msg)
+            self.assertSameValues(moving_median(values, points),
+                                  reference(values, points, median), msg)
+
+    def test_empty_window(self):
+        values = [1, None, 3]
+        for kernel in (moving_min, moving_max, moving_median):
+            self.assertEqual(kernel(values, 0), [None, None, None])
+            self.assertEqual(kernel(values, 1), [1, None])
+            self.assertEqual(kernel([], 2), [])
+
+    def test_sum_average(self):
+        values = [None, 1, 2, None, 4, None, None, None, 5]
+        self.assertEqual(moving_sum(values, 3),
+                         [3, 3, 6, 4, 4, 0])
+        self.assertEqual(moving_average(values, 3),
+                         [1.5, 1.5, 3.0, 4.0, 4.0, None])
+        self.assertEqual(moving_sum([None, None], 3), [None])
+        self.assertEqual(moving_average([None, None], 3), [None])
+        self.assertEqual(moving_sum([1, 2], 3), [3])